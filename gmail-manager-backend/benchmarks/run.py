@@ -0,0 +1,232 @@
+"""
+Benchmarks for the GmailService hot paths, run against the in-process fake Gmail API
+(src/fake_gmail.py through FakeHttp: no network, no account, deterministic mailboxes).
+
+    python -m benchmarks.run                          # compare with benchmarks/baselines.json
+    python -m benchmarks.run --sizes 1000,200000      # other mailbox sizes
+    python -m benchmarks.run --large                  # also 100k and 200k messages (slow)
+    python -m benchmarks.run --update-baseline        # record the current numbers as baselines
+    python -m benchmarks.run --check-time             # also gate on wall time (same machine only)
+
+For every case and mailbox size it records the wall time (best of --repeat runs), the
+Gmail API calls and HTTP requests the fake received, the quota units taken, and the
+peak traced Python memory (one extra run under tracemalloc; the in-process fake's own
+allocations are included). Background work a case triggers, such as exact counts, is
+awaited and counted in its calls, not in its wall time.
+
+The benchmarked service never uses the local metadata store or the disk cache, and its
+quota limiter is effectively unlimited. This is set on the instance rather than through
+the environment, so it holds when src was imported first (as under pytest). The numbers
+reflect the Gmail-facing code paths rather than quota pacing; the quota units show what
+the same run would cost against the real per-user budget.
+
+Exits with status 1 when a case regresses past a threshold: more calls, HTTP requests or
+quota units than the baseline, or peak memory above baseline * (1 + tolerance). These are
+deterministic for a given tree. Wall time depends on the machine, so it is only gated
+with --check-time, against baselines recorded on the same machine (--update-baseline).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+from src.client_pool import GmailClientPool
+from src.detail_cache import EmailDetailCache
+from src.fake_gmail import FakeGmailServer, FakeHttp, FakeMailbox
+from src.gmail_service import GmailService
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_SIZES = (1000, 10000)
+# Added by --large: the mailbox sizes the service has to hold up to.
+LARGE_SIZES = (100000, 200000)
+# Quota rate and burst of the benchmarked service: pacing never kicks in.
+UNLIMITED_UNITS = 10 ** 9
+
+PAGE_SIZE = 25
+PAGE_N = 5
+# Most frequent sender of the synthetic mailbox.
+QUERY_SENDER = "user1@sender1.example"
+BATCH_IDS = 1000
+BATCH_ACTIONS = ("archive", "trash", "assign_labels", "mark_read", "mark_unread")
+
+
+def page_token_for(gmail: GmailService, page: int) -> str:
+    token = None
+    for _ in range(page - 1):
+        token = gmail.list_emails(['INBOX'], page_token=token, max_results=PAGE_SIZE)['next_page_token']
+    return token
+
+
+def batch_case(action: str):
+    def run(gmail, ctx):
+        result = gmail.perform_batch_action(action, ids=ctx["batch_ids"], add_labels=["Project 1"])
+        assert not result["failed"], result["failed"][:3]
+    return run
+
+
+# name -> (run(gmail, ctx), whether it changes the mailbox)
+CASES = {
+    "list_emails_page_1": (lambda gmail, ctx: gmail.list_emails(['INBOX'], max_results=PAGE_SIZE), False),
+    f"list_emails_page_{PAGE_N}": (
+        lambda gmail, ctx: gmail.list_emails(['INBOX'], page_token=ctx["page_n_token"], max_results=PAGE_SIZE), False
+    ),
+    "list_emails_query": (
+        lambda gmail, ctx: gmail.list_emails(['INBOX'], max_results=PAGE_SIZE, from_sender=QUERY_SENDER), False
+    ),
+    "get_email_ids": (lambda gmail, ctx: gmail.get_email_ids(['INBOX']), False),
+    "count_messages": (lambda gmail, ctx: gmail._count_messages('category:primary is:unread', ['INBOX']), False),
+    "get_subject_counts_sample": (lambda gmail, ctx: gmail.get_subject_counts(['INBOX'], limit=200), False),
+    "get_subject_counts_exact": (lambda gmail, ctx: gmail.get_subject_counts(['INBOX'], mode="exact"), False),
+    "get_full_dashboard_data": (
+        lambda gmail, ctx: gmail.get_full_dashboard_data(['INBOX', 'CATEGORY_PERSONAL']), False
+    ),
+    **{f"batch_{action}": (batch_case(action), True) for action in BATCH_ACTIONS},
+}
+
+
+def new_service(server: FakeGmailServer) -> GmailService:
+    """A GmailService on `server`, without local store, disk cache or quota pacing."""
+    gmail = GmailService()
+    gmail.metadata_store = None
+    gmail.detail_cache = gmail.prefetcher.cache = EmailDetailCache(disk_dir=None)
+    gmail.quota.reconfigure(UNLIMITED_UNITS)
+    gmail.client_pool = GmailClientPool(api_root="http://fake-gmail", anonymous=True, http_factory=lambda: FakeHttp(server))
+    gmail.client_pool.get()  # Parse the discovery document outside the measurement.
+    return gmail
+
+
+def close_service(gmail: GmailService):
+    """Waits for background work (exact counts) and releases the worker threads."""
+    gmail.counter._executor.shutdown(wait=True)
+    gmail.metadata_fetcher._executor.shutdown(wait=True)
+
+
+def measure(server: FakeGmailServer, run, mutates: bool, ctx: dict, trace_memory: bool) -> dict:
+    gmail = new_service(server)
+    snapshot = server.mailbox.snapshot() if mutates else None
+    server.reset_stats()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        run(gmail, ctx)
+        wall = time.perf_counter() - started
+        close_service(gmail)
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        if snapshot is not None:
+            server.mailbox.restore(snapshot)
+    return {
+        "wall_s": wall,
+        "gmail_calls": server.stats["calls"],
+        "http_requests": server.stats["http_requests"],
+        "quota_units": gmail.quota.metrics()["units_total"],
+        "peak_kib": peak // 1024 if peak is not None else None,
+    }
+
+
+def run_size(size: int, cases: list, repeat: int, seed: int = 0) -> dict:
+    started = time.perf_counter()
+    server = FakeGmailServer(FakeMailbox(size=size, seed=seed))
+    setup = new_service(server)
+    ctx = {
+        "page_n_token": page_token_for(setup, PAGE_N),
+        "batch_ids": server.mailbox.search(['INBOX'])[:BATCH_IDS],
+    }
+    close_service(setup)
+    logging.info(f"Mailbox of {size} messages ready in {time.perf_counter() - started:.1f}s.")
+
+    results = {}
+    for name in cases:
+        run, mutates = CASES[name]
+        runs = [measure(server, run, mutates, ctx, trace_memory=False) for _ in range(repeat)]
+        result = min(runs, key=lambda r: r["wall_s"])
+        result["wall_s"] = round(result["wall_s"], 4)
+        result["peak_kib"] = measure(server, run, mutates, ctx, trace_memory=True)["peak_kib"]
+        results[name] = result
+        print(f"{size:>7} {name:<28} {result['wall_s']:>9.4f}s {result['gmail_calls']:>7} calls "
+              f"{result['http_requests']:>6} http {result['quota_units']:>8} units {result['peak_kib']:>8} KiB")
+    return results
+
+
+def compare(results: dict, baselines: dict, time_tolerance: float, memory_tolerance: float,
+            min_time_delta: float = 0.005, check_time: bool = False) -> list:
+    """
+    Returns a description of every regression of `results` against `baselines`.
+    Wall time is only compared with `check_time`.
+    """
+    regressions = []
+    for size, cases in results.items():
+        for name, result in cases.items():
+            baseline = baselines.get(size, {}).get(name)
+            if baseline is None:
+                continue
+            label = f"{name} @ {size}"
+            for key in ("gmail_calls", "http_requests", "quota_units"):
+                if result[key] > baseline[key]:
+                    regressions.append(f"{label}: {key} {baseline[key]} -> {result[key]}")
+            if check_time and result["wall_s"] > baseline["wall_s"] * (1 + time_tolerance) \
+                    and result["wall_s"] - baseline["wall_s"] > min_time_delta:
+                regressions.append(f"{label}: wall time {baseline['wall_s']}s -> {result['wall_s']}s")
+            if result["peak_kib"] > baseline["peak_kib"] * (1 + memory_tolerance):
+                regressions.append(f"{label}: peak memory {baseline['peak_kib']} KiB -> {result['peak_kib']} KiB")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="GmailService benchmarks against the fake Gmail API.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated mailbox sizes.")
+    parser.add_argument("--large", action="store_true", help=f"Also run {', '.join(map(str, LARGE_SIZES))} messages.")
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma-separated case names.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (the best one counts).")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baselines.")
+    parser.add_argument("--check-time", action="store_true",
+                        help="Also fail on wall time regressions (baselines must come from this machine).")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="Allowed relative wall time increase (--check-time).")
+    parser.add_argument("--memory-tolerance", type=float, default=0.5, help="Allowed relative peak memory increase.")
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    cases = [name for name in args.cases.split(",") if name]
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    if args.large:
+        sizes += [size for size in LARGE_SIZES if size not in sizes]
+    results = {str(size): run_size(size, cases, args.repeat) for size in sizes}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.update_baseline:
+        for size, cases_results in results.items():
+            baselines.setdefault(size, {}).update(cases_results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written to {args.baseline}.")
+        return 0
+
+    regressions = compare(results, baselines, args.time_tolerance, args.memory_tolerance, check_time=args.check_time)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions against the baselines.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from urllib.parse import urlencode
+
+import httpx
+import httplib2
+from googleapiclient.errors import HttpError
+
+from . import metrics, request_usage
+from .batch_scheduler import MAX_BATCH_SIZE, is_retryable_error
+from .quota import TokenBucket, units_for
+
+GOOGLE_API_ROOT = "https://gmail.googleapis.com"
+
+# Path prefix of every users.* method; callers pass paths relative to it.
+USER_PATH = "/gmail/v1/users/me/"
+
+BATCH_PATH = "/batch/gmail/v1"
+
+BOUNDARY_PATTERN = re.compile(r'boundary="?([^";]+)"?')
+CONTENT_ID_PATTERN = re.compile(r'^content-id:\s*<response-item-(\d+)>', re.IGNORECASE | re.MULTILINE)
+
+
+def http_error(status: int, content: bytes, uri: str) -> HttpError:
+    """Builds the googleapiclient HttpError the synchronous client would have raised."""
+    return HttpError(httplib2.Response({"status": status}), content, uri=uri)
+
+
+def build_batch_body(calls: list, boundary: str) -> str:
+    """
+    Encodes GET calls as a multipart/mixed batch request body.
+    `calls` is a list of (path, params); parts are numbered in order ("item-0", "item-1", ...).
+    """
+    parts = []
+    for index, (path, params) in enumerate(calls):
+        query = f"?{urlencode(params, doseq=True)}" if params else ""
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item-{index}>\r\n\r\n"
+            f"GET {USER_PATH}{path}{query} HTTP/1.1\r\n\r\n"
+        )
+    return "".join(parts) + f"--{boundary}--\r\n"
+
+
+def parse_batch_response(content_type: str, body: bytes) -> dict:
+    """Splits a multipart/mixed batch response into {part index: (status, payload bytes)}."""
+    match = BOUNDARY_PATTERN.search(content_type or "")
+    if match is None:
+        raise ValueError(f"Batch response without a multipart boundary: {content_type!r}")
+    results = {}
+    text = body.decode("utf-8").replace("\r\n", "\n")
+    for part in text.split(f"--{match.group(1)}"):
+        outer, _, http = part.strip().partition("\n\n")
+        content_id = CONTENT_ID_PATTERN.search(outer)
+        if content_id is None or not http:
+            continue
+        status_line, _, rest = http.partition("\n")
+        _, _, payload = rest.partition("\n\n")
+        results[int(content_id.group(1))] = (int(status_line.split()[1]), payload.strip().encode("utf-8"))
+    return results
+
+
+class AsyncGmailTransport:
+    """
+    asyncio counterpart of the googleapiclient clients, for the REST and batch endpoints.
+
+    All requests share one pooled httpx.AsyncClient (created per event loop), so the number
+    of concurrent calls is bounded by the connection pool and the shared quota bucket, not
+    by threads. Quota is taken with `acquire_async`; 429/5xx responses and transport errors
+    are retried with exponential backoff. Errors surface as googleapiclient HttpError, so
+    callers handle them exactly like errors from the synchronous client.
+
+    `credentials()` returns valid OAuth credentials (GmailClientPool.credentials); it may
+    block while refreshing, so it only runs in a worker thread once the cached token expires.
+    """
+
+    def __init__(self, credentials, bucket: TokenBucket, api_root: str = None,
+                 max_connections: int = 100, timeout: float = 30, max_attempts: int = 5,
+                 base_backoff: float = 1.0, sleep=asyncio.sleep, http_transport: httpx.AsyncBaseTransport = None):
+        self.credentials = credentials
+        self.bucket = bucket
+        self.api_root = (api_root or GOOGLE_API_ROOT).rstrip("/")
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.sleep = sleep
+        self.http_transport = http_transport
+        self._creds = None
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_root, limits=self.limits, timeout=self.timeout, transport=self.http_transport
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+
+    async def _auth_headers(self) -> dict:
+        creds = self._creds
+        if creds is None or not creds.valid:
+            creds = self._creds = await asyncio.to_thread(self.credentials)
+        # Anonymous credentials (GMAIL_API_ANONYMOUS) carry no token.
+        return {"Authorization": f"Bearer {creds.token}"} if creds.token else {}
+
+    async def _backoff(self, attempt: int, what: str, error):
+        delay = self.base_backoff * (2 ** attempt) + random.uniform(0, self.base_backoff)
+        logging.warning(f"{what} failed ({error}); retrying in {delay:.2f}s.")
+        metrics.observe_backoff('async_transport', delay)
+        await self.sleep(delay)
+
+    async def request(self, method: str, http_method: str, path: str, params: dict = None, body: dict = None) -> dict:
+        """
+        Calls one users.* method, e.g. request('messages.get', 'GET', 'messages/123', {'format': 'full'}).
+        `method` names the API method for quota accounting. Returns the decoded JSON response.
+        """
+        url = f"{USER_PATH}{path}"
+        for attempt in range(self.max_attempts):
+            request_usage.charge()
+            await self.bucket.acquire_async(units_for(method), method=method)
+            started = time.perf_counter()
+            try:
+                response = await self._get_client().request(
+                    http_method, url, params=params, json=body, headers=await self._auth_headers()
+                )
+                request_usage.record("bytes_received", len(response.content))
+                if response.status_code < 400:
+                    metrics.observe_call(method, time.perf_counter() - started)
+                    return response.json() if response.content else {}
+                error = http_error(response.status_code, response.content, url)
+            except httpx.TransportError as e:
+                error = e
+            metrics.observe_call(method, time.perf_counter() - started, error)
+            if not (isinstance(error, httpx.TransportError) or is_retryable_error(error)) \
+                    or attempt + 1 == self.max_attempts:
+                raise error
+            await self._backoff(attempt, f"{method} {path}", error)
+
+    async def _send_batch(self, calls: list) -> dict:
+        """Sends one batch request. Returns {index: (status, payload)} for its parts."""
+        boundary = f"batch_{random.getrandbits(64):016x}"
+        response = await self._get_client().post(
+            BATCH_PATH,
+            content=build_batch_body(calls, boundary),
+            headers={**await self._auth_headers(), "Content-Type": f"multipart/mixed; boundary={boundary}"},
+        )
+        request_usage.record("bytes_received", len(response.content))
+        if response.status_code >= 400:
+            raise http_error(response.status_code, response.content, BATCH_PATH)
+        return parse_batch_response(response.headers.get("content-type"), response.content)
+
+    async def _batch_chunk(self, method: str, calls: list) -> dict:
+        """Runs up to MAX_BATCH_SIZE (request_id, path, params) calls, retrying failed parts."""
+        results = {}
+        pending = list(calls)
+        for attempt in range(self.max_attempts):
+            request_usage.charge(len(pending), batch=True)
+            await self.bucket.acquire_async(units_for(method, len(pending)), method=method)
+            started = time.perf_counter()
+            try:
+                parts = await self._send_batch([(path, params) for _, path, params in pending])
+                metrics.observe_batch(method, len(pending), time.perf_counter() - started)
+            except (HttpError, httpx.TransportError) as e:
+                metrics.observe_batch(method, len(pending), time.perf_counter() - started, e)
+                if not (isinstance(e, httpx.TransportError) or is_retryable_error(e)) or attempt + 1 == self.max_attempts:
+                    for request_id, _, _ in pending:
+                        results[request_id] = e
+                    return results
+                await self._backoff(attempt, f"Batch of {len(pending)} {method} calls", e)
+                continue
+            failed = []
+            for index, (request_id, path, params) in enumerate(pending):
+                status, payload = parts.get(index, (500, b'{"error": "missing batch part"}'))
+                if status < 400:
+                    metrics.observe_batch_part(method)
+                    results[request_id] = json.loads(payload) if payload else {}
+                    continue
+                error = results[request_id] = http_error(status, payload, f"{USER_PATH}{path}")
+                metrics.observe_batch_part(method, error)
+                if is_retryable_error(error):
+                    failed.append((request_id, path, params))
+            if not failed or attempt + 1 == self.max_attempts:
+                break
+            pending = failed
+            await self._backoff(attempt, f"{len(pending)} {method} calls in a batch", "retryable errors")
+        return results
+
+    async def batch(self, method: str, calls: list) -> dict:
+        """
+        Runs GET calls for one API method through batch requests of up to 100 calls each,
+        all chunks concurrently. `calls` is a list of (request_id, path, params).
+        Returns {request_id: decoded response, or the HttpError it failed with}.
+        """
+        chunks = [calls[i:i + MAX_BATCH_SIZE] for i in range(0, len(calls), MAX_BATCH_SIZE)]
+        results = {}
+        for chunk_results in await asyncio.gather(*(self._batch_chunk(method, chunk) for chunk in chunks)):
+            results.update(chunk_results)
+        return results
@@ -0,0 +1,229 @@
+import logging
+import random
+import time
+from collections import deque
+
+from googleapiclient.errors import HttpError
+
+from . import metrics, request_usage
+from .quota import TokenBucket, units_for
+
+# Gmail accepts at most 100 calls in one batch request.
+MAX_BATCH_SIZE = 100
+
+# users.messages.batchModify accepts at most 1000 IDs per call.
+MAX_BULK_MODIFY_IDS = 1000
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_rate_limit_error(error) -> bool:
+    """429s, and the 403 rateLimitExceeded/userRateLimitExceeded variants Gmail also uses."""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and b'ateLimitExceeded' in (error.content or b'')
+
+
+def is_retryable_error(error) -> bool:
+    if is_rate_limit_error(error):
+        return True
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    # Transport-level failures (timeouts, broken connections) are worth another try.
+    return isinstance(error, (OSError, TimeoutError))
+
+
+def is_per_message_error(error) -> bool:
+    """
+    Errors of a bulk call that may only concern some of its IDs (unknown or malformed
+    message IDs), so the IDs are worth trying one by one.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    return error.resp.status == 404 or (error.resp.status == 400 and b'Invalid id' in (error.content or b''))
+
+
+def group_label_changes(changes: dict) -> list:
+    """
+    Groups per-message label changes by identical (add, remove) sets so each group
+    can go through messages.batchModify.
+    `changes` maps message id -> (add_label_ids, remove_label_ids).
+    Returns a list of (ids, add_label_ids, remove_label_ids).
+    """
+    groups = {}
+    for email_id, (add_ids, remove_ids) in changes.items():
+        key = (tuple(sorted(set(add_ids or []))), tuple(sorted(set(remove_ids or []))))
+        groups.setdefault(key, []).append(email_id)
+    return [(ids, list(add_ids), list(remove_ids)) for (add_ids, remove_ids), ids in groups.items()]
+
+
+class AdaptiveBatchScheduler:
+    """
+    Runs one Gmail call per message ID through batch requests, as fast as quota allows.
+
+    - Every batch first takes its quota units from a shared token bucket.
+    - The batch size grows toward 100 while batches succeed and halves on rate-limit errors.
+    - Only the failed sub-requests are retried, with exponential backoff.
+    - The result reports success or failure for every ID.
+
+    Label changes shared by many IDs should use `run_bulk_modify` (messages.batchModify)
+    instead, which needs one call per 1000 IDs.
+    """
+
+    def __init__(self, service_factory, bucket: TokenBucket, min_size: int = 5,
+                 initial_size: int = 20, max_size: int = MAX_BATCH_SIZE,
+                 max_attempts: int = 5, base_backoff: float = 1.0, sleep=time.sleep):
+        self.service_factory = service_factory
+        self.bucket = bucket
+        self.min_size = min_size
+        self.initial_size = initial_size
+        self.max_size = min(max_size, MAX_BATCH_SIZE)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.sleep = sleep
+
+    def _backoff(self, streak: int) -> float:
+        return min(self.base_backoff * (2 ** streak), 32) + random.uniform(0, self.base_backoff)
+
+    def run(self, ids: list, build_request, method: str, progress=None, succeeded: list = None) -> dict:
+        """
+        Executes `build_request(service, id)` for every id.
+        `method` is the Gmail method name used for quota accounting (e.g. 'messages.modify').
+        `progress`, if given, is called as progress(processed, failed, total) after every batch.
+        IDs Gmail accepted are appended to `succeeded` (if given) as they complete, so a
+        caller interrupted by `progress` (JobCancelled) still knows what was applied.
+        Returns {"succeeded": [ids], "failed": [{"id": ..., "error": ...}]}.
+        """
+        pending = deque((email_id, 0) for email_id in dict.fromkeys(ids))
+        total = len(pending)
+        succeeded = [] if succeeded is None else succeeded
+        failed = []
+        size = min(self.initial_size, self.max_size)
+        throttle_streak = 0
+        service = self.service_factory()
+
+        while pending:
+            chunk = [pending.popleft() for _ in range(min(size, len(pending)))]
+            attempts = dict(chunk)
+            outcome = {}
+
+            def batch_callback(request_id, response, exception):
+                outcome[request_id] = exception
+
+            batch = service.new_batch_http_request(callback=metrics.instrument_batch(method, batch_callback))
+            for email_id, _ in chunk:
+                batch.add(build_request(service, email_id), request_id=email_id)
+
+            try:
+                # Charged before the quota is taken, so a call over the budget spends none.
+                request_usage.charge(len(chunk), batch=True)
+                self.bucket.acquire(units_for(method, len(chunk)), method=method)
+                metrics.execute_batch(batch, method, len(chunk), charged=True)
+            except Exception as e:
+                # The whole batch failed (network, auth...): every sub-request is unknown.
+                logging.error(f"Batch execution failed for {len(chunk)} requests: {e}")
+                outcome = {email_id: e for email_id, _ in chunk}
+
+            retry, rate_limited = [], False
+            for email_id, _ in chunk:
+                error = outcome.get(email_id, Exception("No response for sub-request"))
+                if error is None:
+                    succeeded.append(email_id)
+                    continue
+                rate_limited = rate_limited or is_rate_limit_error(error)
+                attempt = attempts[email_id] + 1
+                if is_retryable_error(error) and attempt < self.max_attempts:
+                    retry.append((email_id, attempt))
+                else:
+                    logging.error(f"Error in batch action for id {email_id}: {error}")
+                    failed.append({"id": email_id, "error": str(error)})
+
+            if rate_limited:
+                size = max(self.min_size, size // 2)
+                throttle_streak += 1
+            elif not retry:
+                size = min(self.max_size, size + max(1, size // 2))
+                throttle_streak = 0
+
+            if progress:
+                progress(len(succeeded) + len(failed), len(failed), total)
+
+            if retry:
+                delay = self._backoff(throttle_streak if rate_limited else retry[0][1] - 1)
+                logging.warning(
+                    f"{len(retry)} of {len(chunk)} sub-requests failed; retrying in {delay:.2f}s "
+                    f"with batch size {size}."
+                )
+                metrics.observe_backoff('batch_scheduler', delay)
+                self.sleep(delay)
+                # Retried IDs go first so they are not starved by the rest of the queue.
+                pending.extendleft(reversed(retry))
+
+        logging.info(f"Batch {method}: {len(succeeded)} succeeded, {len(failed)} failed out of {total}.")
+        return {"succeeded": succeeded, "failed": failed}
+
+    def run_bulk_modify(self, groups: list, progress=None, succeeded: list = None) -> dict:
+        """
+        Applies label changes through messages.batchModify in slices of up to 1000 IDs.
+        `groups` is a list of (ids, add_label_ids, remove_label_ids), see group_label_changes.
+        Retryable errors are retried with backoff; a slice that still fails with one, or
+        with an error that may only concern some IDs, falls back to per-message modify
+        calls so the result keeps per-ID precision. Any other error (an invalid label,
+        a 403) would fail the same way for every message, so the whole slice is failed.
+        `progress` and `succeeded` work as in `run`.
+        Returns {"succeeded": [ids], "failed": [{"id": ..., "error": ...}]}.
+        """
+        total = sum(len(ids) for ids, _, _ in groups)
+        succeeded = [] if succeeded is None else succeeded
+        failed = []
+        service = self.service_factory()
+
+        for ids, add_ids, remove_ids in groups:
+            ids = list(dict.fromkeys(ids))
+            body = {}
+            if add_ids: body['addLabelIds'] = add_ids
+            if remove_ids: body['removeLabelIds'] = remove_ids
+
+            for start in range(0, len(ids), MAX_BULK_MODIFY_IDS):
+                chunk = ids[start:start + MAX_BULK_MODIFY_IDS]
+                error = None
+                for attempt in range(self.max_attempts):
+                    try:
+                        request_usage.charge()
+                        self.bucket.acquire(units_for('messages.batchModify'), method='messages.batchModify')
+                        metrics.execute(
+                            service.users().messages().batchModify(userId='me', body=dict(body, ids=chunk)),
+                            'messages.batchModify', charged=True
+                        )
+                        error = None
+                        break
+                    except Exception as e:
+                        error = e
+                        if not is_retryable_error(e) or attempt == self.max_attempts - 1:
+                            break
+                        delay = self._backoff(attempt)
+                        logging.warning(f"batchModify of {len(chunk)} messages failed with {e}; retrying in {delay:.2f}s.")
+                        metrics.observe_backoff('batch_scheduler', delay)
+                        self.sleep(delay)
+
+                if error is None:
+                    succeeded.extend(chunk)
+                elif not (is_retryable_error(error) or is_per_message_error(error)):
+                    logging.error(f"batchModify failed for {len(chunk)} messages: {error}")
+                    failed.extend({"id": email_id, "error": str(error)} for email_id in chunk)
+                else:
+                    logging.warning(f"batchModify failed for {len(chunk)} messages ({error}); falling back to per-message modify.")
+
+                    def build_request(service, email_id):
+                        return service.users().messages().modify(userId='me', id=email_id, body=body)
+
+                    result = self.run(chunk, build_request, 'messages.modify', succeeded=succeeded)
+                    failed.extend(result["failed"])
+
+                if progress:
+                    progress(len(succeeded) + len(failed), len(failed), total)
+
+        logging.info(f"Bulk modify: {len(succeeded)} succeeded, {len(failed)} failed out of {total}.")
+        return {"succeeded": succeeded, "failed": failed}
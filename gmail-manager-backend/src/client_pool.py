@@ -0,0 +1,149 @@
+import os.path
+import logging
+import threading
+import httplib2
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build, build_from_document
+
+from . import request_usage
+from .config import SCOPES, CREDENTIALS_FILE, TOKEN_FILE, GMAIL_API_ROOT, GMAIL_API_ANONYMOUS
+
+
+class UsageTrackingHttp:
+    """Forwards to an httplib2.Http, adding response sizes to the current request's usage."""
+
+    def __init__(self, http):
+        self.__dict__['http'] = http
+
+    def request(self, *args, **kwargs):
+        response, content = self.http.request(*args, **kwargs)
+        request_usage.record("bytes_received", len(content or b""))
+        return response, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.http, name, value)
+
+
+class GmailClientPool:
+    """
+    Hands out authorized Gmail API clients, one per thread.
+
+    httplib2.Http is not thread-safe, so every thread gets its own client, built
+    once and then reused (keeping its TLS connection alive). All clients share a
+    single Credentials object; loading and refreshing it happens under a lock so
+    concurrent requests trigger at most one token refresh. The discovery document
+    is parsed once and reused for every client built afterwards.
+
+    With `api_root`, clients (including their batch endpoint) talk to that base URL
+    instead of Google's, e.g. the local fake server in src/fake_gmail.py; `anonymous`
+    then skips OAuth entirely. `http_factory` replaces the httplib2.Http each client
+    sends through (benchmarks use an in-process fake transport).
+    """
+
+    def __init__(self, token_file: str = TOKEN_FILE, credentials_file: str = CREDENTIALS_FILE,
+                 scopes: list = None, timeout: int = 30, api_root: str = GMAIL_API_ROOT,
+                 anonymous: bool = GMAIL_API_ANONYMOUS, http_factory=None):
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self.scopes = scopes or SCOPES
+        self.api_root = api_root.rstrip('/') if api_root else None
+        self.anonymous = anonymous
+        self.http_factory = http_factory
+        # Timeout ensures a hanging batch request (e.g. lost packets) eventually fails
+        # and can be retried instead of freezing the worker indefinitely.
+        self.timeout = timeout
+        self._creds = None
+        self._creds_lock = threading.Lock()
+        self._discovery_doc = None
+        self._build_lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+
+    # --- Credentials ---
+
+    def _save_credentials(self, creds: Credentials):
+        with open(self.token_file, 'w') as token:
+            token.write(creds.to_json())
+
+    def _load_credentials(self) -> Credentials:
+        if self.anonymous:
+            return AnonymousCredentials()
+        creds = None
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
+
+        if creds and creds.valid:
+            return creds
+        if creds and creds.expired and creds.refresh_token:
+            logging.info("Refreshing expired credentials.")
+            creds.refresh(Request())
+        else:
+            logging.info("Performing new user authentication.")
+            if not os.path.exists(self.credentials_file):
+                logging.error(f"CRITICAL: Credentials file '{self.credentials_file}' not found.")
+                raise FileNotFoundError(
+                    f"Error: '{self.credentials_file}' not found. "
+                    "Please download it from the Google Cloud Console and place it in the root directory."
+                )
+            flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, self.scopes)
+            creds = flow.run_local_server(port=0)
+        self._save_credentials(creds)
+        return creds
+
+    def credentials(self) -> Credentials:
+        """Returns the shared, valid credentials, loading or refreshing them once under a lock."""
+        creds = self._creds
+        if creds is not None and creds.valid:
+            return creds
+        with self._creds_lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if self._creds is not None and self._creds.valid:
+                return self._creds
+            if self._creds is None:
+                self._creds = self._load_credentials()
+            else:
+                logging.info("Refreshing expired credentials.")
+                self._creds.refresh(Request())
+                self._save_credentials(self._creds)
+            return self._creds
+
+    # --- Clients ---
+
+    def _build_client(self, creds: Credentials):
+        http = self.http_factory() if self.http_factory else httplib2.Http(timeout=self.timeout)
+        authed_http = AuthorizedHttp(creds, http=UsageTrackingHttp(http))
+        with self._build_lock:
+            document = self._discovery_doc
+        if document is not None:
+            return build_from_document(document, http=authed_http)
+        service = build('gmail', 'v1', http=authed_http, cache_discovery=False)
+        document = getattr(service, '_rootDesc', None)
+        if self.api_root and document is not None:
+            # rootUrl drives both the REST base URL and the batch endpoint.
+            document = dict(document, rootUrl=f"{self.api_root}/")
+            service = build_from_document(document, http=authed_http)
+        with self._build_lock:
+            self._discovery_doc = document
+        return service
+
+    def get(self):
+        """Returns the calling thread's Gmail client, building it on first use."""
+        creds = self.credentials()
+        local = self._local
+        if getattr(local, 'service', None) is None or local.generation != self._generation:
+            local.service = self._build_client(creds)
+            local.generation = self._generation
+        return local.service
+
+    def reset(self):
+        """Discards every pooled client and the cached credentials (e.g. after re-authentication)."""
+        with self._creds_lock:
+            self._creds = None
+            self._generation += 1
@@ -13,4 +13,79 @@ CREDENTIALS_FILE = 'credentials.json'
 TOKEN_FILE = 'token.json'
 
 # Frontend URL for CORS
-FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3123")
\ No newline at end of file
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3123")
+
+# Base URL of the Gmail API. Point it at the local fake server (python -m src.fake_gmail)
+# to load test without a real mailbox; empty means Google's endpoint.
+GMAIL_API_ROOT = os.getenv("GMAIL_API_ROOT", "")
+# Send unauthenticated requests instead of loading OAuth credentials (fake server only).
+GMAIL_API_ANONYMOUS = os.getenv("GMAIL_API_ANONYMOUS", "false").lower() == "true"
+
+# Local metadata store (SQLite) used to answer label-only list/count/subject queries
+# without going back to Gmail. Kept current with the History API.
+METADATA_STORE_ENABLED = os.getenv("METADATA_STORE_ENABLED", "true").lower() == "true"
+METADATA_DB_FILE = os.getenv("METADATA_DB_FILE", "metadata.db")
+# Seconds between two history syncs of the metadata store.
+METADATA_SYNC_INTERVAL = int(os.getenv("METADATA_SYNC_INTERVAL", "30"))
+
+# Gmail per-user quota budget shared by all batch operations (Gmail's ceiling is 250 units/s).
+GMAIL_QUOTA_UNITS_PER_SECOND = int(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", "250"))
+# Units that may be spent at once before pacing kicks in. The default is one second of
+# quota, so a cold start cannot send several seconds' worth at once and draw 429s.
+# Raise it (e.g. 2500 to hydrate a 500-message page at once) to opt into larger bursts.
+GMAIL_QUOTA_BURST_UNITS = int(os.getenv("GMAIL_QUOTA_BURST_UNITS", "250"))
+
+# Concurrent metadata batches (up to 100 messages each) used to hydrate list pages,
+# subject counts and sender stats. 5 covers a 500-message page in a single round trip.
+METADATA_FETCH_WORKERS = int(os.getenv("METADATA_FETCH_WORKERS", "5"))
+# The metadata store backfill/sync fetches with its own workers, and only spends quota
+# while this fraction of the bucket stays free for foreground requests.
+METADATA_SYNC_FETCH_WORKERS = int(os.getenv("METADATA_SYNC_FETCH_WORKERS", "2"))
+METADATA_SYNC_QUOTA_RESERVE = float(os.getenv("METADATA_SYNC_QUOTA_RESERVE", "0.5"))
+
+# Background jobs (long batch actions, full counts): persistent job table and worker count.
+JOBS_DB_FILE = os.getenv("JOBS_DB_FILE", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Seconds the user's label list is cached before it is fetched again. Unknown label
+# names and label IDs seen in history also trigger a refresh.
+LABELS_CACHE_TTL = int(os.getenv("LABELS_CACHE_TTL", "300"))
+
+# Email detail cache: parsed message bodies kept in memory (LRU, bounded by total body
+# bytes) and on disk (bodies never change). Label state is re-checked separately.
+EMAIL_CACHE_MAX_BYTES = int(os.getenv("EMAIL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMAIL_CACHE_DIR = os.getenv("EMAIL_CACHE_DIR", "email_cache")  # Empty disables the disk tier
+EMAIL_DISK_CACHE_MAX_BYTES = int(os.getenv("EMAIL_DISK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Seconds cached label state (read/unread) is trusted when the metadata store cannot answer.
+EMAIL_CACHE_LABELS_TTL = int(os.getenv("EMAIL_CACHE_LABELS_TTL", "60"))
+
+# Background prefetch of the bodies on a listed page (see /emails?prefetch=true).
+# The prefetcher only spends quota while this fraction of the bucket stays free for
+# foreground requests.
+PREFETCH_QUOTA_RESERVE = float(os.getenv("PREFETCH_QUOTA_RESERVE", "0.5"))
+
+# Email bodies are decoded up to this many bytes; longer ones are returned truncated.
+EMAIL_BODY_MAX_BYTES = int(os.getenv("EMAIL_BODY_MAX_BYTES", str(2 * 1024 * 1024)))
+
+# Number of subjects the approximate (top-K) subject counter tracks.
+SUBJECT_TOPK_CAPACITY = int(os.getenv("SUBJECT_TOPK_CAPACITY", "1000"))
+
+# Async Gmail transport (httpx): connection pool shared by all async endpoints.
+GMAIL_ASYNC_MAX_CONNECTIONS = int(os.getenv("GMAIL_ASYNC_MAX_CONNECTIONS", "100"))
+# Worker threads for endpoints that still call the blocking client (long dashboard and
+# batch operations). Kept separate so they cannot starve the async endpoints.
+BLOCKING_CALLS_LIMIT = int(os.getenv("BLOCKING_CALLS_LIMIT", "20"))
+
+# Optional per-endpoint budgets of Gmail calls per request, as "path=calls,..."
+# (e.g. "/dashboard/full=300,/emails=150"). Batch sub-requests count as calls.
+GMAIL_CALL_BUDGETS = os.getenv("GMAIL_CALL_BUDGETS", "")
+# What happens once a request would exceed its budget: its further Gmail calls fail, and
+# "degrade" answers with what the endpoint built from the calls it made (flagged with
+# X-Gmail-Budget-Exceeded), while "abort" answers 503.
+GMAIL_CALL_BUDGET_MODE = os.getenv("GMAIL_CALL_BUDGET_MODE", "degrade")
+
+# Dashboard result cache (stale-while-revalidate): results younger than the TTL are
+# served as is; older ones are served flagged stale while they are recomputed in the
+# background, until they are MAX_AGE seconds old.
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+DASHBOARD_CACHE_MAX_AGE = int(os.getenv("DASHBOARD_CACHE_MAX_AGE", "3600"))
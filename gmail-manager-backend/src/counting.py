@@ -0,0 +1,279 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+# Search terms that are nothing more than label membership, so they can be
+# answered from label data instead of a Gmail search.
+QUERY_LABEL_ALIASES = {
+    'is:unread': 'UNREAD',
+    'is:starred': 'STARRED',
+    'is:important': 'IMPORTANT',
+    'in:inbox': 'INBOX',
+    'in:sent': 'SENT',
+    'in:spam': 'SPAM',
+    'in:trash': 'TRASH',
+    'category:primary': 'CATEGORY_PERSONAL',
+    'category:social': 'CATEGORY_SOCIAL',
+    'category:promotions': 'CATEGORY_PROMOTIONS',
+    'category:updates': 'CATEGORY_UPDATES',
+    'category:forums': 'CATEGORY_FORUMS',
+}
+
+
+def reduce_query_to_labels(query: str, label_ids: list = None):
+    """
+    Reduces a search query to pure label membership when possible.
+    Returns the combined list of label ids, or None if the query needs a real Gmail search.
+    """
+    combined = list(label_ids or [])
+    for term in (query or "").lower().split():
+        label_id = QUERY_LABEL_ALIASES.get(term)
+        if label_id is None:
+            return None
+        if label_id not in combined:
+            combined.append(label_id)
+    return combined
+
+
+def count_key(label_ids: list, query: str) -> tuple:
+    """Cache key for a count: label order and whitespace in the query do not matter."""
+    return (tuple(sorted(set(label_ids or []))), " ".join((query or "").split()))
+
+
+def count_fingerprint(label_ids: list, query: str) -> str:
+    """Short stable identifier for a (labelIds, q) pair, used by clients to poll for a count."""
+    return hashlib.sha1(repr(count_key(label_ids, query)).encode('utf-8')).hexdigest()[:16]
+
+
+class MessageCounter:
+    """
+    Counts messages matching (labelIds, q), cheapest strategy first:
+
+    1. The local metadata store, when it is ready and the query is label-only.
+    2. labels.get messagesTotal/messagesUnread, when the query is a single label
+       (optionally combined with UNREAD).
+    3. A memoized exact count, valid until the mailbox historyId moves (or for
+       `unversioned_ttl` seconds when the historyId could not be read).
+    4. An exact page walk over message IDs.
+
+    In "estimate" mode, step 4 is replaced by Gmail's resultSizeEstimate and the
+    exact count is computed in the background for the next caller.
+    """
+
+    def __init__(self, service_factory, execute, store_provider=None,
+                 history_ttl: float = 5.0, max_entries: int = 256, max_workers: int = 2,
+                 unversioned_ttl: float = 60.0):
+        self.service_factory = service_factory
+        self.execute = execute
+        self.store_provider = store_provider or (lambda: None)
+        self.history_ttl = history_ttl
+        self.unversioned_ttl = unversioned_ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # key -> (count, history_id, stored_at)
+        self._in_flight = {}  # key -> Future
+        self._fingerprints = OrderedDict()  # fingerprint -> (label_ids, query)
+        self._lock = threading.Lock()
+        self._history_id = None
+        self._history_checked_at = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="count")
+
+    # --- History tracking ---
+
+    def _current_history_id(self, service):
+        """Mailbox historyId, re-read from users.getProfile at most every `history_ttl` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if self._history_id is not None and now - self._history_checked_at < self.history_ttl:
+                return self._history_id
+        try:
+            profile = self.execute(service.users().getProfile(userId='me', fields='historyId'))
+            history_id = profile.get('historyId')
+        except Exception as e:
+            logging.warning(f"Could not read mailbox historyId, count cache bypassed: {e}")
+            return None
+        with self._lock:
+            if history_id != self._history_id:
+                self._cache.clear()
+            self._history_id = history_id
+            self._history_checked_at = now
+        return history_id
+
+    def invalidate(self):
+        """Drops every memoized count, e.g. after we modified messages ourselves."""
+        with self._lock:
+            self._cache.clear()
+            self._history_checked_at = 0.0
+
+    def _cache_get(self, key, history_id):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[1] != history_id:
+                return None
+            if history_id is None and time.monotonic() - entry[2] > self.unversioned_ttl:
+                # Counted while the historyId was unknown: only trusted for a short while.
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def _remember(self, label_ids: list, query: str) -> str:
+        fingerprint = count_fingerprint(label_ids, query)
+        with self._lock:
+            self._fingerprints[fingerprint] = (list(label_ids), query)
+            self._fingerprints.move_to_end(fingerprint)
+            while len(self._fingerprints) > self.max_entries:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def _cache_put(self, key, count, history_id):
+        with self._lock:
+            self._cache[key] = (count, history_id, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    # --- Strategies ---
+
+    def _count_from_label(self, service, label_ids: list):
+        """Uses labels.get counters when the label set is one label, optionally plus UNREAD."""
+        others = [l for l in label_ids if l != 'UNREAD']
+        unread = 'UNREAD' in label_ids
+        if len(others) > 1 or (not others and not unread):
+            return None
+        target = others[0] if others else 'UNREAD'
+        label = self.execute(service.users().labels().get(userId='me', id=target))
+        if unread and others:
+            return label.get('messagesUnread', 0)
+        return label.get('messagesTotal', 0)
+
+    def _walk_count(self, service, label_ids: list, query: str) -> int:
+        """Exact count by paging through message IDs, 500 at a time."""
+        total_count = 0
+        page_token = None
+        while True:
+            results = self.execute(service.users().messages().list(
+                userId='me',
+                labelIds=label_ids,
+                q=query,
+                pageToken=page_token,
+                maxResults=500,
+                fields="nextPageToken,messages(id)",
+                includeSpamTrash=False
+            ))
+            total_count += len(results.get('messages', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return total_count
+
+    def _estimate(self, service, label_ids: list, query: str) -> int:
+        results = self.execute(service.users().messages().list(
+            userId='me', labelIds=label_ids, q=query, maxResults=1, fields="resultSizeEstimate"
+        ))
+        return results.get('resultSizeEstimate', 0)
+
+    def _exact_and_cache(self, key, label_ids: list, query: str) -> int:
+        service = self.service_factory()
+        history_id = self._current_history_id(service)
+        cached = self._cache_get(key, history_id)
+        if cached is not None:
+            return cached
+        count = self._walk_count(service, label_ids, query)
+        self._cache_put(key, count, history_id)
+        return count
+
+    def _schedule_exact(self, key, label_ids: list, query: str):
+        """Starts (at most one) background exact count for `key`."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._exact_and_cache, key, label_ids, query)
+            self._in_flight[key] = future
+
+        def _done(f):
+            with self._lock:
+                self._in_flight.pop(key, None)
+            if f.exception():
+                logging.error(f"Background count failed for {key}: {f.exception()}")
+
+        future.add_done_callback(_done)
+        return future
+
+    # --- Public API ---
+
+    def count(self, label_ids: list = None, query: str = None, mode: str = "exact", estimate: int = None) -> dict:
+        """
+        Returns {"count": int, "exact": bool, "source": str, "fingerprint": str}.
+        mode="exact" always returns an exact figure; mode="estimate" never walks pages
+        in the caller's thread and may return Gmail's resultSizeEstimate instead
+        (`estimate` can be passed in when the caller already has one).
+        """
+        label_ids = list(label_ids or [])
+        query = query or None
+        fingerprint = self._remember(label_ids, query)
+
+        local_labels = reduce_query_to_labels(query, label_ids)
+        store = self.store_provider()
+        if store is not None and local_labels is not None:
+            return {"count": store.count(local_labels), "exact": True, "source": "store", "fingerprint": fingerprint}
+
+        service = self.service_factory()
+        if local_labels is not None:
+            try:
+                count = self._count_from_label(service, local_labels)
+                if count is not None:
+                    return {"count": count, "exact": True, "source": "label", "fingerprint": fingerprint}
+            except Exception as e:
+                logging.warning(f"labels.get count failed for {local_labels}, falling back: {e}")
+
+        key = count_key(label_ids, query)
+        history_id = self._current_history_id(service)
+        cached = self._cache_get(key, history_id)
+        metrics.observe_cache('message_count', hit=cached is not None)
+        if cached is not None:
+            return {"count": cached, "exact": True, "source": "cache", "fingerprint": fingerprint}
+
+        if mode == "estimate":
+            self._schedule_exact(key, label_ids, query)
+            if estimate is None:
+                estimate = self._estimate(service, label_ids, query)
+            return {"count": estimate, "exact": False, "source": "estimate", "fingerprint": fingerprint}
+
+        # Share the work with a background count that may already be running.
+        with self._lock:
+            future = self._in_flight.get(key)
+        if future is not None:
+            return {"count": future.result(), "exact": True, "source": "walk", "fingerprint": fingerprint}
+        count = self._walk_count(service, label_ids, query)
+        self._cache_put(key, count, history_id)
+        return {"count": count, "exact": True, "source": "walk", "fingerprint": fingerprint}
+
+    def status(self, fingerprint: str, wait: float = 0):
+        """
+        Looks up the exact count for a fingerprint handed out by `count`.
+        Waits up to `wait` seconds for a running background count (long-poll).
+        Returns {"fingerprint", "count", "exact", "status"} or None for unknown fingerprints.
+        """
+        with self._lock:
+            target = self._fingerprints.get(fingerprint)
+        if target is None:
+            return None
+        label_ids, query = target
+        key = count_key(label_ids, query)
+
+        history_id = self._current_history_id(self.service_factory())
+        cached = self._cache_get(key, history_id)
+        if cached is None:
+            future = self._schedule_exact(key, label_ids, query)
+            if wait:
+                try:
+                    cached = future.result(timeout=wait)
+                except Exception:
+                    cached = None
+        if cached is None:
+            return {"fingerprint": fingerprint, "count": None, "exact": False, "status": "pending"}
+        return {"fingerprint": fingerprint, "count": cached, "exact": True, "status": "done"}
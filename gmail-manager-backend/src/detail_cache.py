@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+from .config import EMAIL_CACHE_MAX_BYTES, EMAIL_CACHE_DIR, EMAIL_DISK_CACHE_MAX_BYTES
+
+# Gmail message IDs are hex strings; anything else never touches the disk tier.
+SAFE_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def content_size(content: dict) -> int:
+    """Bytes a cached entry is charged for: its body, plus a little for the headers."""
+    return len(content.get('body', '').encode('utf-8')) + 512
+
+
+class EmailDetailCache:
+    """
+    Two-tier cache of parsed message details for get_email_details.
+
+    A message's content (headers, snippet, decoded body) never changes, so it is kept:
+    - in memory, in an LRU bounded by the total size of the cached bodies,
+    - on disk as one JSON file per message (optional), so it survives restarts.
+
+    Label state (read/unread) does change. It is kept next to the in-memory entry with
+    the time it was observed, and callers decide whether it is still fresh enough.
+    """
+
+    def __init__(self, max_bytes: int = EMAIL_CACHE_MAX_BYTES, disk_dir: str = EMAIL_CACHE_DIR,
+                 disk_max_bytes: int = EMAIL_DISK_CACHE_MAX_BYTES, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self.clock = clock
+        self._entries = OrderedDict()  # id -> {"content", "label_ids", "labels_at", "size"}
+        self._bytes = 0
+        self._disk_bytes = None  # Computed on first disk write
+        self._lock = threading.Lock()
+
+    # --- Memory tier ---
+
+    def get(self, email_id: str):
+        """
+        Returns (content, label_ids, labels_age_seconds) or None.
+        label_ids is None when the content came from disk and labels were never observed.
+        """
+        with self._lock:
+            entry = self._entries.get(email_id)
+            if entry is not None:
+                self._entries.move_to_end(email_id)
+                age = None if entry['labels_at'] is None else self.clock() - entry['labels_at']
+                metrics.observe_cache('email_detail', hit=True)
+                return entry['content'], entry['label_ids'], age
+        content = self._read_disk(email_id)
+        metrics.observe_cache('email_detail', hit=content is not None)
+        if content is None:
+            return None
+        self._remember(email_id, content, None)
+        return content, None, None
+
+    def contains(self, email_id: str) -> bool:
+        """
+        Whether `email_id` is cached in memory or on disk. Unlike `get`, it neither reads
+        the disk file, refreshes the LRU order nor counts as a hit or miss.
+        """
+        with self._lock:
+            if email_id in self._entries:
+                return True
+        path = self._disk_path(email_id)
+        return path is not None and os.path.exists(path)
+
+    def put(self, email_id: str, content: dict, label_ids: list):
+        """Caches freshly fetched content together with the labels it was fetched with."""
+        self._remember(email_id, content, label_ids)
+        self._write_disk(email_id, content)
+
+    def set_labels(self, email_id: str, label_ids: list):
+        """Records freshly observed label state for a cached message."""
+        with self._lock:
+            entry = self._entries.get(email_id)
+            if entry is not None:
+                entry['label_ids'] = list(label_ids)
+                entry['labels_at'] = self.clock()
+
+    def apply_label_delta(self, ids: list, add_label_ids: list = None, remove_label_ids: list = None):
+        """Mirrors a label change we made ourselves into the cached label state."""
+        add_label_ids, remove_label_ids = set(add_label_ids or []), set(remove_label_ids or [])
+        with self._lock:
+            for email_id in ids:
+                entry = self._entries.get(email_id)
+                if entry is None or entry['label_ids'] is None:
+                    continue
+                labels = (set(entry['label_ids']) | add_label_ids) - remove_label_ids
+                entry['label_ids'] = sorted(labels)
+
+    def _remember(self, email_id: str, content: dict, label_ids):
+        size = content_size(content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(email_id, None)
+            if old is not None:
+                self._bytes -= old['size']
+            self._entries[email_id] = {
+                "content": content,
+                "label_ids": list(label_ids) if label_ids is not None else None,
+                "labels_at": self.clock() if label_ids is not None else None,
+                "size": size,
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['size']
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- Disk tier ---
+
+    def _disk_path(self, email_id: str):
+        if not self.disk_dir or not SAFE_ID.match(email_id):
+            return None
+        return os.path.join(self.disk_dir, f"{email_id}.json")
+
+    def _read_disk(self, email_id: str):
+        path = self._disk_path(email_id)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable cached email '{email_id}': {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, email_id: str, content: dict):
+        path = self._disk_path(email_id)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = self._scan_disk_bytes()
+                else:
+                    self._disk_bytes += os.path.getsize(path)
+                over_budget = self._disk_bytes > self.disk_max_bytes
+            if over_budget:
+                self._prune_disk()
+        except OSError as e:
+            logging.warning(f"Failed to write cached email '{email_id}' to disk: {e}")
+
+    def _disk_files(self) -> list:
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _scan_disk_bytes(self) -> int:
+        return sum(size for _, size, _ in self._disk_files())
+
+    def _prune_disk(self):
+        """Deletes the oldest cached bodies until the disk tier is back to 80% of its budget."""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 0.8
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+        logging.info(f"Email disk cache pruned: removed {removed} files, {total} bytes left.")
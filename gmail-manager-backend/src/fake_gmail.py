@@ -0,0 +1,715 @@
+"""
+Local stand-in for the Gmail v1 REST API, for offline load testing.
+
+Serves a synthetic mailbox over the endpoints this backend uses: messages.list/get/
+modify/trash/untrash/batchModify, multipart/mixed batch requests, labels, filters,
+history and getProfile. Latency, the per-user quota and random 429s are configurable,
+so batching, pagination and rate-limit handling can be measured without a real account.
+
+    python -m src.fake_gmail --messages 100000 --latency 0.05 --quota 250 --error-rate 0.01
+
+then start the backend with GMAIL_API_ROOT=http://127.0.0.1:8085 GMAIL_API_ANONYMOUS=true.
+
+Search queries (`q`) support the operators the backend generates: from:, to:, subject:,
+after:, before:, is:, in:, label:, category:, negation with '-', and bare words.
+Anything else is rejected with a 400 instead of being silently ignored.
+"""
+import argparse
+import asyncio
+import base64
+import email.parser
+import json
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from .quota import TokenBucket, units_for
+
+USER_PREFIX = "/gmail/v1/users/me/"
+
+SYSTEM_LABELS = [
+    'INBOX', 'SENT', 'DRAFT', 'SPAM', 'TRASH', 'UNREAD', 'STARRED', 'IMPORTANT',
+    'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS',
+]
+HIDDEN_LABELS = ('SPAM', 'TRASH')
+
+# Share of the synthetic mailbox in each inbox category.
+CATEGORY_WEIGHTS = {
+    'CATEGORY_PERSONAL': 40, 'CATEGORY_PROMOTIONS': 30, 'CATEGORY_UPDATES': 15,
+    'CATEGORY_SOCIAL': 10, 'CATEGORY_FORUMS': 5,
+}
+
+SUBJECT_TEMPLATES = [
+    "Your order #{n} has shipped", "Weekly newsletter - issue {n}", "Invitation: team sync #{n}",
+    "Re: project update", "Your receipt from Shop {n}", "Security alert", "{n} new notifications",
+    "Flash sale: {n}% off everything", "Meeting notes", "Welcome aboard!", "Invoice {n} is due",
+    "Re: dinner on Friday?", "Your weekly report", "Password reset request", "New comment on your post",
+]
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut "
+    "labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris"
+).split()
+
+QUERY_TERM = re.compile(r'(-)?(?:(\w+):)?(\([^)]*\)|"[^"]*"|\S+)')
+
+HISTORY_KEYS = {
+    'messageAdded': 'messagesAdded', 'messageDeleted': 'messagesDeleted',
+    'labelAdded': 'labelsAdded', 'labelRemoved': 'labelsRemoved',
+}
+
+
+class FakeGmailError(Exception):
+    """An error response, rendered in Gmail's JSON error format."""
+
+    def __init__(self, status: int, reason: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.message = message
+
+    def payload(self) -> dict:
+        return {"error": {
+            "code": self.status,
+            "message": self.message,
+            "errors": [{"message": self.message, "domain": "global", "reason": self.reason}],
+        }}
+
+
+def rate_limit_error() -> FakeGmailError:
+    return FakeGmailError(429, "rateLimitExceeded", "Too many requests for user (injected by fake Gmail).")
+
+
+def b64url(data: str) -> str:
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+class FakeMessage:
+    __slots__ = ('id', 'thread_id', 'label_ids', 'sender', 'to', 'subject', 'body', 'internal_date', 'size_estimate')
+
+    def __init__(self, id, thread_id, label_ids, sender, to, subject, body, internal_date, size_estimate):
+        self.id = id
+        self.thread_id = thread_id
+        self.label_ids = label_ids
+        self.sender = sender
+        self.to = to
+        self.subject = subject
+        self.body = body
+        self.internal_date = internal_date
+        self.size_estimate = size_estimate
+
+    @property
+    def snippet(self) -> str:
+        return self.body[:100]
+
+    def headers(self) -> list:
+        return [
+            {"name": "From", "value": self.sender},
+            {"name": "To", "value": self.to},
+            {"name": "Subject", "value": self.subject},
+            {"name": "Date", "value": formatdate(self.internal_date / 1000)},
+            {"name": "Message-ID", "value": f"<{self.id}@fake.gmail>"},
+        ]
+
+
+class FakeMailbox:
+    """
+    In-memory Gmail mailbox: a deterministic synthetic set of messages (same `seed`,
+    same mailbox), labels, filters and a history log of every change.
+    """
+
+    def __init__(self, size: int = 1000, seed: int = 0, user_labels: int = 5,
+                 address: str = "me@example.com", history_limit: int = 100000):
+        self.address = address
+        self.history_limit = history_limit
+        self.labels = {label_id: {"id": label_id, "name": label_id, "type": "system"} for label_id in SYSTEM_LABELS}
+        for i in range(1, user_labels + 1):
+            self.labels[f"Label_{i}"] = {"id": f"Label_{i}", "name": f"Project {i}", "type": "user"}
+        self.messages = {}
+        self.order = []  # Message IDs, newest first.
+        self.filters = {}
+        self.history = []  # (history ID, record) in ascending order.
+        self.history_id = 1000
+        self._filter_seq = 0
+        self._query_cache = {}
+        self._rng = random.Random(seed)
+        self._now_ms = int(time.time() * 1000)
+        self._seq = 0
+        self._user_labels = [label_id for label_id in self.labels if label_id.startswith('Label_')]
+        self._generate(size)
+
+    # --- Synthetic data ---
+
+    def _new_message(self, internal_date: int, thread_id: str = None) -> FakeMessage:
+        rng = self._rng
+        self._seq += 1
+        message_id = f"{0x18a0000000000000 + self._seq:x}"
+        sender_no = min(int(rng.paretovariate(1.2)), 2000)
+        domain = f"sender{sender_no % 300}.example"
+        sender = f"Sender {sender_no} <user{sender_no}@{domain}>"
+        subject = rng.choice(SUBJECT_TEMPLATES).format(n=rng.randint(1, 50))
+        body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))).capitalize() + "."
+
+        labels = [rng.choices(list(CATEGORY_WEIGHTS), weights=list(CATEGORY_WEIGHTS.values()))[0]]
+        roll = rng.random()
+        if roll < 0.01:
+            labels.append('SPAM')
+        elif roll < 0.03:
+            labels.append('TRASH')
+        elif roll < 0.63:
+            labels.append('INBOX')
+        if rng.random() < 0.35:
+            labels.append('UNREAD')
+        if rng.random() < 0.02:
+            labels.append('STARRED')
+        if rng.random() < 0.10:
+            labels.append('IMPORTANT')
+        if self._user_labels and rng.random() < 0.10:
+            labels.append(rng.choice(self._user_labels))
+        return FakeMessage(
+            message_id, thread_id or message_id, labels, sender, self.address, subject, body,
+            internal_date, rng.randint(2000, 200000),
+        )
+
+    def _generate(self, size: int):
+        # One message every ten minutes going back from now; every fifth one replies to the previous.
+        previous = None
+        created = []
+        for i in range(size):
+            thread_id = previous.thread_id if previous is not None and i % 5 == 4 else None
+            message = self._new_message(self._now_ms - (size - i) * 600000, thread_id)
+            created.append(message)
+            previous = message
+        for message in reversed(created):
+            self.messages[message.id] = message
+            self.order.append(message.id)
+
+    def deliver(self, count: int = 1) -> list:
+        """Simulates `count` new messages arriving (recorded as messageAdded history)."""
+        delivered = []
+        for _ in range(count):
+            self._now_ms += 1000
+            message = self._new_message(self._now_ms)
+            if 'SPAM' not in message.label_ids and 'TRASH' not in message.label_ids and 'INBOX' not in message.label_ids:
+                message.label_ids.append('INBOX')
+            self.messages[message.id] = message
+            self.order.insert(0, message.id)
+            self._record({"messagesAdded": [{"message": self._stub(message)}]}, message)
+            delivered.append(message.id)
+        return delivered
+
+    def snapshot(self) -> tuple:
+        """Captures the mutable state (labels per message, history) for `restore`."""
+        return {i: list(m.label_ids) for i, m in self.messages.items()}, list(self.history), self.history_id
+
+    def restore(self, snapshot: tuple):
+        """Rolls back to a `snapshot`, dropping messages delivered since."""
+        labels, self.history, self.history_id = snapshot
+        self.messages = {i: m for i, m in self.messages.items() if i in labels}
+        self.order = [i for i in self.order if i in labels]
+        for message_id, label_ids in labels.items():
+            self.messages[message_id].label_ids = list(label_ids)
+        self._query_cache.clear()
+
+    # --- History ---
+
+    @staticmethod
+    def _stub(message: FakeMessage) -> dict:
+        return {"id": message.id, "threadId": message.thread_id, "labelIds": list(message.label_ids)}
+
+    def _record(self, changes: dict, message: FakeMessage):
+        self._query_cache.clear()
+        self.history_id += 1
+        record = {"id": str(self.history_id), "messages": [self._stub(message)], **changes}
+        self.history.append((self.history_id, record))
+        if len(self.history) > self.history_limit:
+            del self.history[:len(self.history) - self.history_limit]
+
+    def relabel(self, message: FakeMessage, add: list, remove: list):
+        for label_id in list(add) + list(remove):
+            if label_id not in self.labels:
+                raise FakeGmailError(400, "invalidArgument", f"Invalid label: {label_id}")
+        added = [label_id for label_id in add if label_id not in message.label_ids]
+        removed = [label_id for label_id in remove if label_id in message.label_ids and label_id not in add]
+        message.label_ids = [label_id for label_id in message.label_ids if label_id not in removed] + added
+        if added:
+            self._record({"labelsAdded": [{"message": self._stub(message), "labelIds": added}]}, message)
+        if removed:
+            self._record({"labelsRemoved": [{"message": self._stub(message), "labelIds": removed}]}, message)
+
+    def list_history(self, start_history_id: int, history_types: list = None,
+                     page_token: str = None, max_results: int = 100) -> dict:
+        oldest = self.history[0][0] if self.history else self.history_id + 1
+        if start_history_id < oldest - 1 and start_history_id < self.history_id:
+            raise FakeGmailError(404, "notFound", "Requested entity was not found.")
+        wanted = {HISTORY_KEYS[t] for t in history_types} if history_types else set(HISTORY_KEYS.values())
+        records = [
+            {key: value for key, value in record.items() if key in ('id', 'messages') or key in wanted}
+            for history_id, record in self.history if history_id > start_history_id
+        ]
+        records = [record for record in records if len(record) > 2]
+        offset = int(page_token or 0)
+        page = records[offset:offset + max_results]
+        result = {"historyId": str(self.history_id)}
+        if page:
+            result["history"] = page
+        if offset + max_results < len(records):
+            result["nextPageToken"] = str(offset + max_results)
+        return result
+
+    # --- Search ---
+
+    def _label_id_for_name(self, name: str) -> str:
+        name = name.strip().lower()
+        for label in self.labels.values():
+            if label["id"].lower() == name or label["name"].lower().replace(" ", "-") == name.replace(" ", "-"):
+                return label["id"]
+        raise FakeGmailError(400, "invalidArgument", f"Unknown label in query: {name}")
+
+    def _term_predicate(self, op: str, value: str):
+        if op is None:
+            return lambda m: value in m.subject.lower() or value in m.sender.lower() or value in m.body.lower()
+        if op == 'from':
+            return lambda m: value in m.sender.lower()
+        if op == 'to':
+            return lambda m: value in m.to.lower()
+        if op == 'subject':
+            return lambda m: value in m.subject.lower()
+        if op in ('after', 'before'):
+            if value.isdigit():
+                ms = int(value) * 1000
+            else:
+                day = datetime.strptime(value.replace("-", "/"), "%Y/%m/%d").replace(tzinfo=timezone.utc)
+                ms = int(day.timestamp() * 1000)
+            return (lambda m: m.internal_date >= ms) if op == 'after' else (lambda m: m.internal_date < ms)
+        if op == 'is':
+            if value == 'read':
+                return lambda m: 'UNREAD' not in m.label_ids
+            label_id = {'unread': 'UNREAD', 'starred': 'STARRED', 'important': 'IMPORTANT'}.get(value)
+        elif op == 'category':
+            label_id = 'CATEGORY_PERSONAL' if value == 'primary' else f"CATEGORY_{value.upper()}"
+        elif op in ('in', 'label'):
+            if value == 'anywhere':
+                return lambda m: True
+            label_id = self._label_id_for_name(value)
+        else:
+            label_id = None
+        if label_id is None or label_id not in self.labels:
+            raise FakeGmailError(400, "invalidArgument", f"Unsupported search term: {op}:{value}")
+        return lambda m: label_id in m.label_ids
+
+    def _compile_query(self, q: str):
+        """Returns (predicate, whether the query itself reaches into SPAM/TRASH)."""
+        predicates = []
+        reaches_hidden = False
+        for negate, op, value in QUERY_TERM.findall(q or ""):
+            op = op.lower() or None
+            value = value.strip('()"').lower()
+            if op is None and value in ('or', 'and', '{', '}'):
+                raise FakeGmailError(400, "invalidArgument", f"Unsupported search operator: {value}")
+            if op in ('in', 'label') and value in ('spam', 'trash', 'anywhere') and not negate:
+                reaches_hidden = True
+            predicate = self._term_predicate(op, value)
+            predicates.append((lambda m, p=predicate: not p(m)) if negate else predicate)
+        return (lambda m: all(p(m) for p in predicates)), reaches_hidden
+
+    def search(self, label_ids: list = None, q: str = None, include_spam_trash: bool = False) -> list:
+        """IDs matching labels and query, newest first (cached until the mailbox changes)."""
+        key = (tuple(sorted(label_ids or [])), q or "", include_spam_trash)
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            return cached
+        for label_id in label_ids or []:
+            if label_id not in self.labels:
+                raise FakeGmailError(400, "invalidArgument", f"Invalid label: {label_id}")
+        predicate, reaches_hidden = self._compile_query(q)
+        show_hidden = include_spam_trash or reaches_hidden or any(l in HIDDEN_LABELS for l in label_ids or [])
+        ids = []
+        for message_id in self.order:
+            message = self.messages[message_id]
+            if label_ids and not all(l in message.label_ids for l in label_ids):
+                continue
+            if not show_hidden and any(l in HIDDEN_LABELS for l in message.label_ids):
+                continue
+            if predicate(message):
+                ids.append(message_id)
+        self._query_cache[key] = ids
+        return ids
+
+    # --- Resources ---
+
+    def message(self, message_id: str) -> FakeMessage:
+        message = self.messages.get(message_id)
+        if message is None:
+            raise FakeGmailError(404, "notFound", "Requested entity was not found.")
+        return message
+
+    def render(self, message: FakeMessage, fmt: str = "full", metadata_headers: list = None) -> dict:
+        result = {
+            "id": message.id, "threadId": message.thread_id, "labelIds": list(message.label_ids),
+            "snippet": message.snippet, "sizeEstimate": message.size_estimate,
+            "historyId": str(self.history_id), "internalDate": str(message.internal_date),
+        }
+        if fmt == "minimal":
+            return result
+        if fmt == "raw":
+            mime = EmailMessage()
+            for header in message.headers():
+                mime[header["name"]] = header["value"]
+            mime.set_content(message.body)
+            mime.add_alternative(f"<p>{message.body}</p>", subtype="html")
+            result["raw"] = base64.urlsafe_b64encode(mime.as_bytes()).decode("ascii")
+            return result
+        headers = message.headers()
+        if fmt == "metadata":
+            if metadata_headers:
+                wanted = {h.lower() for h in metadata_headers}
+                headers = [h for h in headers if h["name"].lower() in wanted]
+            result["payload"] = {"mimeType": "multipart/alternative", "headers": headers}
+            return result
+        result["payload"] = {
+            "partId": "", "mimeType": "multipart/alternative", "filename": "", "headers": headers, "body": {"size": 0},
+            "parts": [
+                {"partId": "0", "mimeType": "text/plain", "filename": "", "headers": [],
+                 "body": {"size": len(message.body), "data": b64url(message.body)}},
+                {"partId": "1", "mimeType": "text/html", "filename": "", "headers": [],
+                 "body": {"size": len(message.body) + 7, "data": b64url(f"<p>{message.body}</p>")}},
+            ],
+        }
+        return result
+
+    def profile(self) -> dict:
+        return {
+            "emailAddress": self.address, "messagesTotal": len(self.messages),
+            "threadsTotal": len({m.thread_id for m in self.messages.values()}), "historyId": str(self.history_id),
+        }
+
+    def label(self, label_id: str) -> dict:
+        label = self.labels.get(label_id)
+        if label is None:
+            raise FakeGmailError(404, "notFound", "Requested entity was not found.")
+        ids = self.search([label_id], include_spam_trash=True)
+        unread = [i for i in ids if 'UNREAD' in self.messages[i].label_ids]
+        return {
+            **label, "messagesTotal": len(ids), "messagesUnread": len(unread),
+            "threadsTotal": len({self.messages[i].thread_id for i in ids}),
+            "threadsUnread": len({self.messages[i].thread_id for i in unread}),
+        }
+
+    def create_filter(self, body: dict) -> dict:
+        self._filter_seq += 1
+        created = {"id": f"filter{self._filter_seq}", "criteria": body.get("criteria", {}), "action": body.get("action", {})}
+        self.filters[created["id"]] = created
+        return created
+
+    def get_filter(self, filter_id: str) -> dict:
+        if filter_id not in self.filters:
+            raise FakeGmailError(404, "notFound", "Filter not found.")
+        return self.filters[filter_id]
+
+
+class FakeGmailServer:
+    """
+    Routes Gmail API calls to a FakeMailbox, applying the configured quota and
+    429 injection per call (each part of a batch counts as one call, as in Gmail).
+    `quota_units_per_second=None` disables quota enforcement.
+    """
+
+    def __init__(self, mailbox: FakeMailbox, latency: float = 0.0, jitter: float = 0.0,
+                 quota_units_per_second: float = None, quota_burst: float = None,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.mailbox = mailbox
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = (
+            TokenBucket(rate=quota_units_per_second, capacity=quota_burst) if quota_units_per_second else None
+        )
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        # Calls may arrive from several threads (FakeHttp); the mailbox is not thread-safe.
+        self._lock = threading.RLock()
+        self.reset_stats()
+        self._routes = [
+            ("GET", r"profile", "getProfile", self._get_profile),
+            ("GET", r"labels", "labels.list", self._list_labels),
+            ("GET", r"labels/(?P<id>[^/]+)", "labels.get", self._get_label),
+            ("GET", r"messages", "messages.list", self._list_messages),
+            ("POST", r"messages/batchModify", "messages.batchModify", self._batch_modify),
+            ("GET", r"messages/(?P<id>[^/]+)", "messages.get", self._get_message),
+            ("POST", r"messages/(?P<id>[^/]+)/modify", "messages.modify", self._modify),
+            ("POST", r"messages/(?P<id>[^/]+)/trash", "messages.trash", self._trash),
+            ("POST", r"messages/(?P<id>[^/]+)/untrash", "messages.untrash", self._untrash),
+            ("GET", r"history", "history.list", self._list_history),
+            ("GET", r"settings/filters", "settings.filters.list", self._list_filters),
+            ("POST", r"settings/filters", "settings.filters.create", self._create_filter),
+            ("GET", r"settings/filters/(?P<id>[^/]+)", "settings.filters.get", self._get_filter),
+            ("DELETE", r"settings/filters/(?P<id>[^/]+)", "settings.filters.delete", self._delete_filter),
+        ]
+        self._routes = [(verb, re.compile(pattern + "$"), method, handler) for verb, pattern, method, handler in self._routes]
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"http_requests": 0, "calls": 0, "batch_requests": 0, "rate_limited": 0, "by_method": {}}
+
+    def count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def wait_time(self) -> float:
+        """Latency to add to the next HTTP request."""
+        with self._lock:
+            return self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+
+    async def delay(self):
+        wait = self.wait_time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def call(self, http_method: str, path: str, params: dict = None, body: dict = None) -> tuple:
+        """
+        Handles one API call; `path` is relative to /gmail/v1/users/me/ and `params` maps
+        names to lists of values. Returns (status, JSON payload or None).
+        """
+        with self._lock:
+            return self._call(http_method, path, params, body)
+
+    def _call(self, http_method: str, path: str, params: dict, body: dict) -> tuple:
+        for verb, pattern, method, handler in self._routes:
+            match = pattern.match(path)
+            if verb != http_method or match is None:
+                continue
+            self.stats["calls"] += 1
+            self.stats["by_method"][method] = self.stats["by_method"].get(method, 0) + 1
+            try:
+                if (self.error_rate and self._rng.random() < self.error_rate) or \
+                        (self.bucket is not None and not self.bucket.try_acquire(units_for(method))):
+                    raise rate_limit_error()
+                return handler(params or {}, body or {}, **match.groupdict())
+            except FakeGmailError as e:
+                if e.status == 429:
+                    self.stats["rate_limited"] += 1
+                return e.status, e.payload()
+        return 404, FakeGmailError(404, "notFound", f"No fake handler for {http_method} {path}").payload()
+
+    @staticmethod
+    def _one(params: dict, name: str, default=None):
+        values = params.get(name)
+        return values[0] if values else default
+
+    def _flag(self, params: dict, name: str) -> bool:
+        return str(self._one(params, name, "false")).lower() == "true"
+
+    # --- Handlers: (params, body, **path groups) -> (status, payload) ---
+
+    def _get_profile(self, params, body):
+        return 200, self.mailbox.profile()
+
+    def _list_labels(self, params, body):
+        return 200, {"labels": [dict(label) for label in self.mailbox.labels.values()]}
+
+    def _get_label(self, params, body, id):
+        return 200, self.mailbox.label(id)
+
+    def _list_messages(self, params, body):
+        ids = self.mailbox.search(params.get("labelIds"), self._one(params, "q"), self._flag(params, "includeSpamTrash"))
+        max_results = min(int(self._one(params, "maxResults", 100)), 500)
+        offset = int(self._one(params, "pageToken") or 0)
+        page = ids[offset:offset + max_results]
+        result = {"resultSizeEstimate": len(ids)}
+        if page:
+            result["messages"] = [{"id": i, "threadId": self.mailbox.messages[i].thread_id} for i in page]
+        if offset + max_results < len(ids):
+            result["nextPageToken"] = str(offset + max_results)
+        return 200, result
+
+    def _get_message(self, params, body, id):
+        message = self.mailbox.message(id)
+        return 200, self.mailbox.render(message, self._one(params, "format", "full"), params.get("metadataHeaders"))
+
+    def _modify(self, params, body, id):
+        message = self.mailbox.message(id)
+        self.mailbox.relabel(message, body.get("addLabelIds", []), body.get("removeLabelIds", []))
+        return 200, self.mailbox.render(message, "minimal")
+
+    def _trash(self, params, body, id):
+        message = self.mailbox.message(id)
+        self.mailbox.relabel(message, ["TRASH"], [])
+        return 200, self.mailbox.render(message, "minimal")
+
+    def _untrash(self, params, body, id):
+        message = self.mailbox.message(id)
+        self.mailbox.relabel(message, [], ["TRASH"])
+        return 200, self.mailbox.render(message, "minimal")
+
+    def _batch_modify(self, params, body):
+        ids = body.get("ids", [])
+        if len(ids) > 1000:
+            raise FakeGmailError(400, "invalidArgument", "ids must not contain more than 1000 entries.")
+        for message_id in ids:
+            message = self.mailbox.messages.get(message_id)
+            if message is not None:
+                self.mailbox.relabel(message, body.get("addLabelIds", []), body.get("removeLabelIds", []))
+        return 204, None
+
+    def _list_history(self, params, body):
+        start = self._one(params, "startHistoryId")
+        if start is None:
+            raise FakeGmailError(400, "invalidArgument", "startHistoryId is required.")
+        return 200, self.mailbox.list_history(
+            int(start), params.get("historyTypes"), self._one(params, "pageToken"),
+            min(int(self._one(params, "maxResults", 100)), 500),
+        )
+
+    def _list_filters(self, params, body):
+        filters = list(self.mailbox.filters.values())
+        return 200, ({"filter": filters} if filters else {})
+
+    def _create_filter(self, params, body):
+        return 200, self.mailbox.create_filter(body)
+
+    def _get_filter(self, params, body, id):
+        return 200, self.mailbox.get_filter(id)
+
+    def _delete_filter(self, params, body, id):
+        self.mailbox.get_filter(id)
+        del self.mailbox.filters[id]
+        return 204, None
+
+    # --- Batch ---
+
+    def call_batch(self, content_type: str, content: bytes) -> tuple:
+        """Runs every part of a multipart/mixed batch request. Returns (content type, body)."""
+        container = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + content
+        )
+        boundary = f"batch_fake_{self._rng.getrandbits(48):012x}"
+        parts = []
+        for part in container.get_payload() or []:
+            request_text = part.get_payload(decode=False).replace("\r\n", "\n")
+            head, _, body = request_text.partition("\n\n")
+            http_method, target = head.split("\n", 1)[0].split()[:2]
+            url = urlsplit(target)
+            status, payload = self.call(
+                http_method, url.path.removeprefix(USER_PREFIX), parse_qs(url.query), json.loads(body) if body.strip() else None,
+            )
+            content_id = (part.get("Content-ID") or "<>").strip("<>")
+            payload_text = json.dumps(payload) if payload is not None else ""
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n{payload_text}\r\n"
+            )
+        self.count("batch_requests")
+        return f"multipart/mixed; boundary={boundary}", "".join(parts) + f"--{boundary}--\r\n"
+
+
+class FakeHttp:
+    """
+    httplib2.Http stand-in that hands requests straight to a FakeGmailServer in the same
+    process, without sockets (GmailClientPool(http_factory=...)). Used by the benchmarks.
+    """
+
+    timeout = None
+    follow_redirects = True
+    redirect_codes = frozenset()
+
+    def __init__(self, server: FakeGmailServer):
+        self.server = server
+        self.connections = {}
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        self.server.count("http_requests")
+        wait = self.server.wait_time()
+        if wait > 0:
+            time.sleep(wait)
+        url = urlsplit(uri)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if url.path.startswith("/batch"):
+            content_type = {k.lower(): v for k, v in (headers or {}).items()}.get("content-type", "")
+            content_type, content = self.server.call_batch(content_type, body or b"")
+            return httplib2.Response({"status": 200, "content-type": content_type}), content.encode("utf-8")
+        status, payload = self.server.call(
+            method, url.path.removeprefix(USER_PREFIX), parse_qs(url.query), json.loads(body) if body else None
+        )
+        content = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        return httplib2.Response({"status": status, "content-type": "application/json; charset=UTF-8"}), content
+
+    def close(self):
+        pass
+
+
+def create_app(server: FakeGmailServer) -> FastAPI:
+    """The HTTP front of a FakeGmailServer (REST endpoints, batch endpoint, /_fake controls)."""
+    app = FastAPI(title="Fake Gmail API")
+
+    def respond(status: int, payload) -> Response:
+        if payload is None:
+            return Response(status_code=status)
+        return JSONResponse(payload, status_code=status)
+
+    @app.api_route(USER_PREFIX + "{path:path}", methods=["GET", "POST", "DELETE"])
+    async def gmail_call(path: str, request: Request):
+        server.count("http_requests")
+        await server.delay()
+        raw = await request.body()
+        params = {key: request.query_params.getlist(key) for key in request.query_params.keys()}
+        return respond(*server.call(request.method, path, params, json.loads(raw) if raw else None))
+
+    @app.post("/batch/gmail/v1")
+    @app.post("/batch")
+    async def gmail_batch(request: Request):
+        server.count("http_requests")
+        await server.delay()
+        content_type, body = server.call_batch(request.headers.get("content-type", ""), await request.body())
+        return Response(body, media_type=content_type)
+
+    @app.get("/_fake/stats")
+    async def fake_stats():
+        return {**server.stats, "messages": len(server.mailbox.messages), "history_id": server.mailbox.history_id}
+
+    @app.post("/_fake/deliver")
+    async def fake_deliver(count: int = 1):
+        return {"ids": server.mailbox.deliver(count)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=100000, help="Size of the synthetic mailbox.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every HTTP request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, up to this many seconds.")
+    parser.add_argument("--quota", type=float, default=None, help="Per-user quota units per second (default: unlimited).")
+    parser.add_argument("--quota-burst", type=float, default=None, help="Units that may be spent at once (default: --quota).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with an injected 429.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.monotonic()
+    mailbox = FakeMailbox(size=args.messages, seed=args.seed)
+    logging.info(f"Generated {args.messages} messages in {time.monotonic() - started:.1f}s.")
+    server = FakeGmailServer(
+        mailbox, latency=args.latency, jitter=args.jitter, quota_units_per_second=args.quota,
+        quota_burst=args.quota_burst, error_rate=args.error_rate, seed=args.seed,
+    )
+    uvicorn.run(create_app(server), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,43 @@
+import asyncio
 import random
-import os.path
 import logging
+from collections import OrderedDict
 import time
 import ssl
-import base64
-from functools import wraps
-import httplib2
-from google.auth.transport.requests import Request
-from google_auth_httplib2 import AuthorizedHttp
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from functools import partial, wraps
 from googleapiclient.errors import HttpError
 
-from .config import SCOPES, CREDENTIALS_FILE, TOKEN_FILE
+from .config import (
+    METADATA_STORE_ENABLED, METADATA_DB_FILE, METADATA_SYNC_INTERVAL, GMAIL_QUOTA_UNITS_PER_SECOND,
+    EMAIL_CACHE_LABELS_TTL, PREFETCH_QUOTA_RESERVE, SUBJECT_TOPK_CAPACITY, GMAIL_ASYNC_MAX_CONNECTIONS,
+    METADATA_FETCH_WORKERS, GMAIL_QUOTA_BURST_UNITS, GMAIL_API_ROOT, METADATA_SYNC_FETCH_WORKERS,
+    METADATA_SYNC_QUOTA_RESERVE
+)
+from .client_pool import GmailClientPool
+from .async_transport import AsyncGmailTransport
+from .quota import QuotaLimiter, method_for_request, units_for
+from .batch_scheduler import AdaptiveBatchScheduler, group_label_changes
+from .request_usage import GmailCallBudgetExceeded
+from .label_registry import LabelRegistry
+from .detail_cache import EmailDetailCache
+from .metadata_fetcher import MetadataFetcher, extract_headers, LIST_HEADERS, RECIPIENT_HEADERS
+from .records import MessageRecord
+from .prefetcher import DetailPrefetcher
+from .metadata_store import MetadataStore, MetadataSyncWorker
+from . import metrics, mime_parser, request_usage
+from .subjects import NO_SUBJECT, SubjectAggregator
+from .sender_stats import SenderAggregator
+from .counting import MessageCounter, QUERY_LABEL_ALIASES
+
+# Page tokens handed out for pages served from the local metadata store.
+LOCAL_PAGE_TOKEN_PREFIX = "local:"
+
+# How many recently processed IDs a query-driven batch action remembers, to skip
+# messages the search index still returns right after they were modified.
+RECENT_IDS_WINDOW = 50000
+
+# messages.list returns at most 500 IDs per page.
+ID_PAGE_SIZE = 500
 
 # --- Retry Decorator ---
 def retry_on_network_error(max_retries=3, delay=1):
@@ -39,6 +63,7 @@ def retry_on_network_error(max_retries=3, delay=1):
                     # Exponential backoff
                     backoff_delay = delay * (2 ** attempt)
                     logging.info(f"Retrying in {backoff_delay} seconds...")
+                    metrics.observe_backoff('network_retry', backoff_delay)
                     time.sleep(backoff_delay)
         return wrapper
     return decorator
@@ -46,42 +71,115 @@ def retry_on_network_error(max_retries=3, delay=1):
 
 class GmailService:
     def __init__(self):
-        self.service = self._get_gmail_service()
-        self.labels_map, self.all_labels_list = self._get_labels()
+        self.client_pool = GmailClientPool()
+        # Shared per-user quota budget (Gmail allows 250 units/user/second on average).
+        # Every Gmail call takes its quota units here (see _execute and QuotaLimiter.metrics).
+        self.quota = QuotaLimiter(rate=GMAIL_QUOTA_UNITS_PER_SECOND, capacity=GMAIL_QUOTA_BURST_UNITS)
+        self.batch_scheduler = AdaptiveBatchScheduler(self._get_gmail_service, self.quota)
+        # asyncio transport used by the async (a*) methods; shares the quota bucket.
+        self.transport = AsyncGmailTransport(
+            self.client_pool.credentials, self.quota, api_root=GMAIL_API_ROOT,
+            max_connections=GMAIL_ASYNC_MAX_CONNECTIONS
+        )
+        # Labels are fetched on first use and refreshed on TTL expiry, unknown names
+        # and unknown label IDs in history (see LabelRegistry).
+        self.label_registry = LabelRegistry(self._get_labels)
+        # Batches of up to 100 messages.get calls, several in flight, paced by the quota bucket.
+        self.metadata_fetcher = MetadataFetcher(self._get_gmail_service, self.quota, max_workers=METADATA_FETCH_WORKERS)
+        self.detail_cache = EmailDetailCache()
+        self.prefetcher = DetailPrefetcher(
+            # Bodies needing attachment or raw fetches are left to the foreground request.
+            self._get_gmail_service, self.quota, self.detail_cache, partial(self._details_content, allow_fetch=False),
+            reserve=self.quota.capacity * PREFETCH_QUOTA_RESERVE
+        )
+        # The store's backfill/sync runs at low priority: its own fetch workers, and a
+        # quota reserve left to foreground requests.
+        sync_reserve = self.quota.capacity * METADATA_SYNC_QUOTA_RESERVE
+        self.metadata_store = (
+            MetadataStore(
+                METADATA_DB_FILE, quota=self.quota, quota_reserve=sync_reserve,
+                fetcher=MetadataFetcher(
+                    self._get_gmail_service, self.quota, max_workers=METADATA_SYNC_FETCH_WORKERS,
+                    # Batches small enough to be taken while the reserve stays free.
+                    batch_size=max(1, int((self.quota.capacity - sync_reserve) // units_for('messages.get'))),
+                    reserve=sync_reserve, name="metadata-sync-fetch"
+                )
+            ) if METADATA_STORE_ENABLED else None
+        )
+        if self.metadata_store is not None:
+            self.metadata_store.on_label_ids = self.label_registry.observe_label_ids
+        self._metadata_sync = None
+        self.counter = MessageCounter(
+            service_factory=self._get_gmail_service,
+            execute=self._execute_with_retry,
+            store_provider=self._local_store
+        )
+
+    # --- Local Metadata Store ---
+
+    def start_metadata_sync(self):
+        """Starts the background backfill/history sync of the local metadata store."""
+        if self.metadata_store is None or self._metadata_sync is not None:
+            return
+        self._metadata_sync = MetadataSyncWorker(
+            self.metadata_store, self._get_gmail_service, interval=METADATA_SYNC_INTERVAL
+        )
+        self._metadata_sync.start()
+
+    def stop_metadata_sync(self):
+        if self._metadata_sync is not None:
+            self._metadata_sync.stop()
+            self._metadata_sync = None
+
+    def _local_store(self):
+        """Returns the metadata store if it is fully backfilled, otherwise None."""
+        try:
+            if self.metadata_store is not None and self.metadata_store.is_ready():
+                return self.metadata_store
+        except Exception as e:
+            logging.warning(f"Metadata store unavailable, falling back to Gmail: {e}")
+        return None
+
+    def _apply_local_label_delta(self, ids: list, add_label_ids: list = None, remove_label_ids: list = None):
+        """Mirrors a label change we just made in Gmail into the local store and caches."""
+        self.counter.invalidate()
+        self.detail_cache.apply_label_delta(ids, add_label_ids, remove_label_ids)
+        if self.metadata_store is None:
+            return
+        try:
+            self.metadata_store.apply_label_delta(ids, add_label_ids, remove_label_ids)
+        except Exception as e:
+            logging.warning(f"Failed to update metadata store after modification: {e}")
+        if self._metadata_sync is not None:
+            self._metadata_sync.trigger()
+
+    def _list_emails_local(self, store: MetadataStore, label_ids: list, page_token: str, max_results: int) -> dict:
+        """Serves a list_emails page from the local metadata store. Raises ValueError on a malformed page token."""
+        offset = 0
+        if page_token:
+            offset_text = page_token[len(LOCAL_PAGE_TOKEN_PREFIX):]
+            if not offset_text.isascii() or not offset_text.isdigit():
+                raise ValueError(f"Invalid page token '{page_token}'")
+            offset = int(offset_text)
+        total = store.count(label_ids)
+        emails = store.list_messages(label_ids, offset=offset, limit=max_results)
+        next_offset = offset + max_results
+        return {
+            "emails": emails,
+            "total_estimate": total,
+            "next_page_token": f"{LOCAL_PAGE_TOKEN_PREFIX}{next_offset}" if next_offset < total else None
+        }
+
+    @property
+    def service(self):
+        """The calling thread's pooled Gmail client."""
+        return self._get_gmail_service()
 
     @retry_on_network_error()
     def _get_gmail_service(self):
-        """Authenticates with the Gmail API and returns the service object."""
-        creds = None
+        """Returns this thread's authorized Gmail client from the shared pool."""
         try:
-            if os.path.exists(TOKEN_FILE):
-                creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-            
-            if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    logging.info("Refreshing expired credentials.")
-                    creds.refresh(Request())
-                else:
-                    logging.info("Performing new user authentication.")
-                    if not os.path.exists(CREDENTIALS_FILE):
-                        logging.error(f"CRITICAL: Credentials file '{CREDENTIALS_FILE}' not found.")
-                        raise FileNotFoundError(
-                            f"Error: '{CREDENTIALS_FILE}' not found. "
-                            "Please download it from the Google Cloud Console and place it in the root directory."
-                        )
-                    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-                    creds = flow.run_local_server(port=0)
-                
-                with open(TOKEN_FILE, 'w') as token:
-                    token.write(creds.to_json())
-            
-            # Create an HTTP object with a timeout
-            # This ensures that if a batch request hangs (e.g. lost packets), it will eventually timeout and fail
-            # allowing the application to recover or retry, rather than freezing indefinitely.
-            http = httplib2.Http(timeout=30)
-            authed_http = AuthorizedHttp(creds, http=http)
-            
-            return build('gmail', 'v1', http=authed_http, cache_discovery=False)
+            return self.client_pool.get()
         except Exception as e:
             logging.error(f"An unexpected error occurred during service initialization: {e}", exc_info=True)
             return None
@@ -91,28 +189,33 @@ class GmailService:
         """Fetches all user labels and returns both a map and a list."""
         try:
             logging.info("Fetching user labels from Gmail API.")
-            results = self.service.users().labels().list(userId='me').execute()
+            results = self._execute(self.service.users().labels().list(userId='me'))
             labels = results.get('labels', [])
             labels_map = {label['name'].upper(): label['id'] for label in labels}
             structured_labels = [{"id": l["id"], "name": l["name"], "type": l.get("type", "user")} for l in labels]
             return labels_map, structured_labels
         except HttpError as error:
             logging.error(f"An HttpError occurred while fetching labels: {error.content}", exc_info=True)
-            return {}, []
+            raise
+
+    @property
+    def labels_map(self) -> dict:
+        """Upper-cased label name -> label ID, from the label registry."""
+        return self.label_registry.labels_map
+
+    @property
+    def all_labels_list(self) -> list:
+        return self.label_registry.labels_list
+
+    def resolve_label_id(self, name: str):
+        """Returns the ID of the label called `name`, refreshing the labels once if it is unknown."""
+        return self.label_registry.resolve(name)
 
     @retry_on_network_error()
     def get_all_labels(self) -> list:
         """Returns the structured list of all labels."""
         return self.all_labels_list
     
-    def _get_accurate_label_count(self, label_id: str) -> int:
-        """Fetches the accurate message count for a specific label."""
-        try:
-            label = self.service.users().labels().get(userId='me', id=label_id).execute()
-            return label.get('messagesTotal', 0)
-        except Exception:
-            return 0
-
     def _construct_query(self, filters: dict) -> str:
         query_parts = []
         if filters.get("from_sender"): query_parts.append(f'from:({filters["from_sender"]})')
@@ -120,208 +223,239 @@ class GmailService:
         if filters.get("subject"): query_parts.append(f'subject:({filters["subject"]})')
         if filters.get("after_date"): query_parts.append(f'after:{filters["after_date"].replace("-", "/")}')
         if filters.get("before_date"): query_parts.append(f'before:{filters["before_date"].replace("-", "/")}')
+        # Epoch seconds: limits a select-all batch action to mail that had arrived by then.
+        if filters.get("received_before"): query_parts.append(f'before:{int(filters["received_before"])}')
         return " ".join(query_parts)
 
     @retry_on_network_error()
-    def list_emails(self, label_ids: list, page_token: str = None, max_results: int = 25, **filters) -> dict:
-        """Lists emails with filtering, pagination, and query construction using batch requests."""
+    def list_emails(self, label_ids: list, page_token: str = None, max_results: int = 25, prefetch: bool = False, **filters) -> dict:
+        """
+        Lists emails with filtering, pagination, and query construction using batch requests.
+        With prefetch, the full content of the returned page is fetched in the background
+        (replacing any earlier prefetch) so opening one of these emails is instant.
+        """
+        result = self._list_emails_page(label_ids, page_token, max_results, **filters)
+        if prefetch:
+            self.prefetcher.enqueue([email['id'] for email in result['emails'] if email])
+        return result
+
+    def _list_emails_page(self, label_ids: list, page_token: str = None, max_results: int = 25, **filters) -> dict:
         try:
             query = self._construct_query(filters)
+            store = self._local_store()
+            if store and not query and (not page_token or page_token.startswith(LOCAL_PAGE_TOKEN_PREFIX)):
+                return self._list_emails_local(store, label_ids, page_token, max_results)
+            if page_token and page_token.startswith(LOCAL_PAGE_TOKEN_PREFIX):
+                # The store went away between two pages; restart from Gmail's first page.
+                page_token = None
+
             logging.info(f"Executing search with query: '{query}', labels: {label_ids}")
 
-            results = self.service.users().messages().list(
+            results = self._execute(self.service.users().messages().list(
                 userId='me',
                 labelIds=label_ids,
                 q=query,
                 pageToken=page_token,
                 maxResults=max_results
-            ).execute()
+            ))
             
             messages = results.get('messages', [])
             total_estimate = results.get('resultSizeEstimate', 0)
             next_page_token = results.get('nextPageToken')
             
-            # Accurate count logic:
-            # If we have a simple label view, get the label count (fast).
-            if not query and len(label_ids) == 1:
-                 accurate_count = self._get_accurate_label_count(label_ids[0])
-                 if accurate_count > 0:
-                     total_estimate = accurate_count
-            # If we have a query and there's a next page, the estimate is likely inaccurate.
-            # We traverse IDs to count the real total. This can be slow for huge result sets,
-            # but provides the accurate pagination user requested.
-            elif query or next_page_token:
-                # Start with current page count
-                total_count = len(messages) if not page_token else 0 # If page_token exists, we are mid-stream, count is tricky without full re-scan.
-                
-                # Actually, for consistent "1-25 of X", X needs to be the global total. 
-                # If we are on page 1 (no page_token) and there is a next page, we count.
-                if not page_token and next_page_token:
-                    logging.info("Counting remaining messages for accurate pagination...")
-                    temp_token = next_page_token
-                    while temp_token:
-                        # Fetch minimal fields for speed
-                        cnt_res = self.service.users().messages().list(
-                            userId='me', labelIds=label_ids, q=query, pageToken=temp_token, maxResults=500, fields="nextPageToken,messages(id)"
-                        ).execute()
-                        total_count += len(cnt_res.get('messages', []))
-                        temp_token = cnt_res.get('nextPageToken')
-                    
-                    total_estimate = total_count
-            
-            # Pre-allocate list
-            emails = [None] * len(messages)
-            
-            if messages:
-                # Callback function for batch processing
-                def batch_callback(request_id, response, exception):
-                    idx = int(request_id)
-                    if exception:
-                        logging.warning(f"Error fetching details for message index {idx}: {exception}")
-                        return
-
-                    headers = response.get('payload', {}).get('headers', [])
-                    label_ids_list = response.get('labelIds', [])
-                    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-                    date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-                    
-                    emails[idx] = {
-                        "id": response['id'], 
-                        "thread_id": response['threadId'], 
-                        "snippet": response['snippet'],
-                        "subject": subject, 
-                        "sender": sender,
-                        "date": date,
-                        "is_unread": 'UNREAD' in label_ids_list
-                    }
-
-                # Reduced chunk size to 10 to strictly avoid concurrency limits
-                chunk_size = 10
-                for i in range(0, len(messages), chunk_size):
-                    batch = self.service.new_batch_http_request(callback=batch_callback)
-                    chunk = messages[i:i + chunk_size]
-                    
-                    for j, message in enumerate(chunk):
-                        # request_id stores the global index to place the result back correctly
-                        global_index = i + j
-                        batch.add(
-                            self.service.users().messages().get(
-                                userId='me', 
-                                id=message['id'], 
-                                format='metadata', 
-                                metadataHeaders=['Subject', 'From', 'Date']
-                            ),
-                            request_id=str(global_index)
-                        )
-                    
-                    logging.info(f"Executing batch request for messages {i} to {i + len(chunk)}...")
-                    try:
-                        batch.execute()
-                        # Add delay to respect rate limits
-                        time.sleep(0.1)
-                    except Exception as e:
-                        logging.error(f"Batch execution failed for list_emails chunk {i}: {e}")
-
-            # Filter out any emails that failed to load (None entries)
-            valid_emails = [e for e in emails if e is not None]
+            if not page_token and not next_page_token:
+                # Everything fits on this page.
+                total = {"count": len(messages), "exact": True}
+            else:
+                total = self._listing_total(label_ids, query, total_estimate)
             
-            return {
-                "emails": valid_emails,
-                "total_estimate": total_estimate,
-                "next_page_token": next_page_token
-            }
+            # Hydrate the page's headers; messages that failed to load are left out.
+            records = self.metadata_fetcher.fetch_records([m['id'] for m in messages])
+            return self._listing_page([record.to_email() for record in records], total, next_page_token)
         except HttpError as error:
             logging.error(f"HttpError in list_emails: {error.content}", exc_info=True)
             raise Exception(f"Failed to fetch emails: {error}")
 
-    def get_email_ids(self, label_ids: list, **filters) -> list:
-        """Fetches ONLY email IDs for a given query. Used for batch actions."""
-        try:
-            query = self._construct_query(filters)
-            logging.info(f"Fetching all IDs for query: '{query}', labels: {label_ids}")
+    def _listing_total(self, label_ids: list, query: str, estimate: int) -> dict:
+        """
+        Total count: exact whenever it is cheap (local store, label counters, a
+        previously computed count). Otherwise Gmail's estimate right away; the exact
+        total is computed in the background and can be polled through /emails/count
+        with the returned fingerprint.
+        """
+        return self.counter.count(label_ids=label_ids, query=query, mode="estimate", estimate=estimate)
+
+    @staticmethod
+    def _listing_page(emails: list, total: dict, next_page_token) -> dict:
+        return {
+            "emails": emails,
+            "total_estimate": total["count"],
+            "total_is_exact": total["exact"],
+            "count_fingerprint": None if total["exact"] else total["fingerprint"],
+            "next_page_token": next_page_token
+        }
+
+    def get_count_status(self, fingerprint: str, wait: float = 0):
+        """Returns the (possibly still running) exact count for a list_emails count fingerprint."""
+        return self.counter.status(fingerprint, wait=wait)
+
+    def _list_id_page(self, label_ids: list, query: str, page_token: str = None) -> tuple[list, str]:
+        """Fetches one page (up to ID_PAGE_SIZE) of message IDs. Returns (ids, next_page_token)."""
+        results = self._execute_with_retry(self.service.users().messages().list(
+            userId='me',
+            labelIds=label_ids,
+            q=query,
+            pageToken=page_token,
+            maxResults=ID_PAGE_SIZE,
+            fields="nextPageToken,messages(id)",
+            includeSpamTrash=False
+        ))
+        return [m['id'] for m in results.get('messages', [])], results.get('nextPageToken')
+
+    def _iter_id_pages(self, label_ids: list, query: str):
+        """Yields message IDs one messages.list page at a time, so callers never hold more than a page."""
+        page_token = None
+        while True:
+            ids, page_token = self._list_id_page(label_ids, query, page_token)
+            if ids:
+                yield ids
+            if not page_token:
+                return
 
+    def iter_email_ids(self, label_ids: list, **filters):
+        """
+        Yields the IDs matching a query one page (up to 500) at a time, as soon as Gmail
+        returns each page. Used to stream IDs without holding the full list.
+        """
+        query = self._construct_query(filters)
+        store = self._local_store()
+        if store and not query:
+            ids = store.list_ids(label_ids)
+            for start in range(0, len(ids), ID_PAGE_SIZE):
+                yield ids[start:start + ID_PAGE_SIZE]
+            return
+        logging.info(f"Fetching all IDs for query: '{query}', labels: {label_ids}")
+        yield from self._iter_id_pages(label_ids, query)
+
+    def get_email_ids(self, label_ids: list, progress=None, **filters) -> list:
+        """
+        Fetches ONLY email IDs for a given query. Used for batch actions.
+        `progress(processed, failed, total)` is called after every page (total unknown).
+        """
+        try:
             all_ids = []
-            page_token = None
-            
-            while True:
-                # Fetch only IDs to be fast
-                results = self.service.users().messages().list(
-                    userId='me',
-                    labelIds=label_ids,
-                    q=query,
-                    pageToken=page_token,
-                    maxResults=500,
-                    fields="nextPageToken,messages(id)",
-                    includeSpamTrash=False
-                ).execute()
-                
-                messages = results.get('messages', [])
-                all_ids.extend([m['id'] for m in messages])
-                
-                page_token = results.get('nextPageToken')
-                if not page_token:
-                    break
+            for page in self.iter_email_ids(label_ids, **filters):
+                all_ids.extend(page)
+                if progress:
+                    progress(len(all_ids), 0, None)
             
             return all_ids
         except HttpError as error:
             logging.error(f"HttpError in get_email_ids: {error.content}", exc_info=True)
             raise Exception(f"Failed to fetch email IDs: {error}")
         
-    def _parse_email_body(self, payload) -> str:
-        """Recursively parses the email payload to find the HTML or plain text body."""
-        if "parts" in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/html':
-                    data = part['body'].get('data')
-                    if data:
-                        return base64.urlsafe_b64decode(data.encode('ASCII')).decode('utf-8')
-                # Recurse for multipart messages
-                body = self._parse_email_body(part)
-                if body:
-                    return body
-        elif payload['mimeType'] == 'text/html':
-             data = payload['body'].get('data')
-             if data:
-                return base64.urlsafe_b64decode(data.encode('ASCII')).decode('utf-8')
-        # Fallback to plain text
-        elif payload['mimeType'] == 'text/plain' and 'data' in payload['body']:
-            data = payload['body'].get('data')
-            if data:
-                 return base64.urlsafe_b64decode(data.encode('ASCII')).decode('utf-8').replace('\n', '<br>')
-        return ""
+    def _parse_email_body(self, msg: dict, allow_fetch: bool = True):
+        """
+        Returns (body, truncated) for a format='full' message: the HTML or plain text part,
+        decoded up to EMAIL_BODY_MAX_BYTES. Bodies stored as attachments are fetched on
+        demand; messages without a usable part are re-fetched raw and parsed locally.
+        Without `allow_fetch`, returns None instead of making either call.
+        """
+        email_id = msg['id']
+        needs_fetch = False
+
+        def fetch_attachment(attachment_id):
+            nonlocal needs_fetch
+            if not allow_fetch:
+                needs_fetch = True
+                return ''
+            attachment = self._execute(self.service.users().messages().attachments().get(
+                userId='me', messageId=email_id, id=attachment_id
+            ))
+            return attachment.get('data', '')
+
+        parsed = mime_parser.parse_payload(msg.get('payload', {}), fetch_attachment)
+        if parsed is None and msg.get('payload', {}).get('mimeType', '').startswith('multipart/'):
+            if not allow_fetch:
+                return None
+            logging.info(f"No body part found for email '{email_id}', falling back to the raw message.")
+            raw = self._execute(self.service.users().messages().get(userId='me', id=email_id, format='raw'))
+            parsed = mime_parser.parse_raw(raw.get('raw', ''))
+        if needs_fetch:
+            return None
+        return parsed or ("", False)
 
     @retry_on_network_error()
     def get_email_details(self, email_id: str) -> dict:
-        """Gets the full details of a single email, including a parsed body."""
+        """
+        Gets the full details of a single email, including a parsed body.
+        The parsed content is served from the detail cache when possible; only the
+        label state is re-checked (from the metadata store, or a minimal fetch once
+        the cached labels are older than EMAIL_CACHE_LABELS_TTL).
+        """
         try:
-            msg = self.service.users().messages().get(userId='me', id=email_id, format='full').execute()
-            headers = msg.get('payload', {}).get('headers', [])
+            cached = self.detail_cache.get(email_id)
+            if cached is None and self.prefetcher.wait_for(email_id):
+                cached = self.detail_cache.get(email_id)
+            if cached is not None:
+                content, label_ids, labels_age = cached
+                label_ids = self._current_label_ids(email_id, label_ids, labels_age)
+                return dict(content, is_unread='UNREAD' in label_ids)
+
+            msg = self._execute(self.service.users().messages().get(userId='me', id=email_id, format='full'))
+            content = self._details_content(msg)
             label_ids_list = msg.get('labelIds', [])
-            
-            details = {
-                "id": msg['id'],
-                "thread_id": msg['threadId'],
-                "snippet": msg['snippet'],
-                "subject": next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject'),
-                "sender": next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender'),
-                "to": ", ".join([h['value'] for h in headers if h['name'] in ['To', 'Cc', 'Bcc']]),
-                "date": next((h['value'] for h in headers if h['name'] == 'Date'), ''),
-                "body": self._parse_email_body(msg.get('payload', {})),
-                "is_unread": 'UNREAD' in label_ids_list
-            }
-            return details
+            self.detail_cache.put(email_id, content, label_ids_list)
+            return dict(content, is_unread='UNREAD' in label_ids_list)
         except HttpError as error:
             logging.error(f"HttpError getting details for email '{email_id}': {error.content}", exc_info=True)
             raise Exception("Failed to get email details.")
 
+    def _details_content(self, msg: dict, allow_fetch: bool = True):
+        """
+        The immutable, cacheable part of get_email_details for a format='full' message.
+        Without `allow_fetch`, returns None when the body needs further Gmail calls.
+        """
+        headers = extract_headers(msg.get('payload', {}).get('headers', []), LIST_HEADERS, multi=RECIPIENT_HEADERS)
+        content = {
+            "id": msg['id'],
+            "thread_id": msg['threadId'],
+            "snippet": msg['snippet'],
+            "subject": headers.get('Subject') or NO_SUBJECT,
+            "sender": headers.get('From', 'Unknown Sender'),
+            "to": ", ".join(value for name in RECIPIENT_HEADERS for value in headers.get(name, [])),
+            "date": headers.get('Date', ''),
+        }
+        body = self._parse_email_body(msg, allow_fetch)
+        if body is None:
+            return None
+        content["body"], content["body_truncated"] = body
+        return content
+
+    def _current_label_ids(self, email_id: str, cached_label_ids, labels_age) -> list:
+        """Label IDs for a cached message: from the store, the cache if fresh, else a minimal fetch."""
+        store = self._local_store()
+        if store is not None:
+            label_ids = store.get_label_ids(email_id)
+            if label_ids is not None:
+                return label_ids
+        if cached_label_ids is not None and labels_age < EMAIL_CACHE_LABELS_TTL:
+            return cached_label_ids
+        msg = self._execute(self.service.users().messages().get(
+            userId='me', id=email_id, format='minimal', fields='labelIds'
+        ))
+        label_ids = msg.get('labelIds', [])
+        self.detail_cache.set_labels(email_id, label_ids)
+        return label_ids
+
     @retry_on_network_error()
     def trash_email(self, email_id: str):
         """Moves an email to the trash."""
         try:
             logging.info(f"Moving email '{email_id}' to trash.")
-            service = self._get_gmail_service() # Use new service instance
-            service.users().messages().trash(userId='me', id=email_id).execute()
+            service = self._get_gmail_service()
+            self._execute(service.users().messages().trash(userId='me', id=email_id))
+            self._apply_local_label_delta([email_id], add_label_ids=['TRASH'])
             logging.info(f"Successfully moved email '{email_id}' to trash.")
         except HttpError as error:
             logging.error(f"HttpError trashing email '{email_id}': {error.content}", exc_info=True)
@@ -342,14 +476,15 @@ class GmailService:
         """
         try:
             logging.info(f"Modifying email '{email_id}': ADD {add_label_ids}, REMOVE {remove_label_ids}")
-            service = self._get_gmail_service() # Use new service instance
+            service = self._get_gmail_service()
             body = {
                 'addLabelIds': add_label_ids,
                 'removeLabelIds': remove_label_ids
             }
-            service.users().messages().modify( # Use new service instance
+            self._execute(service.users().messages().modify(
                 userId='me', id=email_id, body=body
-            ).execute()
+            ))
+            self._apply_local_label_delta([email_id], add_label_ids, remove_label_ids)
             logging.info(f"Successfully modified labels for email '{email_id}'.")
         except HttpError as error:
             logging.error(f"HttpError modifying email '{email_id}': {error.content}", exc_info=True)
@@ -360,8 +495,8 @@ class GmailService:
         Modifies labels by name by translating them to IDs first.
         Also marks the email as read by removing the 'UNREAD' label.
         """
-        add_label_ids = [self.labels_map.get(name.upper()) for name in add_label_names if self.labels_map.get(name.upper())]
-        remove_label_ids = [self.labels_map.get(name.upper()) for name in remove_label_names if self.labels_map.get(name.upper())]
+        add_label_ids = [label_id for label_id in map(self.resolve_label_id, add_label_names) if label_id]
+        remove_label_ids = [label_id for label_id in map(self.resolve_label_id, remove_label_names) if label_id]
         
         if 'UNREAD' not in remove_label_ids:
              remove_label_ids.append('UNREAD')
@@ -376,57 +511,281 @@ class GmailService:
         logging.info(f"Archiving email '{email_id}'.")
         self.modify_email(email_id, add_label_ids=[], remove_label_ids=['INBOX', 'UNREAD'])
 
-    def perform_batch_action(self, action: str, ids: list = None, query_params: dict = None, add_labels: list = None, remove_labels: list = None):
-        # NOTE: Logic for fetching IDs based on query has been moved to get_email_ids 
-        # and is now handled by the frontend calling that endpoint first.
-        # This method now expects a list of IDs.
-        
+    # --- Async variants ---
+    # Same results as their blocking counterparts, but Gmail calls go through the
+    # AsyncGmailTransport, so they never hold a worker thread while waiting on Gmail.
+    # Local work that may block (label refresh, exact-count bookkeeping, body parsing
+    # with on-demand attachment fetches, metadata store queries and the detail cache,
+    # whose misses read from disk) runs in a worker thread.
+
+    async def aget_all_labels(self) -> list:
+        return await asyncio.to_thread(self.get_all_labels)
+
+    async def aresolve_label_id(self, name: str):
+        return await asyncio.to_thread(self.resolve_label_id, name)
+
+    async def alist_emails(self, label_ids: list, page_token: str = None, max_results: int = 25,
+                           prefetch: bool = False, **filters) -> dict:
+        """Async list_emails."""
+        query = self._construct_query(filters)
+        store = await asyncio.to_thread(self._local_store)
+        if store and not query and (not page_token or page_token.startswith(LOCAL_PAGE_TOKEN_PREFIX)):
+            result = await asyncio.to_thread(self._list_emails_local, store, label_ids, page_token, max_results)
+        else:
+            if page_token and page_token.startswith(LOCAL_PAGE_TOKEN_PREFIX):
+                page_token = None
+            result = await self._alist_emails_page(label_ids, query, page_token, max_results)
+        if prefetch:
+            self.prefetcher.enqueue([email['id'] for email in result['emails'] if email])
+        return result
+
+    async def _alist_emails_page(self, label_ids: list, query: str, page_token: str, max_results: int) -> dict:
+        logging.info(f"Executing search with query: '{query}', labels: {label_ids}")
+        params = {"labelIds": label_ids, "q": query, "pageToken": page_token, "maxResults": max_results}
+        try:
+            results = await self.transport.request(
+                'messages.list', 'GET', 'messages', params={k: v for k, v in params.items() if v}
+            )
+        except HttpError as error:
+            logging.error(f"HttpError in list_emails: {error.content}", exc_info=True)
+            raise Exception(f"Failed to fetch emails: {error}")
+
+        messages = results.get('messages', [])
+        next_page_token = results.get('nextPageToken')
+        if not page_token and not next_page_token:
+            total = {"count": len(messages), "exact": True}
+        else:
+            total = await asyncio.to_thread(
+                self._listing_total, label_ids, query, results.get('resultSizeEstimate', 0)
+            )
+
+        # Hydrate the page's headers in one batch; messages that failed to load are left out.
+        responses = await self.transport.batch('messages.get', [
+            (m['id'], f"messages/{m['id']}", {"format": "metadata", "metadataHeaders": list(LIST_HEADERS)})
+            for m in messages
+        ])
+        emails = [
+            MessageRecord.from_message(responses[m['id']]).to_email()
+            for m in messages if isinstance(responses.get(m['id']), dict)
+        ]
+        return self._listing_page(emails, total, next_page_token)
+
+    async def aget_email_details(self, email_id: str) -> dict:
+        """Async get_email_details."""
+        try:
+            cached = await asyncio.to_thread(self.detail_cache.get, email_id)
+            if cached is None and self.prefetcher.is_fetching(email_id):
+                await asyncio.to_thread(self.prefetcher.wait_for, email_id)
+                cached = await asyncio.to_thread(self.detail_cache.get, email_id)
+            if cached is not None:
+                content, label_ids, labels_age = cached
+                label_ids = await self._acurrent_label_ids(email_id, label_ids, labels_age)
+                return dict(content, is_unread='UNREAD' in label_ids)
+
+            msg = await self.transport.request('messages.get', 'GET', f"messages/{email_id}", {"format": "full"})
+            content = await asyncio.to_thread(self._details_content, msg)
+            label_ids = msg.get('labelIds', [])
+            await asyncio.to_thread(self.detail_cache.put, email_id, content, label_ids)
+            return dict(content, is_unread='UNREAD' in label_ids)
+        except HttpError as error:
+            logging.error(f"HttpError getting details for email '{email_id}': {error.content}", exc_info=True)
+            raise Exception("Failed to get email details.")
+
+    async def _acurrent_label_ids(self, email_id: str, cached_label_ids, labels_age) -> list:
+        """Async _current_label_ids."""
+        store = await asyncio.to_thread(self._local_store)
+        if store is not None:
+            label_ids = await asyncio.to_thread(store.get_label_ids, email_id)
+            if label_ids is not None:
+                return label_ids
+        if cached_label_ids is not None and labels_age < EMAIL_CACHE_LABELS_TTL:
+            return cached_label_ids
+        msg = await self.transport.request(
+            'messages.get', 'GET', f"messages/{email_id}", {"format": "minimal", "fields": "labelIds"}
+        )
+        label_ids = msg.get('labelIds', [])
+        self.detail_cache.set_labels(email_id, label_ids)
+        return label_ids
+
+    async def atrash_email(self, email_id: str):
+        """Async trash_email."""
+        try:
+            logging.info(f"Moving email '{email_id}' to trash.")
+            await self.transport.request('messages.trash', 'POST', f"messages/{email_id}/trash")
+            await asyncio.to_thread(self._apply_local_label_delta, [email_id], add_label_ids=['TRASH'])
+            logging.info(f"Successfully moved email '{email_id}' to trash.")
+        except HttpError as error:
+            logging.error(f"HttpError trashing email '{email_id}': {error.content}", exc_info=True)
+            raise Exception("Failed to move email to trash.")
+
+    async def amodify_email(self, email_id: str, add_label_ids: list, remove_label_ids: list):
+        """Async modify_email."""
+        try:
+            logging.info(f"Modifying email '{email_id}': ADD {add_label_ids}, REMOVE {remove_label_ids}")
+            await self.transport.request('messages.modify', 'POST', f"messages/{email_id}/modify", body={
+                'addLabelIds': add_label_ids,
+                'removeLabelIds': remove_label_ids
+            })
+            await asyncio.to_thread(self._apply_local_label_delta, [email_id], add_label_ids, remove_label_ids)
+            logging.info(f"Successfully modified labels for email '{email_id}'.")
+        except HttpError as error:
+            logging.error(f"HttpError modifying email '{email_id}': {error.content}", exc_info=True)
+            raise Exception(f"Failed to modify email labels: {error}")
+
+    async def amodify_email_by_name(self, email_id: str, add_label_names: list, remove_label_names: list):
+        """Async modify_email_by_name."""
+        add_label_ids = [label_id for label_id in [await self.aresolve_label_id(n) for n in add_label_names] if label_id]
+        remove_label_ids = [label_id for label_id in [await self.aresolve_label_id(n) for n in remove_label_names] if label_id]
+        if 'UNREAD' not in remove_label_ids:
+            remove_label_ids.append('UNREAD')
+        await self.amodify_email(email_id, add_label_ids, remove_label_ids)
+
+    async def aarchive_email(self, email_id: str):
+        """Async archive_email."""
+        logging.info(f"Archiving email '{email_id}'.")
+        await self.amodify_email(email_id, add_label_ids=[], remove_label_ids=['INBOX', 'UNREAD'])
+
+    def _batch_label_delta(self, action: str, add_labels: list = None, remove_labels: list = None):
+        """Returns the (addLabelIds, removeLabelIds) a label-changing batch action applies."""
+        if action == 'archive':
+            return [], ['INBOX', 'UNREAD']
+        if action == 'assign_labels':
+            add_ids = [label_id for label_id in map(self.resolve_label_id, add_labels or []) if label_id]
+            remove_ids = [label_id for label_id in map(self.resolve_label_id, remove_labels or []) if label_id]
+            if 'UNREAD' not in remove_ids: remove_ids.append('UNREAD')
+            return add_ids, remove_ids
+        if action == 'mark_read':
+            return [], ['UNREAD']
+        if action == 'mark_unread':
+            return ['UNREAD'], []
+        raise ValueError(f"Unknown batch action '{action}'")
+
+    def perform_batch_action(self, action: str, ids: list = None, query_params: dict = None, add_labels: list = None, remove_labels: list = None, progress=None) -> dict:
+        """
+        Applies `action` (archive, trash, assign_labels, mark_read, mark_unread) to every ID.
+        Actions on everything matching a query go through perform_batch_action_matching.
+        Label actions use messages.batchModify in 1000-ID slices; trash has no bulk
+        equivalent and goes through quota-aware, adaptively sized batches with retries
+        of failed sub-requests (AdaptiveBatchScheduler). Returns per-ID results:
+        {"action": ..., "total": n, "succeeded": [ids], "failed": [{"id": ..., "error": ...}]}.
+        `progress(processed, failed, total)` is called after every batch (see JobContext).
+        """
         if not ids:
             logging.warning("Batch Action: No emails found to process.")
-            return
+            return {"action": action, "total": 0, "succeeded": [], "failed": []}
 
         logging.info(f"Batch Action: Processing {len(ids)} emails with action '{action}'")
 
-        def batch_callback(request_id, response, exception):
-            if exception:
-                logging.error(f"Error in batch action for id {request_id}: {exception}")
+        if action == 'trash':
+            add_ids, remove_ids = ['TRASH'], []
+        else:
+            add_ids, remove_ids = self._batch_label_delta(action, add_labels, remove_labels)
+        result = self._run_batch(action, ids, add_ids, remove_ids, progress=progress)
+        return {"action": action, "total": len(ids), "succeeded_count": len(result["succeeded"]), **result}
 
-        service = self._get_gmail_service() # Use new service instance
-        # Reduced chunk size to 10 for modification operations to ensure high stability
-        chunk_size = 10
-        for i in range(0, len(ids), chunk_size):
-            chunk = ids[i:i + chunk_size]
-            batch = service.new_batch_http_request(callback=batch_callback) # Use new service instance
-            
-            for email_id in chunk:
-                if action == 'trash':
-                    batch.add(service.users().messages().trash(userId='me', id=email_id)) # Use new service instance
-                elif action == 'archive':
-                     batch.add(service.users().messages().modify( # Use new service instance
-                        userId='me', id=email_id, body={'removeLabelIds': ['INBOX', 'UNREAD']}
-                    ))
-                elif action == 'assign_labels':
-                    add_ids = [self.labels_map.get(n.upper()) for n in (add_labels or []) if self.labels_map.get(n.upper())]
-                    remove_ids = [self.labels_map.get(n.upper()) for n in (remove_labels or []) if self.labels_map.get(n.upper())]
-                    if 'UNREAD' not in remove_ids: remove_ids.append('UNREAD')
-                    batch.add(service.users().messages().modify( # Use new service instance
-                        userId='me', id=email_id, body={'addLabelIds': add_ids, 'removeLabelIds': remove_ids}
-                    ))
-                elif action == 'mark_read':
-                    batch.add(service.users().messages().modify( # Use new service instance
-                        userId='me', id=email_id, body={'removeLabelIds': ['UNREAD']}
-                    ))
-                elif action == 'mark_unread':
-                    batch.add(service.users().messages().modify( # Use new service instance
-                        userId='me', id=email_id, body={'addLabelIds': ['UNREAD']}
-                    ))
-            
-            try:
-                batch.execute()
-                # Add significant delay to respect rate limits and avoid 429 errors during heavy processing
-                time.sleep(1.0)
-            except Exception as e:
-                 logging.error(f"Batch execution failed for chunk {i}: {e}")
+    def _run_batch(self, action: str, ids: list, add_ids: list, remove_ids: list, progress=None) -> dict:
+        """Sends one batch action for `ids` to Gmail and mirrors the successes locally."""
+        succeeded, result = [], None
+        try:
+            if action == 'trash':
+                # No bulk equivalent for trash: one messages.trash per ID, batched.
+                def build_request(service, email_id):
+                    return service.users().messages().trash(userId='me', id=email_id)
+
+                result = self.batch_scheduler.run(ids, build_request, 'messages.trash', progress=progress,
+                                                  succeeded=succeeded)
+            else:
+                # Label changes go through messages.batchModify (1000 IDs per call).
+                groups = group_label_changes({email_id: (add_ids, remove_ids) for email_id in ids})
+                result = self.batch_scheduler.run_bulk_modify(groups, progress=progress, succeeded=succeeded)
+            return result
+        finally:
+            # Keep the local metadata store in line with what Gmail accepted, also when
+            # the job was cancelled part-way through (then only `succeeded` is known).
+            self._apply_local_label_delta(result["succeeded"] if result else succeeded, add_ids, remove_ids)
+
+    def _action_shrinks_listing(self, action: str, label_ids: list, query: str, remove_ids: list) -> bool:
+        """True if applying the action makes messages drop out of the (labelIds, q) listing."""
+        if action == 'trash':
+            return True
+        listed_labels = set(label_ids or [])
+        listed_labels.update(QUERY_LABEL_ALIASES[t] for t in (query or "").lower().split() if t in QUERY_LABEL_ALIASES)
+        return bool(listed_labels & set(remove_ids))
+
+    def perform_batch_action_matching(self, action: str, label_ids: list, add_labels: list = None,
+                                      remove_labels: list = None, progress=None, **filters) -> dict:
+        """
+        Applies `action` to every message matching (labelIds, filters) without materializing
+        the full ID list: IDs are streamed one messages.list page at a time into the batch
+        pipeline, so memory stays bounded by a page plus a window of recently processed IDs.
+
+        When the action removes messages from the listing (e.g. archiving from INBOX), page
+        tokens would skip messages, so listing restarts from the first page after each page
+        is processed; recently processed IDs are skipped to cope with search index lag.
+        Returns the same shape as perform_batch_action, without the list of succeeded IDs.
+        `progress(processed, failed, total)` is called after every page; total is an estimate.
+        """
+        query = self._construct_query(filters)
+        if action == 'trash':
+            add_ids, remove_ids = ['TRASH'], []
+        else:
+            add_ids, remove_ids = self._batch_label_delta(action, add_labels, remove_labels)
+        restart = self._action_shrinks_listing(action, label_ids, query, remove_ids)
+        logging.info(
+            f"Batch Action (matching): '{action}' on query '{query}', labels {label_ids} "
+            f"({'restarting' if restart else 'paging'} listing)."
+        )
+
+        expected_total = None
+        if progress:
+            expected_total = self.counter.count(label_ids=label_ids, query=query, mode="estimate")["count"]
+
+        recent = OrderedDict()
+        failed = []
+        failed_ids = set()
+        succeeded_count = 0
+        total = 0
+        page_token = None
+        while True:
+            ids, next_page_token = self._list_id_page(label_ids, query, page_token)
+            new_ids = [i for i in ids if i not in recent and i not in failed_ids]
+            if not new_ids:
+                if not next_page_token:
+                    break
+                page_token = next_page_token
+                continue
+
+            result = self._run_batch(action, new_ids, add_ids, remove_ids)
+            total += len(new_ids)
+            succeeded_count += len(result["succeeded"])
+            failed.extend(result["failed"])
+            failed_ids.update(f["id"] for f in result["failed"])
+            for email_id in result["succeeded"]:
+                recent[email_id] = None
+            while len(recent) > RECENT_IDS_WINDOW:
+                recent.popitem(last=False)
+            logging.info(f"Batch Action (matching): {succeeded_count} succeeded, {len(failed)} failed so far.")
+            if progress:
+                progress(total, len(failed), max(expected_total or 0, total))
+
+            if restart:
+                page_token = None
+            elif next_page_token:
+                page_token = next_page_token
+            else:
+                break
+
+        return {"action": action, "total": total, "succeeded": [], "succeeded_count": succeeded_count, "failed": failed}
+
+    def _execute(self, request):
+        """
+        Executes a single Google API request after taking its quota units from the shared limiter.
+        The call budget is charged first, so a call over it takes no quota.
+        """
+        method = method_for_request(request)
+        request_usage.charge()
+        self.quota.acquire(units_for(method), method=method)
+        return metrics.execute(request, method, charged=True)
 
     def _execute_with_retry(self, request, max_retries=5):
         """
@@ -435,7 +794,7 @@ class GmailService:
         """
         for attempt in range(max_retries):
             try:
-                return request.execute()
+                return self._execute(request)
             except (HttpError, ssl.SSLError) as e:
                 if isinstance(e, HttpError):
                     # If it's not a rate limit or server error, raise immediately
@@ -449,198 +808,159 @@ class GmailService:
                 # Exponential backoff: 2^attempt + random jitter
                 sleep_time = (2 ** attempt) + random.uniform(0, 1)
                 logging.warning(f"Request failed with {e}. Retrying in {sleep_time:.2f}s...")
+                metrics.observe_backoff('execute_with_retry', sleep_time)
                 time.sleep(sleep_time)
 
     def _count_messages(self, query: str, label_ids: list = None) -> int:
         """
-        Helper to accurately count messages by iterating through all pages.
+        Helper to accurately count messages.
+        Delegates to the counting engine, which prefers the local store, label counters
+        and memoized counts over paging through every message ID.
         """
-        total_count = 0
-        page_token = None
-        service = self._get_gmail_service() # Use new service instance
-        
-        while True:
-            request = service.users().messages().list( # Use new service instance
-                userId='me',
-                labelIds=label_ids,
-                q=query,
-                pageToken=page_token,
-                maxResults=500,
-                fields="nextPageToken,messages(id)",
-                includeSpamTrash=False
-            )
-            
-            results = self._execute_with_retry(request)
-            
-            messages = results.get('messages', [])
-            total_count += len(messages)
-            
-            page_token = results.get('nextPageToken')
-            if not page_token:
-                break
-            
-            # Small delay between pages to be nice to the API
-            time.sleep(0.1)
-            
-        return total_count
+        return self.counter.count(label_ids=label_ids, query=query)["count"]
 
-    def get_dashboard_stats(self) -> dict:
+    def get_dashboard_stats(self, mode: str = "exact") -> dict:
         """
         Fetches dashboard statistics: Total and Unread counts for INBOX -> Primary.
-        Uses accurate counting by traversing all pages (optimized to fetch IDs only).
+        mode="estimate" returns immediately with Gmail's estimates when no exact
+        count is available yet, and computes the exact counts in the background.
+        Gmail errors are raised; only a request over its call budget gets zero counts.
         """
         try:
             # 1. Total Emails in Primary Inbox
-            # We use _count_messages which is optimized to fetch only IDs
-            total_emails = self._count_messages(query='category:primary', label_ids=['INBOX'])
+            total = self.counter.count(label_ids=['INBOX'], query='category:primary', mode=mode)
             
             # 2. Unread Emails in Primary Inbox
-            unread_emails = self._count_messages(query='category:primary is:unread', label_ids=['INBOX'])
+            unread = self.counter.count(label_ids=['INBOX'], query='category:primary is:unread', mode=mode)
             
             return {
-                "total_emails": total_emails,
-                "unread_emails": unread_emails
+                "total_emails": total["count"],
+                "unread_emails": unread["count"],
+                "counts_exact": total["exact"] and unread["exact"]
             }
-        except Exception as e:
-            logging.error(f"Error fetching dashboard stats: {e}", exc_info=True)
-            return {"total_emails": 0, "unread_emails": 0}
+        except GmailCallBudgetExceeded as e:
+            # Degraded by the call budget (the result is not cached, see cached_dashboard).
+            logging.warning(f"Dashboard stats cut short: {e}")
+            return {"total_emails": 0, "unread_emails": 0, "counts_exact": False}
 
-    def get_subject_counts(self, label_ids: list, limit: int = 200) -> list:
+    def get_subject_counts(self, label_ids: list, limit: int = 200, mode: str = "sample",
+                           normalize: bool = False, top: int = None, progress=None) -> list:
         """
         Aggregates subject counts for the given labels.
-        Iterates through pages to get accurate counts, up to a limit.
+        - mode="sample": the `limit` most recent messages only.
+        - mode="exact": every message with the labels.
+        - mode="approximate": every message, counted with a bounded top-K sketch
+          (SUBJECT_TOPK_CAPACITY entries); counts are upper bounds.
+        With normalize, Re:/Fwd: prefixes, ticket IDs and numbers are collapsed first.
+        `top` caps the number of subjects returned. `progress(processed, failed, total)`
+        is called while messages are streamed from Gmail (total unknown).
         Returns a list of dicts: [{'subject': '...', 'count': 10}, ...] sorted by count desc.
+        Gmail errors are raised; a request over its call budget gets an empty list.
         """
         try:
-            subject_counts = {}
-            page_token = None
-            total_processed = 0
-            successfully_counted = 0  # Track actual successful fetches
-            service = self._get_gmail_service() # Use new service instance
-            
-            # Batch request callback
-            def batch_callback(request_id, response, exception):
-                nonlocal successfully_counted
-                if exception:
-                    logging.warning(f"Error fetching headers for msg {request_id}: {exception}")
-                    return
-                
-                headers = response.get('payload', {}).get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
-                if not subject:
-                    subject = '(No Subject)'
-                
-                subject_counts[subject] = subject_counts.get(subject, 0) + 1
-                successfully_counted += 1
+            whole_label = mode != "sample"
+            aggregator = SubjectAggregator(exact=mode != "approximate", normalize=normalize,
+                                           capacity=SUBJECT_TOPK_CAPACITY)
+            store = self._local_store()
+            if store:
+                # The store already holds every subject; only re-aggregate when needed.
+                counts = store.subject_counts(label_ids, limit=None if whole_label else limit)
+                if not normalize and mode != "approximate":
+                    return counts[:top] if top else counts
+                for row in counts:
+                    aggregator.add(row['subject'], row['count'])
+                return aggregator.top(top)
 
-            while True:
-                # Check limit
-                if limit and successfully_counted >= limit:
-                    logging.info(f"Reached target of {limit} successfully counted subjects.")
-                    break
+            total_processed = 0
 
-                # 1. List IDs for current page
-                request = service.users().messages().list(
-                    userId='me',
-                    labelIds=label_ids,
-                    pageToken=page_token,
-                    maxResults=500, # Max allowed for list
-                    fields="nextPageToken,messages(id)"
-                )
-                
-                results = self._execute_with_retry(request)
-                
-                messages = results.get('messages', [])
-                
-                if messages:
-                    # 2. Batch fetch headers for these messages
-                    # Batch size 10 for stability
-                    chunk_size = 10
-                    
-                    # If adding this chunk exceeds limit, truncate
-                    remaining_needed = limit - successfully_counted if limit else len(messages)
-                    if limit and len(messages) > remaining_needed:
-                        messages = messages[:remaining_needed]
-                        logging.info(f"Limiting to {len(messages)} messages to reach target of {limit}")
-
-                    for i in range(0, len(messages), chunk_size):
-                        chunk = messages[i:i + chunk_size]
-                        batch = service.new_batch_http_request(callback=batch_callback)
-                        
-                        for j, msg in enumerate(chunk):
-                            batch.add(
-                                service.users().messages().get(
-                                    userId='me', 
-                                    id=msg['id'], 
-                                    format='metadata', 
-                                    metadataHeaders=['Subject']
-                                ),
-                                request_id=f"{total_processed + i + j}"
-                            )
-                        try:
-                            batch.execute()
-                            time.sleep(0.1) # Short delay for smaller batches
-                        except Exception as e:
-                            logging.error(f"Batch execution failed during subject count: {e}")
-                    
-                    total_processed += len(messages)
-                    logging.info(f"Processed {total_processed} messages, successfully counted {successfully_counted} subjects")
+            def listed_ids():
+                nonlocal total_processed
+                for page in self._iter_id_pages(label_ids, ""):
+                    if not whole_label:
+                        page = page[:limit - total_processed]
+                    total_processed += len(page)
+                    yield from page
+                    if not whole_label and total_processed >= limit:
+                        logging.info(f"Reached target of {limit} subjects to count.")
+                        return
 
-                page_token = results.get('nextPageToken')
-                if not page_token:
-                    logging.info("No more pages available")
-                    break
-                
-                # Small delay between pages
-                time.sleep(0.1)
-            
-            logging.info(f"Final stats: Processed {total_processed} messages, successfully counted {successfully_counted} subjects, unique subjects: {len(subject_counts)}")
-            # Convert to list of dicts
-            result = [
-                {"subject": subj, "count": count} 
-                for subj, count in subject_counts.items()
-            ]
-            
-            # Sort by count descending
-            result.sort(key=lambda x: x['count'], reverse=True)
+            for record in self.metadata_fetcher.iter_records(listed_ids(), headers=('Subject',)):
+                aggregator.add(record.subject)
+                if progress and aggregator.processed % 500 == 0:
+                    progress(aggregator.processed, 0, None)
             
+            result = aggregator.top(top)
+            logging.info(
+                f"Subject counts ({mode}): processed {total_processed} messages, counted {aggregator.processed}, "
+                f"returning {len(result)} subjects."
+            )
             return result
-        except Exception as e:
-            logging.error(f"Error calculating subject counts: {e}", exc_info=True)
+        except GmailCallBudgetExceeded as e:
+            logging.warning(f"Subject counts cut short: {e}")
             return []
 
-    def get_full_dashboard_data(self, label_ids: list) -> dict:
+    def get_sender_stats(self, label_ids: list, group_by: str = "address", sort: str = "count",
+                         top: int = 50, progress=None) -> dict:
+        """
+        Per-sender (group_by="address") or per-domain statistics for the given labels:
+        count, unread count and ratio, newest/oldest date and estimated bytes, sorted by `sort`.
+        Served from the metadata store's incrementally maintained aggregates when it is ready;
+        otherwise every message is streamed from Gmail (From header only), which is slow on
+        large labels. Returns {"group_by", "source", "senders": [...]}.
+        """
+        store = self._local_store()
+        if store:
+            senders = store.sender_stats(label_ids, group_by=group_by, sort=sort, limit=top)
+            return {"group_by": group_by, "source": "store", "senders": senders}
+
+        aggregator = SenderAggregator(group_by)
+        ids = (email_id for page in self._iter_id_pages(label_ids, "") for email_id in page)
+        for record in self.metadata_fetcher.iter_records(ids, headers=('From',)):
+            aggregator.add(record.sender, record.label_ids, record.internal_date, record.size_estimate)
+            if progress and aggregator.processed % 500 == 0:
+                progress(aggregator.processed, 0, None)
+        logging.info(f"Sender stats: aggregated {aggregator.processed} messages from Gmail.")
+        return {"group_by": group_by, "source": "gmail", "senders": aggregator.top(sort, top)}
+
+    def get_full_dashboard_data(self, label_ids: list, mode: str = "exact", progress=None) -> dict:
         """
         Fetches all dashboard data (Total, Unread, Subject Counts) in a single pass.
         Uses a hybrid approach:
-        1. Fast 'list' calls for Total and Unread counts (accurate, fast).
-        2. Limited 'get' calls for Subject analysis (recent 1000 emails).
+        1. The counting engine for Total and Unread counts (label counters / cache / page walk,
+           or estimates with a background exact count when mode="estimate").
+        2. Limited 'get' calls for Subject analysis (recent 200 emails).
+        `progress(processed, failed, total)` is called after each of the three steps.
+        Gmail errors are raised rather than answered with zeros, so they are not cached
+        as results; a request over its call budget still gets the zeroed fallback.
         """
         try:
             logging.info("Fetching full dashboard data with hybrid strategy.")
             
-            # 1. Fast Total Count
-            # Uses list() which only fetches IDs, very fast.
-            total_emails = self._count_messages(query=None, label_ids=label_ids)
+            # 1. Total Count
+            total = self.counter.count(label_ids=label_ids, query=None, mode=mode)
+            if progress: progress(1, 0, 3)
             
-            # 2. Fast Unread Count
-            # Uses list() with q='is:unread', very fast.
-            unread_emails = self._count_messages(query="is:unread", label_ids=label_ids)
+            # 2. Unread Count
+            unread = self.counter.count(label_ids=label_ids, query="is:unread", mode=mode)
+            if progress: progress(2, 0, 3)
             
             # 3. Subject Analysis (Limited)
             # Only analyze the most recent 200 emails to keep it fast and avoid rate limits.
             subjects_list = self.get_subject_counts(label_ids=label_ids, limit=200)
+            if progress: progress(3, 0, 3)
             
             return {
-                "total_emails": total_emails,
-                "unread_emails": unread_emails,
+                "total_emails": total["count"],
+                "unread_emails": unread["count"],
+                "counts_exact": total["exact"] and unread["exact"],
                 "subjects": subjects_list
             }
-        except Exception as e:
-            logging.error(f"Error fetching full dashboard data: {e}", exc_info=True)
+        except GmailCallBudgetExceeded as e:
+            logging.warning(f"Full dashboard data cut short: {e}")
             return {
                 "total_emails": 0,
                 "unread_emails": 0,
+                "counts_exact": False,
                 "subjects": []
             }
 
@@ -649,7 +969,7 @@ class GmailService:
     def list_filters(self) -> list:
         """Lists all user's filters."""
         try:
-            result = self.service.users().settings().filters().list(userId='me').execute()
+            result = self._execute(self.service.users().settings().filters().list(userId='me'))
             return result.get('filter', [])
         except Exception as e:
             logging.error(f"Error listing filters: {e}")
@@ -658,7 +978,7 @@ class GmailService:
     def get_filter(self, filter_id: str) -> dict:
         """Gets a specific filter."""
         try:
-            return self.service.users().settings().filters().get(userId='me', id=filter_id).execute()
+            return self._execute(self.service.users().settings().filters().get(userId='me', id=filter_id))
         except Exception as e:
             logging.error(f"Error getting filter {filter_id}: {e}")
             raise e
@@ -666,7 +986,7 @@ class GmailService:
     def create_filter(self, filter_obj: dict) -> dict:
         """Creates a new filter."""
         try:
-            return self.service.users().settings().filters().create(userId='me', body=filter_obj).execute()
+            return self._execute(self.service.users().settings().filters().create(userId='me', body=filter_obj))
         except Exception as e:
             logging.error(f"Error creating filter: {e}")
             raise e
@@ -674,7 +994,7 @@ class GmailService:
     def delete_filter(self, filter_id: str):
         """Deletes a filter."""
         try:
-            self.service.users().settings().filters().delete(userId='me', id=filter_id).execute()
+            self._execute(self.service.users().settings().filters().delete(userId='me', id=filter_id))
         except Exception as e:
             logging.error(f"Error deleting filter {filter_id}: {e}")
             raise e
\ No newline at end of file
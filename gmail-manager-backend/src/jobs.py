@@ -0,0 +1,236 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import JOBS_DB_FILE, JOB_WORKERS
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at DESC);
+"""
+
+
+class JobCancelled(Exception):
+    """Raised from a progress callback when the job has been cancelled."""
+
+
+class JobContext:
+    """
+    Handed to a running job. Its `progress(processed, failed, total)` method has the
+    same signature as the progress callbacks accepted by GmailService's long operations,
+    and raises JobCancelled once cancellation was requested.
+    """
+
+    def __init__(self, manager, job_id: str):
+        self.manager = manager
+        self.job_id = job_id
+        self.cancel_event = threading.Event()
+
+    def progress(self, processed: int, failed: int = 0, total: int = None):
+        self.manager._update_progress(self.job_id, processed, failed, total)
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+
+class JobManager:
+    """
+    In-process background jobs for long-running mailbox operations.
+
+    Jobs run on a small worker pool; their state lives in memory while they run and
+    is persisted to a SQLite job table (progress at most once per second), so finished
+    jobs can still be inspected after a restart. Jobs that were running when the
+    process stopped are marked failed on startup.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_FILE, max_workers: int = JOB_WORKERS,
+                 persist_interval: float = 1.0):
+        self.db_path = db_path
+        self.persist_interval = persist_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.RLock()
+        self._conn = None
+        self._live = {}  # job_id -> job dict, for queued/running jobs
+        self._contexts = {}  # job_id -> JobContext
+        self._persisted_at = {}
+
+    # --- Persistence ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(SCHEMA)
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)",
+                    (FAILED, "Interrupted by a server restart.", time.time(), QUEUED, RUNNING)
+                )
+            self._conn = conn
+        return self._conn
+
+    def _persist(self, job: dict):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs "
+                    "(id, kind, status, params, processed, failed, total, result, error, created_at, started_at, finished_at) "
+                    "VALUES (:id, :kind, :status, :params, :processed, :failed, :total, :result, :error, :created_at, :started_at, :finished_at)",
+                    dict(
+                        job,
+                        params=json.dumps(job['params']),
+                        result=json.dumps(job['result']) if job['result'] is not None else None
+                    )
+                )
+            self._persisted_at[job['id']] = time.monotonic()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    # --- Lifecycle ---
+
+    def submit(self, kind: str, func, params: dict = None) -> dict:
+        """
+        Queues `func(ctx)` as a background job and returns its initial state.
+        `func` receives a JobContext and returns a JSON-serializable result.
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "params": params or {},
+            "processed": 0,
+            "failed": 0,
+            "total": None,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        ctx = JobContext(self, job['id'])
+        with self._lock:
+            self._live[job['id']] = job
+            self._contexts[job['id']] = ctx
+            self._persist(job)
+        self._executor.submit(self._run, job['id'], func, ctx)
+        logging.info(f"Job {job['id']} ({kind}) queued.")
+        return self.describe(dict(job))
+
+    def _run(self, job_id: str, func, ctx: JobContext):
+        with self._lock:
+            job = self._live[job_id]
+            if ctx.cancelled:
+                self._finish(job, CANCELLED)
+                return
+            job['status'] = RUNNING
+            job['started_at'] = time.time()
+            self._persist(job)
+        try:
+            result = func(ctx)
+            with self._lock:
+                job['result'] = result
+                self._finish(job, CANCELLED if ctx.cancelled else SUCCEEDED)
+        except JobCancelled:
+            with self._lock:
+                self._finish(job, CANCELLED)
+        except Exception as e:
+            logging.error(f"Job {job_id} ({job['kind']}) failed: {e}", exc_info=True)
+            with self._lock:
+                job['error'] = str(e)
+                self._finish(job, FAILED)
+
+    def _finish(self, job: dict, status: str):
+        job['status'] = status
+        job['finished_at'] = time.time()
+        self._persist(job)
+        self._live.pop(job['id'], None)
+        self._contexts.pop(job['id'], None)
+        self._persisted_at.pop(job['id'], None)
+        logging.info(f"Job {job['id']} ({job['kind']}) {status}: {job['processed']} processed, {job['failed']} failed.")
+
+    def _update_progress(self, job_id: str, processed: int, failed: int, total: int):
+        with self._lock:
+            job = self._live.get(job_id)
+            if job is None:
+                return
+            job['processed'] = processed
+            job['failed'] = failed
+            if total is not None:
+                job['total'] = total
+            if time.monotonic() - self._persisted_at.get(job_id, 0) >= self.persist_interval:
+                self._persist(job)
+
+    def cancel(self, job_id: str):
+        """Requests cancellation. Returns the job state, or None for unknown jobs."""
+        with self._lock:
+            ctx = self._contexts.get(job_id)
+            if ctx is not None:
+                ctx.cancel_event.set()
+                logging.info(f"Job {job_id} cancellation requested.")
+        return self.get(job_id)
+
+    # --- Queries ---
+
+    @staticmethod
+    def describe(job: dict) -> dict:
+        """Adds throughput (items/s) and ETA (s) derived from the progress counters."""
+        throughput, eta = None, None
+        if job.get('started_at'):
+            end = job.get('finished_at') or time.time()
+            elapsed = max(end - job['started_at'], 1e-6)
+            throughput = job['processed'] / elapsed
+            if job['status'] == RUNNING and job.get('total') and throughput > 0:
+                eta = max(job['total'] - job['processed'], 0) / throughput
+        return dict(job, throughput=throughput, eta_seconds=eta)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._live.get(job_id)
+            if job is not None:
+                return self.describe(dict(job))
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self.describe(self._row_to_job(row)) if row else None
+
+    def list(self, limit: int = 50) -> list:
+        """Recent jobs, newest first, without their results (which can hold every processed ID)."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, kind, status, params, processed, failed, total, NULL AS result, error, "
+                "created_at, started_at, finished_at FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+            jobs = [self._live.get(row['id']) or self._row_to_job(row) for row in rows]
+        return [self.describe(dict(job, result=None)) for job in jobs]
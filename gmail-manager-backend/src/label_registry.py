@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+
+from . import metrics
+from .config import LABELS_CACHE_TTL
+
+
+class LabelRegistry:
+    """
+    Lazily loaded, self-refreshing cache of the user's labels.
+
+    `fetch()` returns (labels_map, labels_list) where labels_map maps upper-cased
+    label names to IDs. The labels are fetched on first use and again when:
+    - the TTL has expired,
+    - `invalidate()` was called (e.g. history mentions a label ID we do not know),
+    - a lookup misses (a label created elsewhere since the last fetch).
+
+    Refreshes are single-flight: concurrent callers that need a refresh wait for the
+    one already running instead of issuing their own labels.list call. Misses for the
+    same unknown name refresh at most once per `miss_interval` seconds.
+    If a refresh fails, the previous snapshot keeps being served.
+    """
+
+    def __init__(self, fetch, ttl: float = LABELS_CACHE_TTL, miss_interval: float = 5.0, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self.clock = clock
+        self._map = {}
+        self._list = []
+        self._ids = frozenset()
+        self._loaded_at = None
+        self._failed_at = None
+        self._stale = False
+        self._version = 0
+        self._refresh_lock = threading.Lock()
+        self._misses = {}  # upper-cased name still unknown after a refresh -> time of that refresh
+
+    def _expired(self) -> bool:
+        now = self.clock()
+        if self._failed_at is not None and now - self._failed_at < self.miss_interval:
+            return False
+        return self._stale or self._loaded_at is None or now - self._loaded_at >= self.ttl
+
+    def refresh(self, seen_version: int = None) -> bool:
+        """
+        Fetches the labels again. If `seen_version` is given and another thread has
+        refreshed (or failed to) since that version was observed, returns without fetching.
+        Returns False if the fetch failed; the previous snapshot is kept.
+        """
+        with self._refresh_lock:
+            if seen_version is not None and (self._version != seen_version or not self._expired()):
+                return True
+            try:
+                labels_map, labels_list = self.fetch()
+            except Exception as e:
+                logging.error(f"Failed to refresh labels, keeping {len(self._list)} cached labels: {e}")
+                self._failed_at = self.clock()
+                return False
+            self._map, self._list = labels_map, labels_list
+            self._ids = frozenset(label['id'] for label in labels_list)
+            self._loaded_at = self.clock()
+            self._failed_at = None
+            self._stale = False
+            self._version += 1
+            logging.info(f"Label registry refreshed: {len(labels_list)} labels.")
+            return True
+
+    def _ensure_fresh(self):
+        expired = self._expired()
+        metrics.observe_cache('labels', hit=not expired)
+        if expired:
+            self.refresh(seen_version=self._version)
+
+    def invalidate(self):
+        """Marks the snapshot stale; the next access refetches it."""
+        self._stale = True
+        self._failed_at = None
+
+    def observe_label_ids(self, label_ids):
+        """Invalidates the snapshot if any of `label_ids` (e.g. from history records) is unknown."""
+        if self._loaded_at is None:
+            return
+        unknown = set(label_ids) - self._ids
+        if unknown:
+            logging.info(f"Label registry: unknown label IDs {sorted(unknown)} seen in history, refreshing.")
+            self.invalidate()
+
+    @property
+    def labels_map(self) -> dict:
+        self._ensure_fresh()
+        return self._map
+
+    @property
+    def labels_list(self) -> list:
+        self._ensure_fresh()
+        return self._list
+
+    def resolve(self, name: str):
+        """
+        Returns the ID of the label called `name` (case-insensitive), or None.
+        An unknown name triggers one coalesced refresh, at most once per miss_interval.
+        """
+        if not name:
+            return None
+        key = name.upper()
+        self._ensure_fresh()
+        label_id = self._map.get(key)
+        if label_id is not None:
+            return label_id
+        last_miss = self._misses.get(key)
+        if last_miss is not None and self.clock() - last_miss < self.miss_interval:
+            return None
+        version = self._version
+        self._stale = True
+        self.refresh(seen_version=version)
+        label_id = self._map.get(key)
+        if label_id is None:
+            if len(self._misses) > 1024:
+                self._misses.clear()
+            self._misses[key] = self.clock()
+        return label_id
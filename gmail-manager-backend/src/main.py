@@ -1,17 +1,32 @@
 import os
+import json
+import time
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, Query, Body
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import partial
+
+import anyio
+from fastapi import FastAPI, HTTPException, Query, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from typing import List, Optional
 
 from .schemas import (
     EmailListResponse, UniqueSubjectsResponse, ModifyLabelsRequest,
-    LabelListResponse, EmailDetails, BatchActionRequest, EmailIdListResponse,
-    SubjectCountListResponse, FullDashboardResponse,
+    LabelListResponse, EmailDetails, BatchActionRequest, BatchActionResponse, EmailIdListResponse,
+    SubjectCountListResponse, SenderStatsResponse, FullDashboardResponse, EmailCountResponse, JobResponse, JobListResponse,
     Filter, FilterCreateRequest, FilterResponse, FilterCriteria, FilterAction
 )
 from .gmail_service import GmailService
-from .config import FRONTEND_URL
+from .jobs import JobManager
+from .result_cache import ResultCache
+from . import metrics, request_usage
+from .config import (
+    FRONTEND_URL, BLOCKING_CALLS_LIMIT, GMAIL_CALL_BUDGETS, GMAIL_CALL_BUDGET_MODE,
+    DASHBOARD_CACHE_TTL, DASHBOARD_CACHE_MAX_AGE
+)
 
 # --- Logging Configuration ---
 # This sets up a basic logger that prints timestamped messages to the console.
@@ -22,10 +37,20 @@ logging.basicConfig(
 )
 # --- End Logging Configuration ---
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep the local metadata store backfilled and in sync while the server runs.
+    gmail_service.start_metadata_sync()
+    yield
+    gmail_service.stop_metadata_sync()
+    gmail_service.prefetcher.stop()
+    await gmail_service.transport.aclose()
+
 app = FastAPI(
     title="Gmail Interaction API",
     description="An API to interact with a Gmail account for custom interfaces.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS (Cross-Origin Resource Sharing) Middleware
@@ -36,26 +61,138 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read the per-request Gmail usage (see account_gmail_usage).
+    expose_headers=["Server-Timing", "X-Gmail-Calls", "X-Gmail-Batch-Calls", "X-Gmail-Bytes",
+                    "X-Gmail-Call-Budget", "X-Gmail-Budget-Exceeded"],
 )
 
+# Gmail call budgets by request path (see GMAIL_CALL_BUDGETS).
+call_budgets = request_usage.parse_budgets(GMAIL_CALL_BUDGETS)
+
+@app.middleware("http")
+async def account_gmail_usage(request: Request, call_next):
+    """
+    Tracks the Gmail work behind each request and reports it in Server-Timing and
+    X-Gmail-* headers. Work done while a streaming body is sent is not included.
+    A request over its call budget answers 503 in "abort" mode, or when the endpoint
+    failed instead of degrading.
+    """
+    usage = request_usage.start(call_budgets.get(request.url.path))
+    response = await call_next(request)
+    if usage.exceeded and (GMAIL_CALL_BUDGET_MODE == "abort" or response.status_code >= 500):
+        logging.warning(f"{request.method} {request.url.path} exceeded its budget of {usage.budget} Gmail calls.")
+        response = JSONResponse(
+            status_code=503, content={"detail": f"Gmail call budget of {usage.budget} calls exceeded"}
+        )
+    response.headers.update(usage.headers())
+    return response
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts requests and records their latency per route template (see /metrics)."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.HTTP_REQUESTS.inc(request.method, route, str(status))
+        metrics.HTTP_REQUEST_SECONDS.observe(request.method, route, value=time.perf_counter() - started)
+
 # Initialize the Gmail Service
 # This will handle the authentication flow on the first API call.
 gmail_service = GmailService()
 
+# Background jobs for long-running operations (see /jobs endpoints).
+job_manager = JobManager()
+
+# Last results of the dashboard endpoints, served stale-while-revalidate (see cached_dashboard).
+dashboard_cache = ResultCache(ttl=DASHBOARD_CACHE_TTL, max_age=DASHBOARD_CACHE_MAX_AGE, name="dashboard")
+
+# Worker threads for calls that still use the blocking Gmail client, created per event loop.
+_blocking_limiter = None
+_blocking_limiter_loop = None
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a blocking GmailService call in its own pool of BLOCKING_CALLS_LIMIT threads.
+    Endpoints are async; those without an async service variant go through here, so slow
+    dashboard or batch calls cannot exhaust the threads other requests depend on.
+    """
+    global _blocking_limiter, _blocking_limiter_loop
+    loop = asyncio.get_running_loop()
+    if _blocking_limiter is None or _blocking_limiter_loop is not loop:
+        _blocking_limiter = anyio.CapacityLimiter(BLOCKING_CALLS_LIMIT)
+        _blocking_limiter_loop = loop
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=_blocking_limiter)
+
+async def submit_job(kind: str, func, params: dict) -> JSONResponse:
+    """Queues `func(progress)` as a background job and answers 202 with the job state."""
+    # The job table is SQLite: keep its I/O off the event loop.
+    job = await run_blocking(job_manager.submit, kind, lambda ctx: func(ctx.progress), params)
+    return JSONResponse(status_code=202, content=JobResponse(**job).model_dump())
+
+async def cached_dashboard(key: tuple, func, **kwargs) -> dict:
+    """
+    Answers a dashboard endpoint from dashboard_cache: the last result for `key` is
+    returned at once (refreshed in the background when stale) and only a missing one is
+    computed in the request, once for all concurrent callers. Adds `computed_at` (ISO
+    8601, UTC) and `stale` to the result. A failed computation raises and is not cached
+    (a failed background refresh keeps serving the previous result).
+    """
+    compute = partial(func, **kwargs)
+    cached = dashboard_cache.lookup(key, compute)
+    if cached is None:
+        cached = await run_blocking(dashboard_cache.get, key, compute)
+        usage = request_usage.current()
+        if usage is not None and usage.exceeded:
+            # Degraded by the call budget: do not serve it to the next callers.
+            dashboard_cache.invalidate(key)
+    value, computed_at, stale = cached
+    return {**value, "computed_at": datetime.fromtimestamp(computed_at, timezone.utc).isoformat(), "stale": stale}
+
 @app.get("/labels", response_model=LabelListResponse, tags=["Labels"])
-def get_all_user_labels():
+async def get_all_user_labels():
     """
     Retrieves a list of all user-defined and system labels/folders.
     """
     try:
-        labels = gmail_service.get_all_labels()
+        labels = await gmail_service.aget_all_labels()
         return {"labels": labels}
     except Exception as e:
         logging.error(f"Error in get_all_user_labels: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve labels.")
 
+# inbox_filter values and the Gmail category label each one selects.
+INBOX_CATEGORIES = {
+    "PRIMARY": "CATEGORY_PERSONAL",
+    "PROMOTIONS": "CATEGORY_PROMOTIONS",
+    "SOCIAL": "CATEGORY_SOCIAL",
+    "NOTIFICATIONS": "CATEGORY_UPDATES",
+    "FORUMS": "CATEGORY_FORUMS",
+}
+
+async def resolve_label_ids(folder: Optional[str] = None, inbox_filter: Optional[str] = None, label: Optional[str] = None) -> list:
+    """
+    Translates folder / inbox_filter / label selections into Gmail label IDs.
+    A label that does not resolve answers 404 instead of being dropped, which would
+    silently widen the selection (for a batch action, to the whole mailbox).
+    """
+    if label:
+        label_id = await gmail_service.aresolve_label_id(label)
+        if not label_id:
+            raise HTTPException(status_code=404, detail=f"Label '{label}' not found.")
+        return [label_id]
+    if folder and folder.upper() == 'INBOX' and inbox_filter and inbox_filter.upper() in INBOX_CATEGORIES:
+        return ['INBOX', INBOX_CATEGORIES[inbox_filter.upper()]]
+    if folder:
+        return [folder.upper()]
+    return []
+
 @app.get("/emails", response_model=EmailListResponse, tags=["Emails"])
-def list_emails(
+async def list_emails(
     folder: Optional[str] = Query(None, description="A standard folder (e.g., INBOX, SENT)."),
     inbox_filter: Optional[str] = Query(None, description="Specific inbox category (e.g., Primary)."),
     label: Optional[str] = Query(None, description="A specific user label to filter by."),
@@ -65,37 +202,22 @@ def list_emails(
     to_recipient: Optional[str] = Query(None, description="Filter emails to a specific recipient."),
     subject: Optional[str] = Query(None, description="Filter emails by subject line."),
     after_date: Optional[str] = Query(None, description="Filter emails after this date (YYYY-MM-DD)."),
-    before_date: Optional[str] = Query(None, description="Filter emails before this date (YYYY-MM-DD).")
+    before_date: Optional[str] = Query(None, description="Filter emails before this date (YYYY-MM-DD)."),
+    prefetch: bool = Query(False, description="Fetch the listed emails' content in the background.")
 ):
     """
     Lists emails with advanced filtering and pagination.
+    With prefetch=true, the content of the returned emails is warmed in the background
+    (cancelling the previous page's prefetch), so opening one of them is instant.
     """
-    label_ids = []
-    # Handle special inbox categories
-    inbox_categories = {
-        "PRIMARY": "CATEGORY_PERSONAL",
-        "PROMOTIONS": "CATEGORY_PROMOTIONS",
-        "SOCIAL": "CATEGORY_SOCIAL",
-        "NOTIFICATIONS": "CATEGORY_UPDATES",
-        "FORUMS": "CATEGORY_FORUMS",
-    }
-    
-    if label:
-        # For user labels, we need to look up their ID
-        label_id = gmail_service.labels_map.get(label.upper())
-        if label_id:
-            label_ids.append(label_id)
-    elif folder and folder.upper() == 'INBOX' and inbox_filter and inbox_filter.upper() in inbox_categories:
-        label_ids.append('INBOX')
-        label_ids.append(inbox_categories[inbox_filter.upper()])
-    elif folder:
-        label_ids.append(folder.upper())
+    label_ids = await resolve_label_ids(folder, inbox_filter, label)
 
     try:
-        result = gmail_service.list_emails(
+        result = await gmail_service.alist_emails(
             label_ids=label_ids,
             page_token=page_token,
             max_results=max_results,
+            prefetch=prefetch,
             from_sender=from_sender,
             to_recipient=to_recipient,
             subject=subject,
@@ -103,12 +225,30 @@ def list_emails(
             before_date=before_date
         )
         return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error in list_emails endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+def stream_id_pages(first_page, pages):
+    """Serializes ID pages as NDJSON lines for /emails/ids?stream=true."""
+    count = 0
+    try:
+        if first_page is not None:
+            count += len(first_page)
+            yield json.dumps({"ids": first_page}) + "\n"
+        for page in pages:
+            count += len(page)
+            yield json.dumps({"ids": page}) + "\n"
+    except Exception as e:
+        logging.error(f"Error while streaming email IDs after {count} IDs: {e}", exc_info=True)
+        yield json.dumps({"error": str(e), "count": count}) + "\n"
+        return
+    yield json.dumps({"done": True, "count": count}) + "\n"
+
 @app.get("/emails/ids", response_model=EmailIdListResponse, tags=["Emails"])
-def list_email_ids(
+async def list_email_ids(
     folder: Optional[str] = Query(None),
     inbox_filter: Optional[str] = Query(None),
     label: Optional[str] = Query(None),
@@ -116,51 +256,83 @@ def list_email_ids(
     to_recipient: Optional[str] = Query(None),
     subject: Optional[str] = Query(None),
     after_date: Optional[str] = Query(None),
-    before_date: Optional[str] = Query(None)
+    before_date: Optional[str] = Query(None),
+    background: bool = Query(False, description="Run as a background job and return its ID (202)."),
+    stream: bool = Query(False, description="Stream pages of IDs as NDJSON while they are being listed.")
 ):
     """
     Retrieves a list of ALL email IDs matching the criteria, across all pages.
     Used for client-side batch processing.
-    """
-    label_ids = []
-    inbox_categories = {
-        "PRIMARY": "CATEGORY_PERSONAL",
-        "PROMOTIONS": "CATEGORY_PROMOTIONS",
-        "SOCIAL": "CATEGORY_SOCIAL",
-        "NOTIFICATIONS": "CATEGORY_UPDATES",
-        "FORUMS": "CATEGORY_FORUMS",
-    }
-    
-    if label:
-        label_id = gmail_service.labels_map.get(label.upper())
-        if label_id: label_ids.append(label_id)
-    elif folder and folder.upper() == 'INBOX' and inbox_filter and inbox_filter.upper() in inbox_categories:
-        label_ids.append('INBOX')
-        label_ids.append(inbox_categories[inbox_filter.upper()])
-    elif folder:
-        label_ids.append(folder.upper())
+    With background=true, returns a job whose result is {"ids": [...]} once finished.
+    With stream=true, returns NDJSON: one {"ids": [...]} line per page (up to 500 IDs)
+    as soon as Gmail returns it, then {"done": true, "count": N}. An error after the
+    first page is reported as a final {"error": ...} line.
+    """
+    label_ids = await resolve_label_ids(folder, inbox_filter, label)
+
+    filters = dict(
+        from_sender=from_sender,
+        to_recipient=to_recipient,
+        subject=subject,
+        after_date=after_date,
+        before_date=before_date
+    )
+    if stream:
+        try:
+            pages = gmail_service.iter_email_ids(label_ids=label_ids, **filters)
+            # Fetch the first page eagerly so early failures still map to a 500.
+            first_page = await run_blocking(next, pages, None)
+        except Exception as e:
+            logging.error(f"Error in list_email_ids endpoint: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+        return StreamingResponse(stream_id_pages(first_page, pages), media_type="application/x-ndjson")
+
+    if background:
+        return await submit_job(
+            "email_ids",
+            lambda progress: {"ids": gmail_service.get_email_ids(label_ids=label_ids, progress=progress, **filters)},
+            {"label_ids": label_ids, **filters}
+        )
 
     try:
-        ids = gmail_service.get_email_ids(
-            label_ids=label_ids,
-            from_sender=from_sender,
-            to_recipient=to_recipient,
-            subject=subject,
-            after_date=after_date,
-            before_date=before_date
-        )
+        ids = await run_blocking(gmail_service.get_email_ids, label_ids=label_ids, **filters)
         return {"ids": ids}
     except Exception as e:
         logging.error(f"Error in list_email_ids endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/emails/count", response_model=EmailCountResponse, tags=["Emails"])
+async def get_email_count(
+    fingerprint: str = Query(..., description="The count_fingerprint returned by /emails."),
+    wait: float = Query(0, ge=0, le=30, description="Seconds to wait for a running count to finish (long-poll).")
+):
+    """
+    Returns the exact total for a listing whose /emails response had total_is_exact=false.
+    The count runs in the background; poll this endpoint (optionally long-polling with `wait`).
+    """
+    try:
+        status = await run_blocking(gmail_service.get_count_status, fingerprint, wait=wait)
+    except Exception as e:
+        logging.error(f"Error in get_email_count: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown count fingerprint.")
+    return status
+
+@app.post("/emails/prefetch/cancel", tags=["Emails"])
+async def cancel_prefetch():
+    """
+    Drops the queued background prefetch (e.g. when the user leaves the list view).
+    """
+    return {"dropped": gmail_service.prefetcher.cancel()}
+
 @app.get("/emails/{email_id}", response_model=EmailDetails, tags=["Emails"])
-def get_email_content(email_id: str):
+async def get_email_content(email_id: str):
     """
     Retrieves the full content and details of a single email.
     """
     try:
-        email_details = gmail_service.get_email_details(email_id)
+        email_details = await gmail_service.aget_email_details(email_id)
         if not email_details:
             raise HTTPException(status_code=404, detail="Email not found.")
         return email_details
@@ -169,108 +341,129 @@ def get_email_content(email_id: str):
         raise HTTPException(status_code=500, detail="Failed to retrieve email content.")
 
 @app.post("/emails/{email_id}/trash", status_code=204, tags=["Actions"])
-def trash_email(email_id: str):
+async def trash_email(email_id: str):
     """
     Moves a specific email to the trash.
     """
     try:
-        gmail_service.trash_email(email_id)
+        await gmail_service.atrash_email(email_id)
+        dashboard_cache.mark_stale()
         return
     except Exception as e:
         logging.error(f"Error in trash_email '{email_id}': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to move email to trash.")
 
 @app.get("/subjects/unique", response_model=UniqueSubjectsResponse, tags=["Emails"])
-def get_unique_subjects(
+async def get_unique_subjects(
     folder: Optional[str] = Query(None),
     inbox_filter: Optional[str] = Query(None),
     label: Optional[str] = Query(None)
 ):
-    label_ids = []
-    inbox_categories = {
-        "PRIMARY": "CATEGORY_PERSONAL",
-        "PROMOTIONS": "CATEGORY_PROMOTIONS",
-        "SOCIAL": "CATEGORY_SOCIAL",
-        "NOTIFICATIONS": "CATEGORY_UPDATES",
-        "FORUMS": "CATEGORY_FORUMS",
-    }
+    label_ids = await resolve_label_ids(folder, inbox_filter, label)
 
-    if label:
-        # Note: For user labels, the service needs the ID, not the name.
-        # Assuming the service method can handle looking up ID if not passed, 
-        # but main.py usually does the lookup. 
-        # Let's lookup the ID here to be consistent with list_emails
-        label_id = gmail_service.labels_map.get(label.upper())
-        if label_id: 
-            label_ids.append(label_id)
-        else:
-            # Fallback or if it's a system label passed as 'label'
-            label_ids.append(label.upper())
-    elif folder and folder.upper() == 'INBOX' and inbox_filter and inbox_filter.upper() in inbox_categories:
-        label_ids.append('INBOX')
-        label_ids.append(inbox_categories[inbox_filter.upper()])
-    elif folder:
-        label_ids.append(folder.upper())
-    
     # Default to INBOX if nothing provided
     if not label_ids:
         label_ids.append('INBOX')
 
     try:
-        subjects = gmail_service.get_unique_subjects(label_ids=label_ids)
+        subjects = await run_blocking(gmail_service.get_unique_subjects, label_ids=label_ids)
         return {"subjects": list(subjects)}
     except Exception as e:
         logging.error(f"Error in get_unique_subjects: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/emails/{email_id}/assign-labels", status_code=204, tags=["Actions"])
-def assign_labels_to_email(email_id: str, request: ModifyLabelsRequest):
+async def assign_labels_to_email(email_id: str, request: ModifyLabelsRequest):
     """
     Assigns or removes labels for a specific email using label names.
     """
     try:
-        gmail_service.modify_email_by_name(
+        await gmail_service.amodify_email_by_name(
             email_id,
             add_label_names=request.add_label_names,
             remove_label_names=request.remove_label_names
         )
+        dashboard_cache.mark_stale()
         return
     except Exception as e:
         logging.error(f"Error in assign_labels '{email_id}': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/emails/{email_id}/archive", status_code=204, tags=["Actions"])
-def archive_email(email_id: str):
+async def archive_email(email_id: str):
     """
     Archives a specific email by removing the 'INBOX' label.
     """
     try:
-        gmail_service.archive_email(email_id)
+        await gmail_service.aarchive_email(email_id)
+        dashboard_cache.mark_stale()
         return
     except Exception as e:
         logging.error(f"Error in archive_email '{email_id}': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/actions/batch", status_code=204, tags=["Actions"])
-def perform_batch_action(request: BatchActionRequest):
+# Query parameters accepted by /emails that translate into a Gmail search query.
+# received_before (epoch seconds) is only accepted here, in batch query_params.
+QUERY_FILTER_KEYS = ("from_sender", "to_recipient", "subject", "after_date", "before_date", "received_before")
+
+@app.post("/actions/batch", response_model=BatchActionResponse, tags=["Actions"])
+async def perform_batch_action(
+    request: BatchActionRequest,
+    background: bool = Query(False, description="Run as a background job and return its ID (202).")
+):
     """
     Performs a batch action (archive, trash, assign labels) on selected emails.
-    Expects a list of IDs. Filtering logic is now client-side (fetching IDs first).
+    Either on an explicit list of IDs, or, with select_all_matching, on every email
+    matching query_params (same keys as /emails). In that case the server streams
+    matching IDs page by page into the batch pipeline; the client never sees them.
+    Returns which IDs succeeded and which failed (after retries), or with
+    background=true a job (202) whose progress is available under /jobs/{id}.
     """
     try:
-        # We now expect IDs to be provided by the client even for "All Matching"
-        if not request.ids:
-             raise HTTPException(status_code=400, detail="No IDs provided for batch action.")
-
-        gmail_service.perform_batch_action(
-            action=request.action,
-            ids=request.ids,
-            query_params=None, # Deprecated for this endpoint logic
-            add_labels=request.add_label_names,
-            remove_labels=request.remove_label_names
-        )
-        return
+        if request.select_all_matching:
+            params = request.query_params or {}
+            label_ids = await resolve_label_ids(params.get("folder"), params.get("inbox_filter"), params.get("label"))
+            filters = {key: params.get(key) for key in QUERY_FILTER_KEYS if params.get(key)}
+            if not label_ids and not filters:
+                raise HTTPException(status_code=400, detail="Refusing to apply a batch action to the whole mailbox.")
+
+            def run(progress=None):
+                try:
+                    return gmail_service.perform_batch_action_matching(
+                        action=request.action,
+                        label_ids=label_ids,
+                        add_labels=request.add_label_names,
+                        remove_labels=request.remove_label_names,
+                        progress=progress,
+                        **filters
+                    )
+                finally:
+                    # Also when cancelled part-way: some messages were modified.
+                    dashboard_cache.mark_stale()
+        else:
+            if not request.ids:
+                 raise HTTPException(status_code=400, detail="No IDs provided for batch action.")
+
+            def run(progress=None):
+                try:
+                    return gmail_service.perform_batch_action(
+                        action=request.action,
+                        ids=request.ids,
+                        add_labels=request.add_label_names,
+                        remove_labels=request.remove_label_names,
+                        progress=progress
+                    )
+                finally:
+                    dashboard_cache.mark_stale()
+
+        if background:
+            return await submit_job("batch_action", run, request.model_dump(exclude={"ids"}))
+        return await run_blocking(run)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error in perform_batch_action: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to perform batch action.")
@@ -278,78 +471,174 @@ def perform_batch_action(request: BatchActionRequest):
 # --- Placeholder Endpoints ---
 
 @app.get("/dashboard/summary", tags=["Dashboard"])
-def get_dashboard_summary():
+async def get_dashboard_summary(
+    mode: str = Query("exact", pattern="^(exact|estimate)$", description="'estimate' answers immediately and counts exactly in the background.")
+):
     """
     Placeholder endpoint for a future dashboard.
     Updated to match the data structure expected by the frontend.
     """
-    stats = gmail_service.get_dashboard_stats()
+    try:
+        stats = await cached_dashboard(("summary", mode), gmail_service.get_dashboard_stats, mode=mode)
+    except Exception as e:
+        logging.error(f"Error in get_dashboard_summary: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
     return {
         "message": "Dashboard data loaded.",
         "total_emails": stats.get("total_emails", 0),
-        "unread_emails": stats.get("unread_emails", 0)
+        "unread_emails": stats.get("unread_emails", 0),
+        "counts_exact": stats.get("counts_exact", True),
+        "computed_at": stats["computed_at"],
+        "stale": stats["stale"]
     }
 
 @app.get("/dashboard/subjects", response_model=SubjectCountListResponse, tags=["Dashboard"])
-def get_dashboard_subjects(
+async def get_dashboard_subjects(
     folder: Optional[str] = Query(None),
     inbox_filter: Optional[str] = Query(None),
-    label: Optional[str] = Query(None)
+    label: Optional[str] = Query(None),
+    mode: str = Query("sample", pattern="^(sample|exact|approximate)$", description="'sample' counts the 500 most recent emails; 'exact' and 'approximate' (top-K) cover the whole folder/label."),
+    normalize: bool = Query(False, description="Group subjects that only differ by Re:/Fwd:, ticket IDs or numbers."),
+    top: Optional[int] = Query(None, ge=1, le=5000, description="Return at most this many subjects."),
+    background: bool = Query(False, description="Run as a background job and return its ID (202).")
 ):
     """
     Retrieves subject counts for a specific folder/label.
     Defaults to INBOX -> Primary if nothing specified.
     """
-    label_ids = []
-    inbox_categories = {
-        "PRIMARY": "CATEGORY_PERSONAL",
-        "PROMOTIONS": "CATEGORY_PROMOTIONS",
-        "SOCIAL": "CATEGORY_SOCIAL",
-        "NOTIFICATIONS": "CATEGORY_UPDATES",
-        "FORUMS": "CATEGORY_FORUMS",
-    }
+    label_ids = await resolve_label_ids(folder, inbox_filter, label)
 
-    if label:
-        label_id = gmail_service.labels_map.get(label.upper())
-        if label_id: 
-            label_ids.append(label_id)
-        else:
-            label_ids.append(label.upper())
-    elif folder and folder.upper() == 'INBOX' and inbox_filter and inbox_filter.upper() in inbox_categories:
-        label_ids.append('INBOX')
-        label_ids.append(inbox_categories[inbox_filter.upper()])
-    elif folder:
-        label_ids.append(folder.upper())
-    
     # Default to INBOX -> Primary if nothing provided
     if not label_ids:
         label_ids.append('INBOX')
         label_ids.append('CATEGORY_PERSONAL')
 
+    # Limit sampling to 500 for performance
+    options = dict(label_ids=label_ids, limit=500, mode=mode, normalize=normalize, top=top)
+    if background:
+        return await submit_job(
+            "subject_counts",
+            lambda progress: {"subjects": gmail_service.get_subject_counts(progress=progress, **options)},
+            options
+        )
+
     try:
-        # Limit to 500 for performance
-        counts = gmail_service.get_subject_counts(label_ids=label_ids, limit=500)
-        return {"subjects": counts}
+        key = ("subjects", tuple(sorted(label_ids)), 500, mode, normalize, top)
+        return await cached_dashboard(key, lambda **kwargs: {"subjects": gmail_service.get_subject_counts(**kwargs)}, **options)
     except Exception as e:
         logging.error(f"Error in get_dashboard_subjects: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/dashboard/senders", response_model=SenderStatsResponse, tags=["Dashboard"])
+async def get_dashboard_senders(
+    folder: Optional[str] = Query(None),
+    inbox_filter: Optional[str] = Query(None),
+    label: Optional[str] = Query(None),
+    group_by: str = Query("address", pattern="^(address|domain)$", description="Aggregate per sender address or per sender domain."),
+    sort: str = Query("count", pattern="^(count|unread|unread_ratio|bytes|newest)$"),
+    top: int = Query(50, ge=1, le=5000, description="Return at most this many senders/domains."),
+    background: bool = Query(False, description="Run as a background job and return its ID (202).")
+):
+    """
+    Retrieves per-sender (or per-domain) volume, unread count/ratio, newest/oldest date and
+    estimated size for a folder/label. Defaults to INBOX -> Primary if nothing specified.
+    Answered from the local metadata store's aggregates once it is synced; until then every
+    message is read from Gmail, so prefer background=true on large folders.
+    """
+    label_ids = await resolve_label_ids(folder, inbox_filter, label)
+    if not label_ids:
+        label_ids = ['INBOX', 'CATEGORY_PERSONAL']
+
+    options = dict(label_ids=label_ids, group_by=group_by, sort=sort, top=top)
+    if background:
+        return await submit_job(
+            "sender_stats",
+            lambda progress: gmail_service.get_sender_stats(progress=progress, **options),
+            options
+        )
+
+    try:
+        key = ("senders", tuple(sorted(label_ids)), group_by, sort, top)
+        return await cached_dashboard(key, gmail_service.get_sender_stats, **options)
+    except Exception as e:
+        logging.error(f"Error in get_dashboard_senders: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/dashboard/full", response_model=FullDashboardResponse, tags=["Dashboard"])
-def get_full_dashboard():
+async def get_full_dashboard(
+    mode: str = Query("exact", pattern="^(exact|estimate)$", description="'estimate' answers immediately and counts exactly in the background."),
+    background: bool = Query(False, description="Run as a background job and return its ID (202).")
+):
     """
     Retrieves all dashboard data (Total, Unread, Subjects) for INBOX -> Primary in one go.
     """
+    # INBOX + CATEGORY_PERSONAL
+    label_ids = ['INBOX', 'CATEGORY_PERSONAL']
+    if background:
+        return await submit_job(
+            "dashboard_full",
+            lambda progress: gmail_service.get_full_dashboard_data(label_ids=label_ids, mode=mode, progress=progress),
+            {"label_ids": label_ids, "mode": mode}
+        )
     try:
-        # INBOX + CATEGORY_PERSONAL
-        label_ids = ['INBOX', 'CATEGORY_PERSONAL']
-        data = gmail_service.get_full_dashboard_data(label_ids=label_ids)
-        return data
+        key = ("full", tuple(sorted(label_ids)), 200, mode)
+        return await cached_dashboard(key, gmail_service.get_full_dashboard_data, label_ids=label_ids, mode=mode)
     except Exception as e:
         logging.error(f"Error in get_full_dashboard: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Quota ---
+
+@app.get("/quota", tags=["Metrics"])
+async def get_quota_metrics():
+    """
+    Current state of the shared Gmail quota limiter: units taken per second (1 s / 10 s /
+    60 s averages), utilization of the per-user budget, time spent throttled, and calls
+    and units per API method since startup.
+    """
+    return gmail_service.quota.metrics()
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Metrics"])
+async def get_metrics():
+    """
+    Prometheus text exposition: request latency per route, Gmail calls and latency per
+    API method, batch sizes and failures, retry backoff, quota units and cache hit ratios.
+    """
+    return PlainTextResponse(
+        metrics.render(gmail_service.quota.metrics()), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+# --- Job Endpoints ---
+
+@app.get("/jobs", response_model=JobListResponse, tags=["Jobs"])
+async def list_jobs(limit: int = Query(50, ge=1, le=500)):
+    """
+    Lists recent background jobs, newest first (without their results).
+    """
+    return {"jobs": await run_blocking(job_manager.list, limit=limit)}
+
+@app.get("/jobs/{job_id}", response_model=JobResponse, tags=["Jobs"])
+async def get_job(job_id: str):
+    """
+    Returns a job's status, processed/total/failed counts, throughput, ETA and, once finished, its result.
+    """
+    job = await run_blocking(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobResponse, tags=["Jobs"])
+async def cancel_job(job_id: str):
+    """
+    Requests cancellation of a queued or running job. Work already sent to Gmail is not undone.
+    """
+    job = await run_blocking(job_manager.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
 @app.post("/alerts/custom", tags=["Alerts"])
-def create_custom_alert():
+async def create_custom_alert():
     """
     Placeholder endpoint for creating custom alerts.
     """
@@ -358,12 +647,12 @@ def create_custom_alert():
 # --- Filter Endpoints ---
 
 @app.get("/api/filters", response_model=FilterResponse, tags=["Filters"], response_model_exclude_none=True)
-def list_filters():
+async def list_filters():
     """
     Lists all user's filters.
     """
     try:
-        filters = gmail_service.list_filters()
+        filters = await run_blocking(gmail_service.list_filters)
         return {"filters": filters}
     except Exception as e:
         import traceback
@@ -371,17 +660,17 @@ def list_filters():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/filters/{filter_id}", response_model=Filter, tags=["Filters"], response_model_exclude_none=True)
-def get_filter(filter_id: str):
+async def get_filter(filter_id: str):
     """
     Gets a specific filter.
     """
     try:
-        return gmail_service.get_filter(filter_id)
+        return await run_blocking(gmail_service.get_filter, filter_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/filters", response_model=Filter, tags=["Filters"], response_model_exclude_none=True)
-def create_filter(filter_request: FilterCreateRequest):
+async def create_filter(filter_request: FilterCreateRequest):
     """
     Creates a new filter. 
     Note: Gmail API expects specific format for criteria and action.
@@ -395,19 +684,19 @@ def create_filter(filter_request: FilterCreateRequest):
         if 'criteria' not in filter_obj: filter_obj['criteria'] = {}
         if 'action' not in filter_obj: filter_obj['action'] = {}
 
-        created_filter = gmail_service.create_filter(filter_obj)
+        created_filter = await run_blocking(gmail_service.create_filter, filter_obj)
         return created_filter
     except Exception as e:
         logging.error(f"Error creating filter: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/filters/{filter_id}", tags=["Filters"])
-def delete_filter(filter_id: str):
+async def delete_filter(filter_id: str):
     """
     Deletes a filter.
     """
     try:
-        gmail_service.delete_filter(filter_id)
+        await run_blocking(gmail_service.delete_filter, filter_id)
         return {"status": "success", "message": f"Filter {filter_id} deleted."}
     except Exception as e:
         logging.error(f"Error deleting filter: {e}", exc_info=True)
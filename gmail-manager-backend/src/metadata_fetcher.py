@@ -0,0 +1,155 @@
+import contextvars
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+from googleapiclient.errors import HttpError
+
+from . import metrics, request_usage
+from .batch_scheduler import MAX_BATCH_SIZE, is_retryable_error
+from .quota import TokenBucket, units_for
+from .records import MessageRecord
+
+# Headers shown in email lists.
+LIST_HEADERS = ('Subject', 'From', 'Date')
+
+# Headers combined into the "to" field of email details.
+RECIPIENT_HEADERS = ('To', 'Cc', 'Bcc')
+
+
+def extract_headers(headers: list, names, multi=()) -> dict:
+    """
+    Picks the wanted headers out of a Gmail header list in a single pass.
+    Returns {name: value} with the first value of each header in `names`, and
+    {name: [values]} for headers in `multi` (e.g. To/Cc/Bcc). Missing headers are absent.
+    Matching is case-insensitive; keys use the spelling given in `names`/`multi`.
+    """
+    wanted = {name.lower(): name for name in names}
+    wanted_multi = {name.lower(): name for name in multi}
+    found = {}
+    for header in headers:
+        key = header['name'].lower()
+        name = wanted_multi.get(key)
+        if name is not None:
+            found.setdefault(name, []).append(header['value'])
+            continue
+        name = wanted.get(key)
+        if name is not None and name not in found:
+            found[name] = header['value']
+    return found
+
+
+class MetadataFetcher:
+    """
+    Batch-fetches message metadata for any number of IDs.
+
+    IDs are consumed lazily and split into batch requests of up to 100 calls. Up to
+    `max_workers` batches run concurrently, each first taking its quota units from
+    the shared token bucket. Sub-requests that fail with a retryable error are retried
+    with backoff; messages that no longer exist (404) are skipped.
+
+    Background users (the metadata store sync) get their own fetcher with a quota
+    `reserve`, so they neither occupy the foreground fetcher's threads nor spend the
+    units foreground requests need.
+    """
+
+    def __init__(self, service_factory, bucket: TokenBucket, batch_size: int = MAX_BATCH_SIZE,
+                 max_workers: int = 4, max_attempts: int = 4, base_backoff: float = 0.5, sleep=time.sleep,
+                 reserve: float = 0, name: str = "metadata-fetch"):
+        self.service_factory = service_factory
+        self.bucket = bucket
+        self.reserve = reserve
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.sleep = sleep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def _fetch_batch(self, ids: list, headers, fmt: str, failed_ids: list = None) -> list:
+        """
+        Fetches one batch, retrying failed sub-requests. Returns the raw responses and
+        adds the IDs given up on (not the deleted ones) to `failed_ids`, if given.
+        """
+        if failed_ids is None:
+            failed_ids = []
+        responses = []
+        pending = list(ids)
+        service = self.service_factory()
+        for attempt in range(self.max_attempts):
+            failed = []
+
+            def batch_callback(request_id, response, exception):
+                if exception is None:
+                    responses.append(response)
+                elif isinstance(exception, HttpError) and exception.resp.status == 404:
+                    pass  # Deleted since it was listed
+                elif is_retryable_error(exception):
+                    failed.append(request_id)
+                else:
+                    logging.warning(f"Metadata fetch failed for message '{request_id}': {exception}")
+                    failed_ids.append(request_id)
+
+            batch = service.new_batch_http_request(callback=metrics.instrument_batch('messages.get', batch_callback))
+            for email_id in pending:
+                kwargs = {"metadataHeaders": list(headers)} if fmt == 'metadata' else {}
+                batch.add(service.users().messages().get(userId='me', id=email_id, format=fmt, **kwargs),
+                          request_id=email_id)
+            try:
+                # Charged before the quota is taken, so a call over the budget spends none.
+                request_usage.charge(len(pending), batch=True)
+                self.bucket.acquire(units_for('messages.get', len(pending)), method='messages.get', reserve=self.reserve)
+                metrics.execute_batch(batch, 'messages.get', len(pending), charged=True)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    logging.error(f"Metadata batch of {len(pending)} messages failed: {e}")
+                    failed_ids.extend(pending)
+                    return responses
+                failed = pending
+            if not failed:
+                break
+            pending = failed
+            if attempt + 1 < self.max_attempts:
+                delay = self.base_backoff * (2 ** attempt) + random.uniform(0, self.base_backoff)
+                logging.warning(f"{len(pending)} metadata fetches failed; retrying in {delay:.2f}s.")
+                metrics.observe_backoff('metadata_fetcher', delay)
+                self.sleep(delay)
+        else:
+            logging.error(f"Giving up on metadata for {len(pending)} messages.")
+            failed_ids.extend(pending)
+        return responses
+
+    def iter_responses(self, ids, headers=LIST_HEADERS, fmt: str = 'metadata', failed_ids: list = None):
+        """
+        Yields raw messages.get responses for `ids` (any iterable), in completion order.
+        At most `max_workers` batches are in flight, so the input is read lazily.
+        IDs that could not be fetched (other than deleted ones) are added to `failed_ids`.
+        """
+        ids = iter(ids)
+        in_flight = set()
+        while True:
+            while len(in_flight) < self.max_workers:
+                chunk = list(islice(ids, self.batch_size))
+                if not chunk:
+                    break
+                # Fetch in the caller's context so the batches count towards its request usage.
+                in_flight.add(self._executor.submit(
+                    contextvars.copy_context().run, self._fetch_batch, chunk, headers, fmt, failed_ids
+                ))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+    def iter_records(self, ids, headers=LIST_HEADERS):
+        """Yields a MessageRecord for each of `ids`, in completion order."""
+        for response in self.iter_responses(ids, headers):
+            yield MessageRecord.from_message(response)
+
+    def fetch_records(self, ids: list, headers=LIST_HEADERS) -> list:
+        """Fetches records for `ids` and returns them in the order of `ids` (missing ones dropped)."""
+        by_id = {record.id: record for record in self.iter_records(ids, headers)}
+        return [by_id[email_id] for email_id in ids if email_id in by_id]
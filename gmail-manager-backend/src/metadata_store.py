@@ -0,0 +1,744 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from . import metrics, request_usage
+from .config import METADATA_DB_FILE
+from .quota import TokenBucket, units_for
+from .sender_stats import SORT_ORDERS, aggregate_keys, key_labels, label_key, parse_sender, to_stat
+from .subjects import NO_SUBJECT
+
+# Headers we keep locally for every message. Anything else needs a live API call.
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+
+# Labels Gmail hides from messages.list unless they are requested explicitly.
+HIDDEN_LABELS = ('SPAM', 'TRASH')
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    label_ids TEXT NOT NULL DEFAULT '[]',
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    snippet TEXT,
+    internal_date INTEGER NOT NULL DEFAULT 0,
+    size_estimate INTEGER NOT NULL DEFAULT 0,
+    sender_address TEXT NOT NULL DEFAULT '',
+    sender_domain TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_messages_internal_date ON messages (internal_date DESC);
+
+CREATE TABLE IF NOT EXISTS message_labels (
+    label_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    PRIMARY KEY (label_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_message_labels_message ON message_labels (message_id);
+
+-- Per-label sender aggregates, maintained incrementally by every write (see _update_sender_stats).
+-- label_key is a label ID, '*' for all visible mail, or 'CATEGORY_X&INBOX' for an inbox tab.
+CREATE TABLE IF NOT EXISTS sender_stats (
+    label_key TEXT NOT NULL,
+    address TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0,
+    unread INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    newest INTEGER,
+    oldest INTEGER,
+    dates_stale INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (label_key, address)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sender_stats_domain ON sender_stats (label_key, domain);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Messages whose metadata could not be fetched; re-fetched on every sync until they are stored.
+CREATE TABLE IF NOT EXISTS pending_fetch (
+    id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+
+def message_to_row(msg: dict) -> dict:
+    """Flattens a messages.get(format='metadata') response into a store row."""
+    headers = msg.get('payload', {}).get('headers', [])
+    wanted = {}
+    for header in headers:
+        if header['name'] in METADATA_HEADERS and header['name'] not in wanted:
+            wanted[header['name']] = header['value']
+    return {
+        "id": msg['id'],
+        "thread_id": msg.get('threadId', ''),
+        "label_ids": msg.get('labelIds', []),
+        "subject": wanted.get('Subject', ''),
+        "sender": wanted.get('From', 'Unknown Sender'),
+        "date": wanted.get('Date', ''),
+        "snippet": msg.get('snippet', ''),
+        "internal_date": int(msg.get('internalDate', 0) or 0),
+        "size_estimate": int(msg.get('sizeEstimate', 0) or 0),
+    }
+
+
+class MetadataStore:
+    """
+    Local SQLite copy of message metadata (ids, labels, Subject/From/Date, snippet).
+    Filled once by a backfill, then kept current with users.history.list deltas
+    so that label-only list/count/subject queries never need to touch Gmail.
+    """
+
+    def __init__(self, db_path: str = METADATA_DB_FILE, fetch_chunk_size: int = 50, fetcher=None,
+                 quota: TokenBucket = None, quota_reserve: float = 0):
+        self.db_path = db_path
+        self.fetch_chunk_size = fetch_chunk_size
+        # Quota limiter every sync call takes its units from (the service's shared one).
+        # Sync calls leave `quota_reserve` units to foreground requests.
+        self.quota = quota or TokenBucket()
+        self.quota_reserve = quota_reserve
+        # Optional MetadataFetcher: concurrent, quota-limited batches instead of the serial fallback below.
+        self.fetcher = fetcher
+        self._conn = None
+        self._lock = threading.RLock()
+        # Optional callback receiving the label IDs seen in each history sync.
+        self.on_label_ids = None
+
+    # --- Connection / state helpers ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            self._conn = conn
+        return self._conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Upgrades databases created before sender aggregates existed or missing subjects were stored empty."""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(messages)")}
+        if 'sender_address' not in columns:
+            logging.info("Metadata store: adding sender columns and building sender aggregates.")
+            with conn:
+                conn.execute("ALTER TABLE messages ADD COLUMN sender_address TEXT NOT NULL DEFAULT ''")
+                conn.execute("ALTER TABLE messages ADD COLUMN sender_domain TEXT NOT NULL DEFAULT ''")
+                updates = []
+                for row in conn.execute("SELECT id, sender FROM messages"):
+                    address, _, domain = parse_sender(row['sender'])
+                    updates.append((address, domain, row['id']))
+                conn.executemany("UPDATE messages SET sender_address = ?, sender_domain = ? WHERE id = ?", updates)
+                self._rebuild_sender_stats(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_address)")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            # Missing subjects used to be stored as the display text 'No Subject'.
+            with conn:
+                conn.execute("UPDATE messages SET subject = '' WHERE subject = 'No Subject'")
+                conn.execute("PRAGMA user_version = 1")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _get_state(self, key: str, default=None):
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def _set_state(self, conn: sqlite3.Connection, key: str, value):
+        if value is None:
+            conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
+
+    def is_ready(self) -> bool:
+        """True once the initial backfill has completed and the store can answer queries."""
+        return self._get_state('backfill_complete') == '1'
+
+    def get_history_id(self):
+        return self._get_state('history_id')
+
+    # --- Writes ---
+
+    def _message_states(self, conn: sqlite3.Connection, ids: list) -> list:
+        """What the given stored messages currently contribute to sender_stats (see _update_sender_stats)."""
+        states = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                "SELECT id, label_ids, sender, sender_address, sender_domain, internal_date, size_estimate "
+                f"FROM messages WHERE id IN ({placeholders})", chunk
+            ):
+                states.append(dict(row, label_ids=json.loads(row['label_ids'])))
+        return states
+
+    def _update_sender_stats(self, conn: sqlite3.Connection, states: list, sign: int):
+        """
+        Adds (sign=1) or removes (sign=-1) messages from the sender aggregates. Each state
+        holds label_ids, sender, sender_address, sender_domain, internal_date and size_estimate.
+        Removing a message whose date bounded a row only flags the row's dates as stale;
+        they are recomputed on the next read (_refresh_stale_dates).
+        """
+        deltas = {}
+        for state in states:
+            unread = 1 if 'UNREAD' in state['label_ids'] else 0
+            date, size = state['internal_date'], state['size_estimate']
+            name = parse_sender(state['sender'])[1] if sign > 0 else ''
+            for key in aggregate_keys(state['label_ids'], HIDDEN_LABELS):
+                delta = deltas.get((key, state['sender_address']))
+                if delta is None:
+                    delta = deltas[(key, state['sender_address'])] = {
+                        "label_key": key, "address": state['sender_address'], "domain": state['sender_domain'],
+                        "name": name, "count": 0, "unread": 0, "bytes": 0, "newest": date, "oldest": date,
+                    }
+                delta['count'] += 1
+                delta['unread'] += unread
+                delta['bytes'] += size
+                if date >= delta['newest']:
+                    delta['newest'] = date
+                    delta['name'] = name or delta['name']
+                delta['oldest'] = min(delta['oldest'], date)
+        if not deltas:
+            return
+        if sign > 0:
+            conn.executemany(
+                "INSERT INTO sender_stats (label_key, address, domain, name, count, unread, bytes, newest, oldest) "
+                "VALUES (:label_key, :address, :domain, :name, :count, :unread, :bytes, :newest, :oldest) "
+                "ON CONFLICT(label_key, address) DO UPDATE SET "
+                "count = count + excluded.count, unread = unread + excluded.unread, bytes = bytes + excluded.bytes, "
+                "name = CASE WHEN excluded.name != '' AND excluded.newest >= newest THEN excluded.name ELSE name END, "
+                "newest = MAX(newest, excluded.newest), oldest = MIN(oldest, excluded.oldest)",
+                list(deltas.values())
+            )
+        else:
+            conn.executemany(
+                "UPDATE sender_stats SET "
+                "count = count - :count, unread = unread - :unread, bytes = bytes - :bytes, "
+                "dates_stale = (dates_stale OR :newest >= newest OR :oldest <= oldest) "
+                "WHERE label_key = :label_key AND address = :address",
+                list(deltas.values())
+            )
+            conn.executemany(
+                "DELETE FROM sender_stats WHERE label_key = :label_key AND address = :address AND count <= 0",
+                list(deltas.values())
+            )
+
+    def _rebuild_sender_stats(self, conn: sqlite3.Connection):
+        """Recomputes every sender aggregate from the stored messages."""
+        conn.execute("DELETE FROM sender_stats")
+        cursor = conn.execute(
+            "SELECT label_ids, sender, sender_address, sender_domain, internal_date, size_estimate FROM messages"
+        )
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            self._update_sender_stats(conn, [dict(row, label_ids=json.loads(row['label_ids'])) for row in rows], 1)
+
+    def upsert_messages(self, rows: list):
+        """Inserts or replaces message rows together with their label memberships and sender aggregates."""
+        if not rows:
+            return
+        prepared = []
+        for row in rows:
+            address, _, domain = parse_sender(row['sender'])
+            prepared.append(dict(row, label_ids_json=json.dumps(row['label_ids']),
+                                 sender_address=address, sender_domain=domain))
+        rows = prepared
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                self._update_sender_stats(conn, self._message_states(conn, [row['id'] for row in rows]), -1)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages "
+                    "(id, thread_id, label_ids, subject, sender, date, snippet, internal_date, size_estimate, "
+                    "sender_address, sender_domain) "
+                    "VALUES (:id, :thread_id, :label_ids_json, :subject, :sender, :date, :snippet, :internal_date, "
+                    ":size_estimate, :sender_address, :sender_domain)",
+                    rows
+                )
+                conn.executemany(
+                    "DELETE FROM message_labels WHERE message_id = ?",
+                    [(row['id'],) for row in rows]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO message_labels (label_id, message_id) VALUES (?, ?)",
+                    [(label_id, row['id']) for row in rows for label_id in row['label_ids']]
+                )
+                self._update_sender_stats(conn, rows, 1)
+
+    def delete_messages(self, ids: list):
+        if not ids:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                self._update_sender_stats(conn, self._message_states(conn, ids), -1)
+                conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in ids])
+                conn.executemany("DELETE FROM message_labels WHERE message_id = ?", [(i,) for i in ids])
+                conn.executemany("DELETE FROM pending_fetch WHERE id = ?", [(i,) for i in ids])
+
+    def set_labels(self, label_updates: dict):
+        """
+        Replaces the label set of already-stored messages.
+        `label_updates` maps message id -> full list of label ids.
+        Unknown ids are ignored; they will arrive through messagesAdded or the next backfill.
+        """
+        if not label_updates:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                states = self._message_states(conn, list(label_updates))
+                self._update_sender_stats(conn, states, -1)
+                for state in states:
+                    message_id = state['id']
+                    label_ids = label_updates[message_id]
+                    conn.execute(
+                        "UPDATE messages SET label_ids = ? WHERE id = ?",
+                        (json.dumps(label_ids), message_id)
+                    )
+                    conn.execute("DELETE FROM message_labels WHERE message_id = ?", (message_id,))
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO message_labels (label_id, message_id) VALUES (?, ?)",
+                        [(label_id, message_id) for label_id in label_ids]
+                    )
+                    state['label_ids'] = label_ids
+                self._update_sender_stats(conn, states, 1)
+
+    def apply_label_delta(self, ids: list, add_label_ids: list = None, remove_label_ids: list = None):
+        """
+        Optimistically applies a label change we just sent to Gmail, so reads made
+        before the next history sync already reflect it.
+        """
+        if not ids:
+            return
+        add_label_ids = add_label_ids or []
+        remove_label_ids = set(remove_label_ids or [])
+        updates = {}
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT id, label_ids FROM messages WHERE id IN ({placeholders})", chunk):
+                    labels = [l for l in json.loads(row['label_ids']) if l not in remove_label_ids]
+                    labels.extend(l for l in add_label_ids if l not in labels)
+                    updates[row['id']] = labels
+            self.set_labels(updates)
+
+    def reset(self):
+        """Drops all stored data and sync state, forcing a fresh backfill."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM messages")
+                conn.execute("DELETE FROM message_labels")
+                conn.execute("DELETE FROM sender_stats")
+                conn.execute("DELETE FROM sync_state")
+                conn.execute("DELETE FROM pending_fetch")
+
+    # --- Reads ---
+
+    def _label_filter(self, label_ids: list) -> tuple[str, list]:
+        """
+        Builds a WHERE clause selecting messages carrying ALL of `label_ids`,
+        mirroring messages.list semantics (SPAM/TRASH hidden unless asked for).
+        """
+        clauses, params = [], []
+        label_ids = list(dict.fromkeys(label_ids or []))
+        if label_ids:
+            placeholders = ",".join("?" * len(label_ids))
+            clauses.append(
+                f"m.id IN (SELECT message_id FROM message_labels WHERE label_id IN ({placeholders}) "
+                f"GROUP BY message_id HAVING COUNT(*) = ?)"
+            )
+            params.extend(label_ids)
+            params.append(len(label_ids))
+        hidden = [l for l in HIDDEN_LABELS if l not in label_ids]
+        if hidden:
+            placeholders = ",".join("?" * len(hidden))
+            clauses.append(
+                f"NOT EXISTS (SELECT 1 FROM message_labels h WHERE h.message_id = m.id AND h.label_id IN ({placeholders}))"
+            )
+            params.extend(hidden)
+        where = " AND ".join(clauses) if clauses else "1"
+        return where, params
+
+    @staticmethod
+    def _row_to_email(row: sqlite3.Row) -> dict:
+        label_ids = json.loads(row['label_ids'])
+        return {
+            "id": row['id'],
+            "thread_id": row['thread_id'],
+            "snippet": row['snippet'] or '',
+            "subject": row['subject'] or NO_SUBJECT,
+            "sender": row['sender'] or 'Unknown Sender',
+            "date": row['date'] or '',
+            "is_unread": 'UNREAD' in label_ids
+        }
+
+    def list_messages(self, label_ids: list, offset: int = 0, limit: int = 25) -> list:
+        """Returns email dicts (same shape as GmailService.list_emails) newest first."""
+        where, params = self._label_filter(label_ids)
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM messages m WHERE {where} ORDER BY m.internal_date DESC, m.id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [self._row_to_email(row) for row in rows]
+
+    def list_ids(self, label_ids: list) -> list:
+        where, params = self._label_filter(label_ids)
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT m.id FROM messages m WHERE {where} ORDER BY m.internal_date DESC, m.id DESC",
+                params
+            ).fetchall()
+        return [row['id'] for row in rows]
+
+    def get_label_ids(self, email_id: str):
+        """Returns the current label IDs of a stored message, or None if it is not stored."""
+        with self._lock:
+            row = self._connect().execute("SELECT label_ids FROM messages WHERE id = ?", (email_id,)).fetchone()
+        return json.loads(row['label_ids']) if row else None
+
+    def count(self, label_ids: list) -> int:
+        where, params = self._label_filter(label_ids)
+        with self._lock:
+            row = self._connect().execute(f"SELECT COUNT(*) AS n FROM messages m WHERE {where}", params).fetchone()
+        return row['n']
+
+    def subject_counts(self, label_ids: list, limit: int = None) -> list:
+        """
+        Subject counts over the `limit` most recent messages (all of them if no limit),
+        sorted by count desc. Same output shape as GmailService.get_subject_counts.
+        """
+        where, params = self._label_filter(label_ids)
+        inner = f"SELECT COALESCE(m.subject, '') AS subject FROM messages m WHERE {where}"
+        if limit:
+            inner += " ORDER BY m.internal_date DESC LIMIT ?"
+            params = params + [limit]
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT subject, COUNT(*) AS count FROM ({inner}) GROUP BY subject ORDER BY count DESC",
+                params
+            ).fetchall()
+        return [{"subject": row['subject'] or NO_SUBJECT, "count": row['count']} for row in rows]
+
+    def _refresh_stale_dates(self, conn: sqlite3.Connection, key: str):
+        """Recomputes newest/oldest of the aggregates under `key` that lost a bounding message."""
+        where, params = self._label_filter(key_labels(key))
+        with conn:
+            conn.execute(
+                "UPDATE sender_stats SET dates_stale = 0, "
+                f"newest = (SELECT MAX(m.internal_date) FROM messages m WHERE m.sender_address = sender_stats.address AND {where}), "
+                f"oldest = (SELECT MIN(m.internal_date) FROM messages m WHERE m.sender_address = sender_stats.address AND {where}) "
+                "WHERE label_key = ? AND dates_stale = 1",
+                params + params + [key]
+            )
+
+    def sender_stats(self, label_ids: list, group_by: str = "address", sort: str = "count", limit: int = 50) -> list:
+        """
+        Per-sender (or per-domain) count, unread count, newest/oldest date and estimated bytes
+        of the messages carrying `label_ids`, sorted by `sort` (see SORT_ORDERS).
+        Single labels, all mail and inbox tabs are read from the incrementally maintained
+        sender_stats table; other label combinations are grouped from the messages table.
+        """
+        key = label_key(label_ids)
+        with self._lock:
+            conn = self._connect()
+            if key is None:
+                where, params = self._label_filter(label_ids)
+                column = "m.sender_domain" if group_by == "domain" else "m.sender_address"
+                name = "''" if group_by == "domain" else "MAX(m.sender)"
+                inner = (
+                    f"SELECT {column} AS key, {name} AS name, "
+                    "MAX(m.sender_domain) AS domain, COUNT(*) AS count, "
+                    "SUM(EXISTS (SELECT 1 FROM message_labels u WHERE u.label_id = 'UNREAD' AND u.message_id = m.id)) AS unread, "
+                    "SUM(m.size_estimate) AS bytes, MAX(m.internal_date) AS newest, MIN(m.internal_date) AS oldest "
+                    f"FROM messages m WHERE {where} GROUP BY {column}"
+                )
+            else:
+                self._refresh_stale_dates(conn, key)
+                params = [key]
+                if group_by == "domain":
+                    inner = (
+                        "SELECT domain AS key, '' AS name, domain, SUM(count) AS count, SUM(unread) AS unread, "
+                        "SUM(bytes) AS bytes, MAX(newest) AS newest, MIN(oldest) AS oldest "
+                        "FROM sender_stats WHERE label_key = ? GROUP BY domain"
+                    )
+                else:
+                    inner = (
+                        "SELECT address AS key, name, domain, count, unread, bytes, newest, oldest "
+                        "FROM sender_stats WHERE label_key = ?"
+                    )
+            rows = conn.execute(
+                f"SELECT * FROM ({inner}) ORDER BY {SORT_ORDERS[sort]}, key LIMIT ?", params + [limit]
+            ).fetchall()
+        stats = [to_stat(row) for row in rows]
+        if key is None and group_by != "domain":
+            # The ad-hoc grouping returns a raw From header; keep only its display name.
+            for stat in stats:
+                stat['name'] = parse_sender(stat['name'])[1]
+        return stats
+
+    # --- Sync with Gmail ---
+
+    def _execute(self, request, method: str):
+        request_usage.charge()
+        self.quota.acquire(units_for(method), method=method, reserve=self.quota_reserve)
+        return metrics.execute(request, method, charged=True)
+
+    def _fetch_metadata(self, service, ids: list) -> tuple[list, list]:
+        """Batch-fetches metadata for `ids`. Returns (rows, failed_ids)."""
+        rows, failed = [], []
+
+        def batch_callback(request_id, response, exception):
+            if exception:
+                if not (isinstance(exception, HttpError) and exception.resp.status == 404):
+                    failed.append(request_id)
+                return
+            rows.append(message_to_row(response))
+
+        for i in range(0, len(ids), self.fetch_chunk_size):
+            chunk = ids[i:i + self.fetch_chunk_size]
+            batch = service.new_batch_http_request(callback=metrics.instrument_batch('messages.get', batch_callback))
+            for message_id in chunk:
+                batch.add(
+                    service.users().messages().get(
+                        userId='me', id=message_id, format='metadata', metadataHeaders=METADATA_HEADERS
+                    ),
+                    request_id=message_id
+                )
+            try:
+                request_usage.charge(len(chunk), batch=True)
+                self.quota.acquire(units_for('messages.get', len(chunk)), method='messages.get', reserve=self.quota_reserve)
+                metrics.execute_batch(batch, 'messages.get', len(chunk), charged=True)
+            except Exception as e:
+                logging.error(f"Metadata store: batch fetch failed for {len(chunk)} messages: {e}")
+                failed.extend(chunk)
+        return rows, failed
+
+    def _fetch_with_retry(self, service, ids: list, max_attempts: int = 3) -> list:
+        """
+        Fetches metadata, re-trying only the ids whose sub-requests failed. Ids still
+        failing are recorded in pending_fetch and re-fetched by the next sync.
+        """
+        if self.fetcher is not None:
+            # The fetcher retries failed sub-requests itself and skips deleted messages.
+            pending = []
+            rows = [message_to_row(response)
+                    for response in self.fetcher.iter_responses(ids, METADATA_HEADERS, failed_ids=pending)]
+        else:
+            rows = []
+            pending = ids
+            for attempt in range(max_attempts):
+                fetched, pending = self._fetch_metadata(service, pending)
+                rows.extend(fetched)
+                if not pending:
+                    break
+                logging.warning(f"Metadata store: {len(pending)} messages failed, retrying (attempt {attempt + 1}).")
+                metrics.observe_backoff('metadata_store', 2 ** attempt)
+                time.sleep(2 ** attempt)
+        if pending:
+            logging.error(f"Metadata store: giving up on {len(pending)} messages for now; they will be re-fetched on the next sync.")
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("INSERT OR IGNORE INTO pending_fetch (id) VALUES (?)", [(i,) for i in pending])
+        return rows
+
+    def pending_ids(self) -> list:
+        """Ids of messages whose metadata is still missing after a failed fetch."""
+        with self._lock:
+            return [row['id'] for row in self._connect().execute("SELECT id FROM pending_fetch")]
+
+    def fetch_pending(self, service) -> int:
+        """Re-fetches the messages recorded in pending_fetch. Returns how many were stored."""
+        ids = self.pending_ids()
+        if not ids:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # Failures are recorded again by _fetch_with_retry; deleted messages drop out.
+                conn.executemany("DELETE FROM pending_fetch WHERE id = ?", [(i,) for i in ids])
+        rows = self._fetch_with_retry(service, ids)
+        self.upsert_messages(rows)
+        logging.info(f"Metadata store: re-fetched {len(rows)} of {len(ids)} pending messages.")
+        return len(rows)
+
+    def backfill(self, service):
+        """
+        Loads metadata for every message in the mailbox. Resumable: the list page token
+        is persisted after each page, so an interrupted backfill continues where it stopped.
+        The profile historyId is captured before the first page so no change is missed.
+        """
+        if self._get_state('history_id') is None:
+            profile = self._execute(service.users().getProfile(userId='me'), 'getProfile')
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    self._set_state(conn, 'history_id', profile['historyId'])
+            logging.info(f"Metadata store: starting backfill at historyId {profile['historyId']}.")
+
+        page_token = self._get_state('backfill_page_token')
+        processed = 0
+        while True:
+            results = self._execute(service.users().messages().list(
+                userId='me',
+                pageToken=page_token,
+                maxResults=500,
+                includeSpamTrash=True,
+                fields="nextPageToken,messages(id)"
+            ), 'messages.list')
+            ids = [m['id'] for m in results.get('messages', [])]
+            self.upsert_messages(self._fetch_with_retry(service, ids))
+            processed += len(ids)
+
+            page_token = results.get('nextPageToken')
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    self._set_state(conn, 'backfill_page_token', page_token)
+                    if not page_token:
+                        self._set_state(conn, 'backfill_complete', '1')
+            logging.info(f"Metadata store: backfilled {processed} messages in this run.")
+            if not page_token:
+                break
+
+    def apply_history(self, service) -> int:
+        """
+        Applies users.history.list deltas since the stored historyId.
+        Returns the number of history records applied. If Gmail no longer has the
+        history (404), the store is reset so the next sync performs a full backfill.
+        """
+        start_history_id = self.get_history_id()
+        if start_history_id is None:
+            return 0
+
+        added, deleted, relabelled = set(), set(), {}
+        latest_history_id = start_history_id
+        record_count = 0
+        page_token = None
+        try:
+            while True:
+                results = self._execute(service.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=HISTORY_TYPES,
+                    pageToken=page_token,
+                    maxResults=500
+                ), 'history.list')
+                for record in results.get('history', []):
+                    record_count += 1
+                    for item in record.get('messagesAdded', []):
+                        added.add(item['message']['id'])
+                        deleted.discard(item['message']['id'])
+                    for item in record.get('messagesDeleted', []):
+                        deleted.add(item['message']['id'])
+                        added.discard(item['message']['id'])
+                        relabelled.pop(item['message']['id'], None)
+                    for key in ('labelsAdded', 'labelsRemoved'):
+                        for item in record.get(key, []):
+                            message = item['message']
+                            # The embedded message carries its full label set after the change.
+                            relabelled[message['id']] = message.get('labelIds', [])
+                latest_history_id = results.get('historyId', latest_history_id)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as error:
+            if error.resp.status == 404:
+                logging.warning("Metadata store: history expired, scheduling a full backfill.")
+                self.reset()
+                return 0
+            raise
+
+        self.delete_messages(list(deleted))
+        added_messages = self._fetch_with_retry(service, list(added))
+        self.upsert_messages(added_messages)
+        self.set_labels({k: v for k, v in relabelled.items() if k not in added and k not in deleted})
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                self._set_state(conn, 'history_id', latest_history_id)
+        if self.on_label_ids is not None and record_count:
+            label_ids = {label_id for labels in relabelled.values() for label_id in labels}
+            label_ids.update(label_id for row in added_messages for label_id in row['label_ids'])
+            self.on_label_ids(label_ids)
+        if record_count:
+            logging.info(
+                f"Metadata store: applied {record_count} history records "
+                f"(+{len(added)} / -{len(deleted)} / ~{len(relabelled)}), now at historyId {latest_history_id}."
+            )
+        return record_count
+
+    def sync(self, service):
+        """
+        Runs (or resumes) the backfill if needed, re-fetches messages whose earlier fetch
+        failed, then applies pending history.
+        """
+        if not self.is_ready():
+            self.backfill(service)
+        self.fetch_pending(service)
+        self.apply_history(service)
+
+
+class MetadataSyncWorker:
+    """Daemon thread that keeps a MetadataStore in sync on a fixed interval."""
+
+    def __init__(self, store: MetadataStore, service_factory, interval: int = 30):
+        self.store = store
+        self.service_factory = service_factory
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metadata-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self):
+        """Asks the worker to sync now instead of waiting for the next interval."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # httplib2 is not thread-safe, so the worker uses its own client.
+                service = self.service_factory()
+                if service is not None:
+                    self.store.sync(service)
+            except Exception as e:
+                logging.error(f"Metadata store sync failed: {e}", exc_info=True)
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,300 @@
+"""
+Process-wide metrics in the Prometheus text exposition format (served at /metrics).
+
+Counters and histograms are plain lock-protected dicts keyed by label values, so
+recording a sample costs a lock and a dict update. The helpers at the bottom wrap
+googleapiclient `.execute()` calls and batch requests, retry sleeps and cache lookups,
+and also charge them to the current request's usage (see request_usage.py).
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from googleapiclient.errors import HttpError
+
+from . import request_usage
+
+# Prometheus' default latency buckets (seconds).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 75, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+    def reset(self):
+        """Clears every sample (tests)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _header(self) -> str:
+        return f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n"
+
+    def render(self) -> str:
+        with self._lock:
+            samples = sorted(self._values.items())
+        lines = [f"{self.name}{_labels(self.labelnames, values)} {_number(value)}\n" for values, value in samples]
+        return self._header() + "".join(lines)
+
+
+class Histogram(Counter):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, *labelvalues, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    def count(self, *labelvalues) -> int:
+        with self._lock:
+            state = self._values.get(labelvalues)
+            return state[1] if state else 0
+
+    def render(self) -> str:
+        with self._lock:
+            samples = sorted((values, (list(state[0]), state[1], state[2])) for values, state in self._values.items())
+        lines = []
+        for values, (bucket_counts, count, total) in samples:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}\n")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {count}\n")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {count}\n")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}\n")
+        return self._header() + "".join(lines)
+
+
+# --- Series ---
+
+HTTP_REQUESTS = Counter(
+    "gmail_manager_http_requests_total", "HTTP requests served, by route and status.", ("method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "gmail_manager_http_request_duration_seconds", "Time to answer an HTTP request, by route.", ("method", "route")
+)
+GMAIL_CALLS = Counter(
+    "gmail_manager_gmail_calls_total",
+    "Gmail API calls (single requests and batch parts) by API method and HTTP status.", ("method", "status")
+)
+GMAIL_CALL_SECONDS = Histogram(
+    "gmail_manager_gmail_call_duration_seconds", "Latency of single (non-batch) Gmail API calls.", ("method",)
+)
+GMAIL_BATCH_SIZE = Histogram(
+    "gmail_manager_gmail_batch_size", "Calls per Gmail batch request.", ("method",), buckets=BATCH_SIZE_BUCKETS
+)
+GMAIL_BATCH_SECONDS = Histogram(
+    "gmail_manager_gmail_batch_duration_seconds", "Latency of Gmail batch requests.", ("method",)
+)
+GMAIL_BATCH_FAILED_CALLS = Counter(
+    "gmail_manager_gmail_batch_failed_calls_total", "Batch parts that returned an error, by status.", ("method", "status")
+)
+GMAIL_BATCH_ERRORS = Counter(
+    "gmail_manager_gmail_batch_errors_total", "Batch requests that failed as a whole, by status.", ("method", "status")
+)
+GMAIL_RETRIES = Counter(
+    "gmail_manager_gmail_retries_total", "Backoff sleeps before retrying Gmail calls, by component.", ("component",)
+)
+GMAIL_BACKOFF_SECONDS = Counter(
+    "gmail_manager_gmail_backoff_seconds_total", "Seconds slept in retry backoff, by component.", ("component",)
+)
+CACHE_REQUESTS = Counter(
+    "gmail_manager_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result")
+)
+
+
+# --- Instrumentation helpers ---
+
+def status_of(error) -> str:
+    """Status label of a call outcome: the HTTP status, or 'error' for transport failures."""
+    if error is None:
+        return "200"
+    if isinstance(error, HttpError):
+        return str(error.resp.status)
+    return "error"
+
+
+def observe_call(method: str, seconds: float, error=None):
+    GMAIL_CALLS.inc(method, status_of(error))
+    GMAIL_CALL_SECONDS.observe(method, value=seconds)
+    request_usage.record("gmail_seconds", seconds)
+
+
+def execute(request, method: str, charged: bool = False):
+    """
+    Runs `request.execute()`, recording its latency and outcome under `method`.
+    Callers that take quota first charge the request usage before that (`charged`),
+    so a call over the budget does not spend quota.
+    """
+    if not charged:
+        request_usage.charge()
+    started = time.perf_counter()
+    try:
+        response = request.execute()
+    except Exception as e:
+        observe_call(method, time.perf_counter() - started, e)
+        raise
+    observe_call(method, time.perf_counter() - started)
+    return response
+
+
+def observe_batch_part(method: str, error=None):
+    status = status_of(error)
+    GMAIL_CALLS.inc(method, status)
+    if error is not None:
+        GMAIL_BATCH_FAILED_CALLS.inc(method, status)
+
+
+def instrument_batch(method: str, callback):
+    """Wraps a BatchHttpRequest callback so the outcome of every part is counted."""
+    def instrumented(request_id, response, exception):
+        observe_batch_part(method, exception)
+        return callback(request_id, response, exception)
+    return instrumented
+
+
+def observe_batch(method: str, size: int, seconds: float, error=None):
+    GMAIL_BATCH_SIZE.observe(method, value=size)
+    GMAIL_BATCH_SECONDS.observe(method, value=seconds)
+    request_usage.record("gmail_seconds", seconds)
+    if error is not None:
+        GMAIL_BATCH_ERRORS.inc(method, status_of(error))
+
+
+def execute_batch(batch, method: str, size: int, charged: bool = False):
+    """Runs `batch.execute()`, recording its size, latency and whole-batch failures (see `execute`)."""
+    if not charged:
+        request_usage.charge(size, batch=True)
+    started = time.perf_counter()
+    try:
+        batch.execute()
+    except Exception as e:
+        observe_batch(method, size, time.perf_counter() - started, e)
+        raise
+    observe_batch(method, size, time.perf_counter() - started)
+
+
+def observe_backoff(component: str, seconds: float):
+    GMAIL_RETRIES.inc(component)
+    GMAIL_BACKOFF_SECONDS.inc(component, amount=seconds)
+    request_usage.record("retry_sleep_seconds", seconds)
+
+
+def observe_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def render_quota(quota_metrics: dict) -> str:
+    """Renders QuotaLimiter.metrics() as Prometheus series."""
+    by_method = quota_metrics["by_method"]
+    series = [
+        ("gmail_manager_quota_units_total", "counter", "Quota units taken, by API method.",
+         [(f'{{method="{_escape(m)}"}}', entry["units"]) for m, entry in by_method.items()]),
+        ("gmail_manager_quota_throttled_acquisitions_total", "counter",
+         "Acquisitions that had to wait for quota.", [("", quota_metrics["throttled_acquisitions"])]),
+        ("gmail_manager_quota_throttled_seconds_total", "counter",
+         "Seconds spent waiting for quota.", [("", quota_metrics["throttled_seconds_total"])]),
+        ("gmail_manager_quota_units_per_second", "gauge",
+         "Units taken per second, averaged over the last 10 seconds.", [("", quota_metrics["units_per_second_10s"])]),
+        ("gmail_manager_quota_utilization", "gauge",
+         "Share of the per-user quota rate used over the last 10 seconds.", [("", quota_metrics["utilization_10s"])]),
+        ("gmail_manager_quota_available_units", "gauge",
+         "Units available for immediate use.", [("", quota_metrics["available_units"])]),
+    ]
+    lines = []
+    for name, kind, documentation, samples in series:
+        lines.append(f"# HELP {name} {documentation}\n# TYPE {name} {kind}\n")
+        lines.extend(f"{name}{labels} {_number(value)}\n" for labels, value in samples)
+    return "".join(lines)
+
+
+def render_cache_ratios() -> str:
+    """Hit ratio per cache, derived from CACHE_REQUESTS."""
+    with CACHE_REQUESTS._lock:
+        values = dict(CACHE_REQUESTS._values)
+    name = "gmail_manager_cache_hit_ratio"
+    lines = [f"# HELP {name} Share of cache lookups that hit, since startup.\n# TYPE {name} gauge\n"]
+    for cache in sorted({cache for cache, _ in values}):
+        hits, misses = values.get((cache, "hit"), 0), values.get((cache, "miss"), 0)
+        lines.append(f'{name}{{cache="{_escape(cache)}"}} {_number(round(hits / (hits + misses), 4))}\n')
+    return "".join(lines)
+
+
+def render(quota_metrics: dict = None) -> str:
+    """The full /metrics payload."""
+    text = REGISTRY.render() + render_cache_ratios()
+    if quota_metrics is not None:
+        text += render_quota(quota_metrics)
+    return text
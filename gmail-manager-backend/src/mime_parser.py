@@ -0,0 +1,125 @@
+import base64
+import logging
+import re
+from email import policy
+from email.parser import BytesParser
+
+from .config import EMAIL_BODY_MAX_BYTES
+
+CHARSET_PATTERN = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+
+# Body types in order of preference.
+BODY_MIME_TYPES = ('text/html', 'text/plain')
+
+
+def _header(part: dict, name: str) -> str:
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+
+def _is_attachment(part: dict) -> bool:
+    return bool(part.get('filename')) or _header(part, 'Content-Disposition').lower().startswith('attachment')
+
+
+def select_body_part(payload: dict):
+    """
+    Walks a messages.get(format='full') payload once and returns the best body part:
+    the first text/html part, otherwise the first text/plain part, otherwise None.
+    Parts that are attachments are skipped.
+    """
+    best = {}
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if part.get('parts'):
+            # Reversed so parts are visited in document order.
+            stack.extend(reversed(part['parts']))
+            continue
+        mime_type = part.get('mimeType')
+        if mime_type in BODY_MIME_TYPES and mime_type not in best and not _is_attachment(part):
+            body = part.get('body', {})
+            if body.get('data') or body.get('attachmentId'):
+                best[mime_type] = part
+                if mime_type == BODY_MIME_TYPES[0]:
+                    break
+    return next((best[t] for t in BODY_MIME_TYPES if t in best), None)
+
+
+def part_charset(part: dict) -> str:
+    match = CHARSET_PATTERN.search(_header(part, 'Content-Type'))
+    return match.group(1) if match else 'utf-8'
+
+
+def decode_base64url(data: str, max_bytes: int = EMAIL_BODY_MAX_BYTES) -> tuple[bytes, bool]:
+    """
+    Decodes at most `max_bytes` of a base64url string without decoding the rest.
+    Returns (bytes, truncated).
+    """
+    data = data.rstrip('=')
+    encoded_limit = -(-max_bytes // 3) * 4  # Whole 4-char groups covering max_bytes
+    truncated = len(data) > encoded_limit
+    chunk = data[:encoded_limit] if truncated else data
+    decoded = base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4))
+    if len(decoded) > max_bytes:
+        decoded, truncated = decoded[:max_bytes], True
+    return decoded, truncated
+
+
+def bytes_to_text(raw: bytes, charset: str) -> str:
+    try:
+        return raw.decode(charset, errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+
+def render_body(text: str, mime_type: str) -> str:
+    """HTML bodies are returned as-is; plain text keeps its line breaks."""
+    if mime_type == 'text/plain':
+        return text.replace('\n', '<br>')
+    return text
+
+
+def parse_payload(payload: dict, fetch_attachment=None, max_bytes: int = EMAIL_BODY_MAX_BYTES):
+    """
+    Extracts the display body of a format='full' payload.
+    `fetch_attachment(attachment_id)` returns the base64url data of a body Gmail stored
+    as an attachment; without it such bodies are skipped.
+    Returns (body, truncated), or None if the payload has no usable body part.
+    """
+    part = select_body_part(payload)
+    if part is None:
+        return None
+    body = part.get('body', {})
+    data = body.get('data')
+    if not data and body.get('attachmentId'):
+        if fetch_attachment is None:
+            return None
+        data = fetch_attachment(body['attachmentId'])
+    if not data:
+        return None
+    raw, truncated = decode_base64url(data, max_bytes)
+    return render_body(bytes_to_text(raw, part_charset(part)), part['mimeType']), truncated
+
+
+def parse_raw(raw_data: str, max_bytes: int = EMAIL_BODY_MAX_BYTES):
+    """
+    Fallback for messages whose structured payload has no usable body: parses a
+    format='raw' message with the standard library email parser.
+    Returns (body, truncated), or None if the message has no text body.
+    """
+    raw = base64.urlsafe_b64decode(raw_data + '=' * (-len(raw_data) % 4))
+    message = BytesParser(policy=policy.default).parsebytes(raw)
+    part = message.get_body(preferencelist=('html', 'plain'))
+    if part is None:
+        return None
+    try:
+        text = part.get_content()
+    except (LookupError, UnicodeDecodeError) as e:
+        logging.warning(f"Could not decode raw message body: {e}")
+        payload = part.get_payload(decode=True) or b''
+        text = payload.decode('utf-8', errors='replace')
+    encoded = text.encode('utf-8')
+    truncated = len(encoded) > max_bytes
+    if truncated:
+        text = encoded[:max_bytes].decode('utf-8', errors='ignore')
+    return render_body(text, part.get_content_type()), truncated
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from . import metrics
+from .quota import TokenBucket, units_for
+
+
+class DetailPrefetcher:
+    """
+    Warms the email detail cache for messages the user is likely to open next.
+
+    IDs are queued with `enqueue` (typically the page list_emails just returned) and a
+    single background thread fetches their full content through batch requests. The
+    prefetcher runs at low priority:
+    - it only takes quota units while `reserve` units stay available in the shared
+      bucket, so foreground requests are never delayed by it;
+    - a new `enqueue` replaces whatever was still queued (the user moved to another
+      page), and `cancel` drops the queue altogether.
+
+    `to_content(msg)` turns a format='full' message into cacheable details, or returns
+    None for a message it cannot handle without further Gmail calls; such messages are
+    not cached and left to the foreground fetch, whose calls are not held to `reserve`.
+    `get_email_details` can `wait_for` an ID that is being prefetched right now
+    instead of fetching it a second time.
+    """
+
+    def __init__(self, service_factory, bucket: TokenBucket, cache, to_content,
+                 batch_size: int = 10, reserve: float = 0, poll_interval: float = 0.05):
+        self.service_factory = service_factory
+        self.bucket = bucket
+        self.cache = cache
+        self.to_content = to_content
+        self.batch_size = batch_size
+        self.reserve = reserve
+        self.poll_interval = poll_interval
+        self._queue = deque()
+        self._inflight = {}  # id -> Event set once the batch carrying it completes
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def enqueue(self, ids: list):
+        """Replaces the queue with the given IDs and wakes the worker. Cached IDs are skipped when dequeued."""
+        with self._cond:
+            self._generation += 1
+            self._queue = deque(i for i in dict.fromkeys(ids) if i not in self._inflight)
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="detail-prefetch", daemon=True)
+                self._thread.start()
+
+    def cancel(self) -> int:
+        """Drops every queued ID. A batch already in flight still completes. Returns the number dropped."""
+        with self._cond:
+            dropped = len(self._queue)
+            self._generation += 1
+            self._queue.clear()
+        if dropped:
+            logging.info(f"Prefetch cancelled, {dropped} queued messages dropped.")
+        return dropped
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            self._cond.notify()
+
+    def wait_for(self, email_id: str, timeout: float = 5.0) -> bool:
+        """Waits for an in-flight prefetch of `email_id`. Returns False if it is not being fetched."""
+        event = self._inflight.get(email_id)
+        if event is None:
+            return False
+        return event.wait(timeout)
+
+    def is_fetching(self, email_id: str) -> bool:
+        return email_id in self._inflight
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def _next_chunk(self):
+        """Blocks until IDs are queued; returns (generation, chunk) or None once stopped."""
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            candidates = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            generation = self._generation
+        # Checked outside the lock: the cache may stat the disk tier.
+        return generation, [email_id for email_id in candidates if not self.cache.contains(email_id)]
+
+    def _acquire_quota(self, units: float, generation: int) -> bool:
+        """Waits for spare quota; gives up if the queue was replaced or cancelled meanwhile."""
+        reserve = min(self.reserve, max(self.bucket.capacity - units, 0))
+        while not self.bucket.try_acquire(units, reserve=reserve, method='messages.get'):
+            if self._generation != generation or self._stopped:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def _run(self):
+        while True:
+            item = self._next_chunk()
+            if item is None:
+                return
+            generation, chunk = item
+            if not chunk or not self._acquire_quota(units_for('messages.get', len(chunk)), generation):
+                continue
+            try:
+                self._fetch(chunk)
+            except Exception as e:
+                logging.warning(f"Prefetch of {len(chunk)} messages failed: {e}")
+
+    def _fetch(self, chunk: list):
+        event = threading.Event()
+        for email_id in chunk:
+            self._inflight[email_id] = event
+
+        def batch_callback(request_id, response, exception):
+            if exception is not None:
+                logging.debug(f"Prefetch of message '{request_id}' failed: {exception}")
+                return
+            try:
+                content = self.to_content(response)
+            except Exception as e:
+                # Raising here would drop the rest of the batch's responses.
+                logging.warning(f"Prefetch could not parse message '{request_id}': {e}")
+                return
+            if content is None:
+                logging.debug(f"Prefetch skipped message '{request_id}': its body needs more calls.")
+                return
+            self.cache.put(request_id, content, response.get('labelIds', []))
+
+        try:
+            service = self.service_factory()
+            batch = service.new_batch_http_request(callback=metrics.instrument_batch('messages.get', batch_callback))
+            for email_id in chunk:
+                batch.add(service.users().messages().get(userId='me', id=email_id, format='full'), request_id=email_id)
+            metrics.execute_batch(batch, 'messages.get', len(chunk))
+            logging.debug(f"Prefetched {len(chunk)} messages.")
+        finally:
+            for email_id in chunk:
+                self._inflight.pop(email_id, None)
+            event.set()
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+from . import request_usage
+
+# Gmail API quota units per method.
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.modify': 5,
+    'messages.trash': 5,
+    'messages.untrash': 5,
+    'messages.delete': 10,
+    'messages.batchModify': 50,
+    'messages.batchDelete': 50,
+    'messages.attachments.get': 5,
+    'history.list': 2,
+    'labels.list': 1,
+    'labels.get': 1,
+    'getProfile': 1,
+    'settings.filters.list': 1,
+    'settings.filters.get': 1,
+    'settings.filters.create': 5,
+    'settings.filters.delete': 5,
+}
+
+# Per-user ceiling enforced by Gmail (moving average).
+USER_UNITS_PER_SECOND = 250
+
+
+def units_for(method: str, count: int = 1) -> int:
+    """Quota units consumed by `count` calls to `method` (unknown methods cost 5, like most calls)."""
+    return QUOTA_UNITS.get(method, 5) * count
+
+
+def method_for_request(request) -> str:
+    """
+    The QUOTA_UNITS key of a googleapiclient HttpRequest, from its discovery method ID
+    ('gmail.users.messages.list' -> 'messages.list').
+    """
+    method_id = getattr(request, 'methodId', None)
+    if not isinstance(method_id, str):
+        return 'unknown'
+    return method_id.removeprefix('gmail.').removeprefix('users.') or 'unknown'
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket measured in Gmail quota units.
+    Refills at `rate` units per second up to `capacity`; `acquire` blocks until
+    enough units are available.
+    """
+
+    def __init__(self, rate: float = USER_UNITS_PER_SECOND, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reconfigure(self, rate: float, capacity: float = None):
+        """Changes the rate and capacity, starting again from a full bucket."""
+        with self._lock:
+            self.rate = rate
+            self.capacity = capacity if capacity is not None else rate
+            self._tokens = self.capacity
+            self._updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def _record(self, method, units: float, waited: float):
+        """Hook called after every successful acquisition (see QuotaLimiter)."""
+
+    def try_acquire(self, units: float, reserve: float = 0, method: str = None) -> bool:
+        """
+        Takes `units` if they are available right now. With `reserve`, only takes them if
+        at least `reserve` units are left afterwards (used by low-priority background work).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens - units < reserve:
+                return False
+            self._tokens -= units
+        self._record(method, units, 0.0)
+        return True
+
+    def _take_or_delay(self, units: float, reserve: float = 0) -> float:
+        """Takes `units` and returns 0, or returns how long to wait before trying again."""
+        with self._lock:
+            self._refill(time.monotonic())
+            needed = min(units, self.capacity)
+            # Capped so that a full bucket always satisfies the request.
+            reserve = min(reserve, self.capacity - needed)
+            if self._tokens - reserve >= needed:
+                self._tokens -= units
+                return 0.0
+            return (needed + reserve - self._tokens) / self.rate
+
+    def acquire(self, units: float, method: str = None, reserve: float = 0) -> float:
+        """
+        Blocks until `units` are available and takes them. Requests larger than the
+        capacity are allowed and simply wait for a full bucket (going into debt).
+        `method` names the API method the units are for (accounting only).
+        With `reserve`, waits until `reserve` units are left afterwards, so low-priority
+        background work only spends quota foreground requests are not using.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            delay = self._take_or_delay(units, reserve)
+            if not delay:
+                self._record(method, units, waited)
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self, units: float, method: str = None) -> float:
+        """Like `acquire`, but waits with asyncio.sleep so the event loop keeps running."""
+        waited = 0.0
+        while True:
+            delay = self._take_or_delay(units)
+            if not delay:
+                self._record(method, units, waited)
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class QuotaLimiter(TokenBucket):
+    """
+    The process-wide Gmail quota limiter: a TokenBucket that also accounts for what
+    it hands out. Every Gmail call path takes its units here, named by API method, so
+    the limiter can report per-method calls/units, time spent throttled and recent
+    utilization of the per-user budget (see `metrics`).
+    """
+
+    def __init__(self, rate: float = USER_UNITS_PER_SECOND, capacity: float = None, window: float = 60.0):
+        super().__init__(rate, capacity)
+        self.window = window
+        self._stats_lock = threading.Lock()
+        self._by_method = {}  # method -> {"calls": n, "units": n}
+        self._recent = deque()  # (monotonic time, units) within the last `window` seconds
+        self._units_total = 0.0
+        self._throttled = 0
+        self._wait_seconds = 0.0
+
+    def _record(self, method, units: float, waited: float):
+        now = time.monotonic()
+        method = method or 'unknown'
+        with self._stats_lock:
+            entry = self._by_method.setdefault(method, {"calls": 0, "units": 0})
+            entry["calls"] += max(1, round(units / QUOTA_UNITS.get(method, 5)))
+            entry["units"] += units
+            self._units_total += units
+            if waited:
+                self._throttled += 1
+                self._wait_seconds += waited
+            self._recent.append((now, units))
+            self._trim(now)
+        request_usage.record("quota_wait_seconds", waited)
+
+    def _trim(self, now: float):
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def units_per_second(self, seconds: float = 10.0) -> float:
+        """Average units taken per second over the last `seconds` (at most `window`)."""
+        seconds = min(seconds, self.window)
+        now = time.monotonic()
+        with self._stats_lock:
+            self._trim(now)
+            used = sum(units for at, units in self._recent if at >= now - seconds)
+        return used / seconds
+
+    def metrics(self) -> dict:
+        """Current state and counters of the limiter."""
+        rate_10s = self.units_per_second(10)
+        with self._stats_lock:
+            by_method = {method: dict(entry) for method, entry in sorted(self._by_method.items())}
+            totals = (self._units_total, self._throttled, self._wait_seconds)
+        return {
+            "rate_units_per_second": self.rate,
+            "burst_capacity": self.capacity,
+            "available_units": round(self.available(), 1),
+            "units_per_second_1s": round(self.units_per_second(1), 1),
+            "units_per_second_10s": round(rate_10s, 1),
+            "units_per_second_60s": round(self.units_per_second(60), 1),
+            "utilization_10s": round(rate_10s / self.rate, 3),
+            "units_total": totals[0],
+            "throttled_acquisitions": totals[1],
+            "throttled_seconds_total": round(totals[2], 3),
+            "by_method": by_method,
+        }
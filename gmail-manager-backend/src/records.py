@@ -0,0 +1,67 @@
+from .subjects import NO_SUBJECT
+
+# Header name (lower-case) -> MessageRecord attribute.
+RECORD_HEADERS = {'subject': 'subject', 'from': 'sender', 'date': 'date'}
+
+
+class MessageRecord:
+    """
+    Compact in-memory form of one message's metadata.
+
+    Used instead of per-message dicts wherever many messages are held or streamed
+    (list hydration, subject aggregation). __slots__ removes the per-instance dict,
+    and labels are kept as a tuple. Convert with `to_email()` only at the response
+    boundary.
+    """
+
+    __slots__ = ('id', 'thread_id', 'snippet', 'label_ids', 'internal_date', 'size_estimate',
+                 'subject', 'sender', 'date')
+
+    def __init__(self, id: str, thread_id: str = None, snippet: str = '', label_ids: tuple = (),
+                 internal_date: int = 0, size_estimate: int = 0, subject: str = None,
+                 sender: str = None, date: str = None):
+        self.id = id
+        self.thread_id = thread_id
+        self.snippet = snippet
+        self.label_ids = label_ids
+        self.internal_date = internal_date
+        self.size_estimate = size_estimate
+        self.subject = subject
+        self.sender = sender
+        self.date = date
+
+    @classmethod
+    def from_message(cls, msg: dict) -> 'MessageRecord':
+        """Builds a record from a messages.get(format='metadata') response, reading headers in one pass."""
+        record = cls(
+            msg['id'],
+            msg.get('threadId'),
+            msg.get('snippet', ''),
+            tuple(msg.get('labelIds', ())),
+            int(msg.get('internalDate', 0) or 0),
+            msg.get('sizeEstimate', 0),
+        )
+        for header in msg.get('payload', {}).get('headers', ()):
+            attribute = RECORD_HEADERS.get(header['name'].lower())
+            if attribute is not None and getattr(record, attribute) is None:
+                setattr(record, attribute, header['value'])
+        return record
+
+    @property
+    def is_unread(self) -> bool:
+        return 'UNREAD' in self.label_ids
+
+    def to_email(self) -> dict:
+        """The email list entry served by the API (see schemas.Email)."""
+        return {
+            "id": self.id,
+            "thread_id": self.thread_id,
+            "snippet": self.snippet,
+            "subject": self.subject or NO_SUBJECT,
+            "sender": self.sender or 'Unknown Sender',
+            "date": self.date or '',
+            "is_unread": self.is_unread
+        }
+
+    def __repr__(self):
+        return f"MessageRecord(id={self.id!r}, subject={self.subject!r})"
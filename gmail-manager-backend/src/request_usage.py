@@ -0,0 +1,138 @@
+"""
+Per-request accounting of the Gmail work an API request causes.
+
+The HTTP middleware in main.py starts a RequestUsage for every request; the Gmail
+call paths (metrics.execute / execute_batch, the async transport, the quota limiter
+and the httplib2 clients) add to the one in the current context. It counts single
+calls, batch requests and their sub-requests, response bytes, and the time spent in
+Gmail calls, retry backoff and quota waits, and is reported back as `Server-Timing`
+and `X-Gmail-*` response headers.
+
+The context is a contextvars.ContextVar holding a mutable object, so threads started
+through anyio (run_blocking) or with contextvars.copy_context() add to the same
+usage. Background work (exact counts, prefetching, jobs) runs outside any request
+and is not accounted here.
+
+A usage can carry a budget of Gmail calls. `charge` is called before every call
+(batches charge all their sub-requests at once) and raises GmailCallBudgetExceeded
+once the budget would be exceeded, so a runaway fan-out stops at the budget instead
+of running to completion.
+"""
+import contextvars
+import threading
+import time
+
+
+class GmailCallBudgetExceeded(Exception):
+    """Raised before a Gmail call that would take a request past its call budget."""
+
+    def __init__(self, budget: int, calls: int):
+        super().__init__(f"Gmail call budget of {budget} calls exceeded ({calls} requested)")
+        self.budget = budget
+        self.calls = calls
+
+
+class RequestUsage:
+    """Gmail usage of one API request. Safe to update from several threads."""
+
+    def __init__(self, budget: int = None):
+        self.budget = budget
+        self.calls = 0  # Single calls plus batch sub-requests
+        self.batch_requests = 0
+        self.batch_calls = 0
+        self.bytes_received = 0
+        self.gmail_seconds = 0.0
+        self.retry_sleep_seconds = 0.0
+        self.quota_wait_seconds = 0.0
+        self.exceeded = False
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def charge(self, calls: int = 1, batch: bool = False):
+        """Counts `calls` about to be made; raises GmailCallBudgetExceeded past the budget."""
+        with self._lock:
+            if self.budget is not None and self.calls + calls > self.budget:
+                self.exceeded = True
+                raise GmailCallBudgetExceeded(self.budget, self.calls + calls)
+            self.calls += calls
+            if batch:
+                self.batch_requests += 1
+                self.batch_calls += calls
+
+    def add(self, field: str, amount):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "batch_requests": self.batch_requests,
+                "batch_calls": self.batch_calls,
+                "bytes_received": self.bytes_received,
+                "gmail_seconds": self.gmail_seconds,
+                "retry_sleep_seconds": self.retry_sleep_seconds,
+                "quota_wait_seconds": self.quota_wait_seconds,
+                "budget": self.budget,
+                "exceeded": self.exceeded,
+            }
+
+    def headers(self) -> dict:
+        """Response headers describing this usage (Server-Timing durations are in ms)."""
+        usage = self.snapshot()
+        total_ms = (time.perf_counter() - self.started) * 1000
+        desc = f"{usage['calls']} calls, {usage['batch_requests']} batches"
+        headers = {
+            "Server-Timing": ", ".join([
+                f"total;dur={total_ms:.1f}",
+                f'gmail;dur={usage["gmail_seconds"] * 1000:.1f};desc="{desc}"',
+                f"retry;dur={usage['retry_sleep_seconds'] * 1000:.1f}",
+                f"quota;dur={usage['quota_wait_seconds'] * 1000:.1f}",
+            ]),
+            "X-Gmail-Calls": str(usage["calls"]),
+            "X-Gmail-Batch-Calls": str(usage["batch_calls"]),
+            "X-Gmail-Bytes": str(usage["bytes_received"]),
+        }
+        if usage["budget"] is not None:
+            headers["X-Gmail-Call-Budget"] = str(usage["budget"])
+        if usage["exceeded"]:
+            headers["X-Gmail-Budget-Exceeded"] = "true"
+        return headers
+
+
+_current = contextvars.ContextVar("gmail_request_usage", default=None)
+
+
+def start(budget: int = None) -> RequestUsage:
+    """Starts accounting for the current context (one API request)."""
+    usage = RequestUsage(budget)
+    _current.set(usage)
+    return usage
+
+
+def current():
+    """The RequestUsage of the current context, or None outside a request."""
+    return _current.get()
+
+
+def charge(calls: int = 1, batch: bool = False):
+    usage = _current.get()
+    if usage is not None:
+        usage.charge(calls, batch)
+
+
+def record(field: str, amount):
+    """Adds `amount` to one of the RequestUsage counters, if a request is being accounted."""
+    usage = _current.get()
+    if usage is not None and amount:
+        usage.add(field, amount)
+
+
+def parse_budgets(spec: str) -> dict:
+    """Parses "path=calls,path=calls" (GMAIL_CALL_BUDGETS) into {path: calls}."""
+    budgets = {}
+    for entry in (spec or "").split(","):
+        path, sep, calls = entry.strip().rpartition("=")
+        if sep and path:
+            budgets[path.strip()] = int(calls)
+    return budgets
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import metrics
+
+
+class ResultCache:
+    """
+    Stale-while-revalidate cache for expensive results (the dashboard endpoints).
+
+    A result younger than `ttl` seconds is served as is. An older one is still served
+    immediately, flagged stale, while a background thread recomputes it; after
+    `max_age` seconds it is dropped and the next caller computes it again. `mark_stale`
+    flags every entry after the mailbox was modified, so the next read refreshes it.
+
+    Work is single-flight per key: concurrent callers of a missing key wait for one
+    computation, and a stale key is refreshed by at most one background thread.
+    Background refreshes run outside any API request, so they are not part of a
+    request's Gmail usage or call budget.
+    """
+
+    def __init__(self, ttl: float, max_age: float, max_entries: int = 64, max_workers: int = 2,
+                 name: str = "result", clock=time.time):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.name = name
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> [value, computed_at, marked_stale]
+        self._in_flight = {}  # key -> Future of (value, computed_at, stale)
+        self._generation = 0  # Bumped by mark_stale
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-refresh")
+
+    def _compute(self, key, compute):
+        with self._lock:
+            generation = self._generation
+        value = compute()
+        computed_at = self.clock()
+        with self._lock:
+            # A modification while computing may not be reflected in the value.
+            stale = generation != self._generation
+            self._entries[key] = [value, computed_at, stale]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value, computed_at, stale
+
+    def _refresh(self, key, compute):
+        """Starts (at most one) background recomputation of `key`."""
+        with self._lock:
+            if key in self._in_flight:
+                return
+            future = self._executor.submit(self._compute, key, compute)
+            self._in_flight[key] = future
+
+        def _done(f):
+            with self._lock:
+                self._in_flight.pop(key, None)
+            if f.exception():
+                logging.error(f"Background refresh of {self.name} {key} failed: {f.exception()}")
+
+        future.add_done_callback(_done)
+
+    def lookup(self, key, compute):
+        """
+        Returns (value, computed_at, stale) for a cached `key` without blocking, or None.
+        Serving a stale entry starts its background refresh with `compute`.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] > self.max_age:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value, computed_at, marked_stale = entry
+        metrics.observe_cache(self.name, hit=entry is not None)
+        if entry is None:
+            return None
+        stale = marked_stale or now - computed_at > self.ttl
+        if stale:
+            self._refresh(key, compute)
+        return value, computed_at, stale
+
+    def get(self, key, compute):
+        """
+        Returns (value, computed_at, stale), computing the value in the calling thread
+        when nothing is cached (or waiting for the computation already running).
+        """
+        cached = self.lookup(key, compute)
+        if cached is not None:
+            return cached
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = self._compute(key, compute)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def mark_stale(self):
+        """Flags every entry (and every computation in progress) as stale."""
+        with self._lock:
+            self._generation += 1
+            for entry in self._entries.values():
+                entry[2] = True
@@ -13,12 +13,21 @@ class Email(BaseModel):
 class EmailDetails(Email):
     to: str  # Combined string of all recipients
     body: str # This will be the parsed HTML or plain text body
+    body_truncated: bool = False # True if the body was cut at EMAIL_BODY_MAX_BYTES
 
 class EmailListResponse(BaseModel):
     emails: List[Email]
     total_estimate: int
+    total_is_exact: bool = True
+    count_fingerprint: Optional[str] = None # Poll /emails/count with this while total_is_exact is False
     next_page_token: Optional[str] = None
 
+class EmailCountResponse(BaseModel):
+    fingerprint: str
+    count: Optional[int] = None
+    exact: bool
+    status: str # 'pending' or 'done'
+
 class EmailIdListResponse(BaseModel):
     ids: List[str]
 
@@ -40,22 +49,75 @@ class LabelListResponse(BaseModel):
 class BatchActionRequest(BaseModel):
     action: str = Field(..., description="archive, trash, assign_labels, mark_read, mark_unread")
     ids: Optional[List[str]] = None
-    select_all_matching: bool = False
-    query_params: Optional[Dict[str, Any]] = {}
+    select_all_matching: bool = False # If true, act on every email matching query_params instead of ids
+    query_params: Optional[Dict[str, Any]] = {} # Same keys as /emails: folder, inbox_filter, label, from_sender, ..., plus received_before (epoch seconds)
     add_label_names: Optional[List[str]] = []
     remove_label_names: Optional[List[str]] = []
 
+class BatchActionFailure(BaseModel):
+    id: str
+    error: str
+
+class BatchActionResponse(BaseModel):
+    action: str
+    total: int
+    succeeded: List[str] # Left empty for select_all_matching requests; see succeeded_count
+    succeeded_count: int = 0
+    failed: List[BatchActionFailure]
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str # queued, running, succeeded, failed, cancelled
+    params: Dict[str, Any] = {}
+    processed: int = 0
+    failed: int = 0
+    total: Optional[int] = None
+    throughput: Optional[float] = None # Items processed per second
+    eta_seconds: Optional[float] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[Any] = None
+
+class JobListResponse(BaseModel):
+    jobs: List[JobResponse]
+
 class SubjectCount(BaseModel):
     subject: str
     count: int
 
 class SubjectCountListResponse(BaseModel):
     subjects: List[SubjectCount]
+    computed_at: Optional[str] = None # When the (cached) result was computed, ISO 8601, UTC
+    stale: bool = False # True while an outdated cached result is being recomputed
+
+class SenderStat(BaseModel):
+    key: str # Sender address, or domain when grouped by domain
+    name: str = "" # Display name of the sender's most recent message (empty for domains)
+    domain: str
+    count: int
+    unread_count: int
+    unread_ratio: float
+    newest_date: Optional[str] = None # ISO 8601, UTC
+    oldest_date: Optional[str] = None
+    estimated_bytes: int
+
+class SenderStatsResponse(BaseModel):
+    group_by: str
+    source: str # 'store' (local aggregates) or 'gmail' (streamed from the API)
+    senders: List[SenderStat]
+    computed_at: Optional[str] = None # When the (cached) result was computed, ISO 8601, UTC
+    stale: bool = False # True while an outdated cached result is being recomputed
 
 class FullDashboardResponse(BaseModel):
     total_emails: int
     unread_emails: int
+    counts_exact: bool = True # False when the counts are estimates and an exact count is still running
     subjects: List[SubjectCount]
+    computed_at: Optional[str] = None # When the (cached) result was computed, ISO 8601, UTC
+    stale: bool = False # True while an outdated cached result is being recomputed
 
 class FilterCriteria(BaseModel):
     from_sender: Optional[str] = Field(None, alias="from")
@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from email.utils import parseaddr
+
+# Aggregate key covering every visible message (no label filter).
+ALL_MAIL_KEY = '*'
+
+# Inbox tabs are INBOX + CATEGORY_*; such pairs get their own aggregate key.
+INBOX_TAB_SEPARATOR = '&'
+
+# ORDER BY clauses (over key/count/unread/bytes/newest columns) for each supported sort.
+SORT_ORDERS = {
+    "count": "count DESC",
+    "unread": "unread DESC, count DESC",
+    "unread_ratio": "CAST(unread AS REAL) / count DESC, count DESC",
+    "bytes": "bytes DESC",
+    "newest": "newest DESC",
+}
+
+
+def parse_sender(from_header: str) -> tuple[str, str, str]:
+    """
+    Splits a From header into (address, display name, domain).
+    The address is lowercased so "Shop <News@Shop.com>" and "news@shop.com" aggregate together.
+    """
+    name, address = parseaddr(from_header or '')
+    address = (address or from_header or '').strip().lower()
+    domain = address.rsplit('@', 1)[1] if '@' in address else ''
+    return address, name.strip(), domain
+
+
+def label_key(label_ids: list):
+    """
+    Returns the aggregate key answering a query for `label_ids`, or None when the
+    combination has no pre-computed aggregate (the caller then groups on the fly).
+    """
+    labels = sorted(set(label_ids or []))
+    if not labels:
+        return ALL_MAIL_KEY
+    if len(labels) == 1:
+        return labels[0]
+    if len(labels) == 2 and 'INBOX' in labels and any(l.startswith('CATEGORY_') for l in labels):
+        return INBOX_TAB_SEPARATOR.join(labels)
+    return None
+
+
+def key_labels(key: str) -> list:
+    """Inverse of label_key: the label IDs a stored aggregate key stands for."""
+    if key == ALL_MAIL_KEY:
+        return []
+    return key.split(INBOX_TAB_SEPARATOR)
+
+
+def aggregate_keys(label_ids, hidden_labels) -> list:
+    """
+    Aggregate keys a message with `label_ids` counts towards, mirroring messages.list
+    semantics: messages in one of `hidden_labels` (SPAM/TRASH) only show up under those labels.
+    """
+    labels = set(label_ids or [])
+    hidden = labels.intersection(hidden_labels)
+    if hidden:
+        # A message in both SPAM and TRASH is listed under neither on its own.
+        return sorted(hidden) if len(hidden) == 1 else []
+    keys = [ALL_MAIL_KEY, *sorted(labels)]
+    if 'INBOX' in labels:
+        keys.extend(label_key(['INBOX', l]) for l in sorted(labels) if l.startswith('CATEGORY_'))
+    return keys
+
+
+def _iso_date(internal_date):
+    if not internal_date:
+        return None
+    return datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc).isoformat()
+
+
+def to_stat(row) -> dict:
+    """Turns an aggregate row (address or domain grouping) into the API shape."""
+    count = row['count']
+    return {
+        "key": row['key'],
+        "name": row['name'] or '',
+        "domain": row['domain'],
+        "count": count,
+        "unread_count": row['unread'],
+        "unread_ratio": round(row['unread'] / count, 4) if count else 0.0,
+        "newest_date": _iso_date(row['newest']),
+        "oldest_date": _iso_date(row['oldest']),
+        "estimated_bytes": row['bytes'],
+    }
+
+
+class SenderAggregator:
+    """
+    In-memory counterpart of the sender_stats table, used when the metadata store is
+    not ready and messages are streamed from Gmail instead. Groups by address or domain.
+    """
+
+    def __init__(self, group_by: str = "address"):
+        self.group_by = group_by
+        self.processed = 0
+        self._rows = {}
+
+    def add(self, sender: str, label_ids, internal_date: int, size: int):
+        address, name, domain = parse_sender(sender)
+        key = domain if self.group_by == "domain" else address
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = {
+                "key": key, "name": '' if self.group_by == "domain" else name, "domain": domain,
+                "count": 0, "unread": 0, "bytes": 0, "newest": internal_date, "oldest": internal_date,
+            }
+        row['count'] += 1
+        row['unread'] += 'UNREAD' in label_ids
+        row['bytes'] += size
+        row['newest'] = max(row['newest'], internal_date)
+        row['oldest'] = min(row['oldest'], internal_date)
+        self.processed += 1
+
+    def top(self, sort: str = "count", n: int = None) -> list:
+        sort_keys = {
+            "count": lambda r: (r['count'],),
+            "unread": lambda r: (r['unread'], r['count']),
+            "unread_ratio": lambda r: (r['unread'] / r['count'], r['count']),
+            "bytes": lambda r: (r['bytes'],),
+            "newest": lambda r: (r['newest'],),
+        }
+        rows = sorted(self._rows.values(), key=sort_keys[sort], reverse=True)
+        return [to_stat(row) for row in (rows[:n] if n else rows)]
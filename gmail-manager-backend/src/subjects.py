@@ -0,0 +1,108 @@
+import heapq
+import re
+from collections import Counter
+
+NO_SUBJECT = '(No Subject)'
+
+# Reply/forward prefixes in common languages, possibly repeated or numbered ("Re[2]:").
+REPLY_PREFIX = re.compile(r'^\s*((re|fwd?|aw|wg|sv|vs|tr|rif|antw)(\s*\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+# Ticket / reference IDs such as "#12345", "[JIRA-123]", "ABC-1234", "Case 00123".
+TICKET_ID = re.compile(r'\[?\b[A-Z][A-Z0-9]+-\d+\b\]?|#\s?\d+|\b(case|ticket|order|invoice|ref)\s*(no\.?|number)?\s*[:#]?\s*\d[\w-]*', re.IGNORECASE)
+DIGITS = re.compile(r'\d+([.,:/-]\d+)*')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_subject(subject: str) -> str:
+    """
+    Collapses near-duplicate subjects: strips Re:/Fwd: prefixes and replaces ticket
+    IDs and numbers with '#'. "RE: Order #1234 shipped (2 items)" -> "Order # shipped (# items)".
+    """
+    if not subject:
+        return NO_SUBJECT
+    subject = REPLY_PREFIX.sub('', subject)
+    subject = TICKET_ID.sub(lambda m: f"{m.group(1)} #" if m.group(1) else "#", subject)
+    subject = DIGITS.sub('#', subject)
+    subject = WHITESPACE.sub(' ', subject).strip()
+    return subject or NO_SUBJECT
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-K counter (Metwally et al.): tracks at most `capacity` keys.
+    When a new key arrives while full, it replaces the key with the smallest count
+    and inherits that count (+1). Reported counts are upper bounds that overestimate
+    by at most `error(key)`; any key whose true count exceeds N / capacity is kept.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []  # (count, key), possibly stale; fixed up lazily in _pop_min
+
+    def add(self, key, weight: int = 1):
+        if key in self.counts:
+            self.counts[key] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (weight, key))
+            return
+        floor = self._pop_min()
+        self.counts[key] = floor + weight
+        self.errors[key] = floor
+        heapq.heappush(self._heap, (floor + weight, key))
+
+    def _pop_min(self) -> int:
+        """Evicts the key with the smallest count and returns that count."""
+        while True:
+            count, key = heapq.heappop(self._heap)
+            current = self.counts.get(key)
+            if current is None:
+                continue
+            if current != count:
+                heapq.heappush(self._heap, (current, key))
+                continue
+            del self.counts[key]
+            del self.errors[key]
+            return count
+
+    def error(self, key) -> int:
+        return self.errors.get(key, 0)
+
+    def most_common(self, n: int = None) -> list:
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return items[:n] if n else items
+
+
+class SubjectAggregator:
+    """
+    Streams subjects into subject counts.
+    - exact=True counts every distinct (optionally normalized) subject.
+    - exact=False keeps a Space-Saving sketch of `capacity` entries, so memory stays
+      bounded however many distinct subjects the label has.
+    """
+
+    def __init__(self, exact: bool = True, normalize: bool = False, capacity: int = 1000):
+        self.exact = exact
+        self.normalize = normalize
+        self.processed = 0
+        self._counter = Counter() if exact else SpaceSaving(capacity)
+
+    def add(self, subject: str, count: int = 1):
+        key = normalize_subject(subject) if self.normalize else (subject or NO_SUBJECT)
+        if self.exact:
+            self._counter[key] += count
+        else:
+            self._counter.add(key, count)
+        self.processed += count
+
+    def add_all(self, subjects):
+        for subject in subjects:
+            self.add(subject)
+        return self
+
+    def top(self, n: int = None) -> list:
+        """[{'subject': ..., 'count': ...}] sorted by count desc (counts are upper bounds when approximate)."""
+        return [{"subject": subject, "count": count} for subject, count in self._counter.most_common(n)]
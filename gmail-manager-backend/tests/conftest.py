@@ -2,11 +2,14 @@ import pytest
 from unittest.mock import MagicMock, patch
 from src.gmail_service import GmailService
 from src.main import app
+from src.result_cache import ResultCache
 from fastapi.testclient import TestClient
 
 @pytest.fixture
 def mock_gmail_service():
-    with patch('src.main.gmail_service') as mock:
+    # A fresh dashboard cache, so results of one test are not served to the next.
+    with patch('src.main.gmail_service') as mock, \
+            patch('src.main.dashboard_cache', ResultCache(ttl=60, max_age=3600, name="dashboard")):
         yield mock
 
 @pytest.fixture
@@ -23,7 +26,7 @@ def mock_google_service():
     Mocks the underlying googleapiclient service object.
     Used when testing GmailService directly.
     """
-    with patch('src.gmail_service.build') as mock_build:
+    with patch('src.client_pool.build') as mock_build:
         mock_service = MagicMock()
         mock_build.return_value = mock_service
         yield mock_service
@@ -1,5 +1,7 @@
 import pytest
-from unittest.mock import MagicMock
+import json
+from src.gmail_service import GmailService
+from unittest.mock import MagicMock, AsyncMock
 
 def test_list_filters_api(client, mock_gmail_service):
     # Setup mock
@@ -52,3 +54,196 @@ def test_delete_filter_api(client, mock_gmail_service):
     response = client.delete("/api/filters/123")
     assert response.status_code == 200
     mock_gmail_service.delete_filter.assert_called_with("123")
+
+def test_email_count_api(client, mock_gmail_service):
+    mock_gmail_service.get_count_status.return_value = {'fingerprint': 'abc', 'count': 42, 'exact': True, 'status': 'done'}
+
+    response = client.get("/emails/count?fingerprint=abc&wait=1")
+
+    assert response.status_code == 200
+    assert response.json()['count'] == 42
+    mock_gmail_service.get_count_status.assert_called_with('abc', wait=1.0)
+
+def test_email_count_api_unknown_fingerprint(client, mock_gmail_service):
+    mock_gmail_service.get_count_status.return_value = None
+
+    response = client.get("/emails/count?fingerprint=nope")
+
+    assert response.status_code == 404
+
+def test_batch_action_api_reports_per_id_results(client, mock_gmail_service):
+    mock_gmail_service.perform_batch_action.return_value = {
+        'action': 'archive', 'total': 2, 'succeeded': ['a'], 'failed': [{'id': 'b', 'error': 'Not Found'}]
+    }
+
+    response = client.post("/actions/batch", json={"action": "archive", "ids": ["a", "b"]})
+
+    assert response.status_code == 200
+    assert response.json()['failed'] == [{'id': 'b', 'error': 'Not Found'}]
+
+def test_batch_action_api_requires_ids(client, mock_gmail_service):
+    response = client.post("/actions/batch", json={"action": "archive"})
+    assert response.status_code == 400
+
+def test_batch_action_api_select_all_matching(client, mock_gmail_service):
+    mock_gmail_service.labels_map = {}
+    mock_gmail_service.perform_batch_action_matching.return_value = {
+        'action': 'archive', 'total': 3, 'succeeded': [], 'succeeded_count': 3, 'failed': []
+    }
+
+    response = client.post("/actions/batch", json={
+        "action": "archive",
+        "select_all_matching": True,
+        "query_params": {"folder": "INBOX", "inbox_filter": "Promotions", "from_sender": "shop@example.com"}
+    })
+
+    assert response.status_code == 200
+    assert response.json()['succeeded_count'] == 3
+    mock_gmail_service.perform_batch_action_matching.assert_called_with(
+        action='archive', label_ids=['INBOX', 'CATEGORY_PROMOTIONS'],
+        add_labels=[], remove_labels=[], progress=None, from_sender='shop@example.com'
+    )
+
+def test_batch_action_api_select_all_matching_received_before(client, mock_gmail_service):
+    mock_gmail_service.perform_batch_action_matching.return_value = {
+        'action': 'archive', 'total': 0, 'succeeded': [], 'succeeded_count': 0, 'failed': []
+    }
+
+    response = client.post("/actions/batch", json={
+        "action": "archive",
+        "select_all_matching": True,
+        "query_params": {"folder": "INBOX", "received_before": 1760000000}
+    })
+
+    assert response.status_code == 200
+    mock_gmail_service.perform_batch_action_matching.assert_called_with(
+        action='archive', label_ids=['INBOX'], add_labels=[], remove_labels=[], progress=None,
+        received_before=1760000000
+    )
+    assert GmailService._construct_query(None, {"subject": "x", "received_before": "1760000000"}) == \
+        "subject:(x) before:1760000000"
+
+def test_batch_action_api_rejects_unknown_label(client, mock_gmail_service):
+    mock_gmail_service.aresolve_label_id = AsyncMock(return_value=None)
+
+    response = client.post("/actions/batch", json={
+        "action": "trash",
+        "select_all_matching": True,
+        "query_params": {"label": "Typo", "subject": "invoice"}
+    })
+
+    assert response.status_code == 404
+    mock_gmail_service.perform_batch_action_matching.assert_not_called()
+    assert client.get("/emails?label=Typo").status_code == 404
+
+def test_email_ids_stream_api(client, mock_gmail_service):
+    mock_gmail_service.iter_email_ids.return_value = iter([['a', 'b'], ['c']])
+
+    response = client.get("/emails/ids?folder=INBOX&stream=true")
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"ids": ['a', 'b']}, {"ids": ['c']}, {"done": True, "count": 3}]
+    mock_gmail_service.get_email_ids.assert_not_called()
+
+def test_email_ids_stream_api_reports_late_errors(client, mock_gmail_service):
+    def pages():
+        yield ['a']
+        raise Exception("quota exhausted")
+    mock_gmail_service.iter_email_ids.return_value = pages()
+
+    response = client.get("/emails/ids?folder=INBOX&stream=true")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"ids": ['a']}, {"error": "quota exhausted", "count": 1}]
+
+def test_dashboard_senders_api(client, mock_gmail_service):
+    mock_gmail_service.get_sender_stats.return_value = {
+        "group_by": "domain", "source": "store",
+        "senders": [{
+            "key": "shop.com", "name": "", "domain": "shop.com", "count": 4, "unread_count": 3,
+            "unread_ratio": 0.75, "newest_date": None, "oldest_date": None, "estimated_bytes": 4000,
+        }],
+    }
+
+    response = client.get("/dashboard/senders?folder=INBOX&inbox_filter=Promotions&group_by=domain&sort=unread_ratio&top=10")
+
+    assert response.status_code == 200
+    assert response.json()['senders'][0]['unread_ratio'] == 0.75
+    mock_gmail_service.get_sender_stats.assert_called_with(
+        label_ids=['INBOX', 'CATEGORY_PROMOTIONS'], group_by='domain', sort='unread_ratio', top=10
+    )
+
+def test_dashboard_full_api_serves_cached_result(client, mock_gmail_service):
+    mock_gmail_service.get_full_dashboard_data.return_value = {
+        "total_emails": 10, "unread_emails": 2, "counts_exact": True, "subjects": []
+    }
+
+    first = client.get("/dashboard/full")
+    second = client.get("/dashboard/full")
+
+    assert first.status_code == 200 and second.json() == first.json()
+    assert first.json()['stale'] is False and first.json()['computed_at'].endswith("+00:00")
+    assert mock_gmail_service.get_full_dashboard_data.call_count == 1
+
+    mock_gmail_service.perform_batch_action.return_value = {
+        "action": "archive", "total": 1, "succeeded": ["1"], "succeeded_count": 1, "failed": []
+    }
+    client.post("/actions/batch", json={"action": "archive", "ids": ["1"]})
+    assert client.get("/dashboard/full").json()['stale'] is True
+
+def test_dashboard_full_api_does_not_cache_failures(client, mock_gmail_service):
+    mock_gmail_service.get_full_dashboard_data.side_effect = [
+        Exception("Gmail unavailable"),
+        {"total_emails": 10, "unread_emails": 2, "counts_exact": True, "subjects": []},
+    ]
+
+    assert client.get("/dashboard/full").status_code == 500
+    response = client.get("/dashboard/full")
+
+    assert response.status_code == 200 and response.json()['total_emails'] == 10
+    assert mock_gmail_service.get_full_dashboard_data.call_count == 2
+
+def test_quota_metrics_api(client, mock_gmail_service):
+    mock_gmail_service.quota.metrics.return_value = {"units_total": 42, "by_method": {}}
+
+    response = client.get("/quota")
+
+    assert response.status_code == 200
+    assert response.json()['units_total'] == 42
+
+def test_metrics_api_reports_route_latency(client, mock_gmail_service):
+    mock_gmail_service.quota.metrics.return_value = {
+        "by_method": {}, "throttled_acquisitions": 0, "throttled_seconds_total": 0.0,
+        "units_per_second_10s": 0.0, "utilization_10s": 0.0, "available_units": 250.0,
+    }
+    client.get("/quota")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'gmail_manager_http_request_duration_seconds_count{method="GET",route="/quota"}' in response.text
+    assert 'gmail_manager_quota_available_units 250.0' in response.text
+
+def test_list_emails_api_rejects_invalid_page_token(client, mock_gmail_service):
+    mock_gmail_service.alist_emails = AsyncMock(side_effect=ValueError("Invalid page token 'local:abc'"))
+
+    response = client.get("/emails?folder=INBOX&page_token=local:abc")
+
+    assert response.status_code == 400
+    assert response.json()['detail'] == "Invalid page token 'local:abc'"
+
+def test_email_details_api_uses_async_service(client, mock_gmail_service):
+    mock_gmail_service.aget_email_details = AsyncMock(return_value={
+        "id": "1", "thread_id": "t1", "snippet": "", "subject": "Hi", "sender": "a@b.c", "to": "",
+        "date": "", "body": "<p>Hi</p>", "is_unread": False,
+    })
+
+    response = client.get("/emails/1")
+
+    assert response.status_code == 200
+    assert response.json()['body'] == "<p>Hi</p>"
+    mock_gmail_service.aget_email_details.assert_awaited_once_with("1")
+    mock_gmail_service.get_email_details.assert_not_called()
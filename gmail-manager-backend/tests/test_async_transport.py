@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import json
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+import pytest
+from googleapiclient.errors import HttpError
+
+from src.async_transport import AsyncGmailTransport, build_batch_body, parse_batch_response
+from src.gmail_service import GmailService
+from src.quota import TokenBucket
+
+
+def batch_response(parts: list, boundary: str = "batch_resp") -> httpx.Response:
+    """Encodes [(status, payload dict)] the way Gmail answers a batch request."""
+    body = ""
+    for index, (status, payload) in enumerate(parts):
+        body += (
+            f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-item-{index}>\r\n\r\n"
+            f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+        )
+    body += f"--{boundary}--\r\n"
+    return httpx.Response(200, content=body.encode(), headers={"content-type": f"multipart/mixed; boundary={boundary}"})
+
+
+def batch_paths(request: httpx.Request) -> list:
+    """The inner request lines of a batch request."""
+    return [line.split()[1] for line in request.content.decode().splitlines() if line.startswith("GET ")]
+
+
+def make_transport(handler, **kwargs) -> AsyncGmailTransport:
+    creds = SimpleNamespace(valid=True, token="tok")
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    transport = AsyncGmailTransport(
+        lambda: creds, TokenBucket(rate=1e6), http_transport=httpx.MockTransport(handler), sleep=sleep, **kwargs
+    )
+    transport.sleeps = sleeps
+    return transport
+
+
+def test_batch_body_round_trips_through_the_parser():
+    body = build_batch_body([("messages/a", {"format": "metadata", "metadataHeaders": ["Subject", "From"]})], "b")
+    assert "GET /gmail/v1/users/me/messages/a?format=metadata&metadataHeaders=Subject&metadataHeaders=From" in body
+    response = batch_response([(200, {"id": "a"}), (404, {"error": "gone"})])
+    parsed = parse_batch_response(response.headers["content-type"], response.content)
+    assert parsed[0] == (200, b'{"id": "a"}') and parsed[1][0] == 404
+
+
+def test_request_sends_bearer_token_and_retries_server_errors():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503, json={"error": "busy"})
+        return httpx.Response(200, json={"messages": [{"id": "1"}]})
+
+    transport = make_transport(handler)
+    result = asyncio.run(transport.request('messages.list', 'GET', 'messages', {"labelIds": ["INBOX", "UNREAD"]}))
+
+    assert result == {"messages": [{"id": "1"}]}
+    assert len(calls) == 2 and len(transport.sleeps) == 1
+    assert calls[1].headers["authorization"] == "Bearer tok"
+    assert parse_qs(urlsplit(str(calls[1].url)).query)["labelIds"] == ["INBOX", "UNREAD"]
+
+
+def test_request_raises_http_error_for_client_errors():
+    transport = make_transport(lambda request: httpx.Response(404, json={"error": "not found"}))
+    with pytest.raises(HttpError) as excinfo:
+        asyncio.run(transport.request('messages.get', 'GET', 'messages/x'))
+    assert excinfo.value.resp.status == 404 and transport.sleeps == []
+
+
+def test_batch_retries_only_failed_parts_and_reports_errors():
+    requests = []
+
+    def handler(request):
+        paths = batch_paths(request)
+        requests.append(paths)
+        parts = []
+        for path in paths:
+            message_id = urlsplit(path).path.rsplit("/", 1)[1]
+            if message_id == "b" and len(requests) == 1:
+                parts.append((429, {"error": "rate"}))
+            elif message_id == "gone":
+                parts.append((404, {"error": "gone"}))
+            else:
+                parts.append((200, {"id": message_id}))
+        return batch_response(parts)
+
+    transport = make_transport(handler)
+    calls = [(i, f"messages/{i}", {"format": "minimal"}) for i in ("a", "b", "gone")]
+    results = asyncio.run(transport.batch('messages.get', calls))
+
+    assert results["a"] == {"id": "a"} and results["b"] == {"id": "b"}
+    assert isinstance(results["gone"], HttpError)
+    assert len(requests) == 2 and requests[1] == ["/gmail/v1/users/me/messages/b?format=minimal"]
+
+
+def test_batch_splits_into_chunks_of_100():
+    sizes = []
+
+    def handler(request):
+        paths = batch_paths(request)
+        sizes.append(len(paths))
+        return batch_response([(200, {"id": urlsplit(p).path.rsplit("/", 1)[1]}) for p in paths])
+
+    transport = make_transport(handler)
+    results = asyncio.run(transport.batch('messages.get', [(str(i), f"messages/{i}", None) for i in range(250)]))
+    assert sorted(sizes) == [50, 100, 100] and len(results) == 250
+
+
+def test_alist_emails_lists_and_hydrates_through_the_transport():
+    def handler(request):
+        if request.url.path == "/batch/gmail/v1":
+            return batch_response([
+                (200, {"id": "1", "threadId": "t1", "labelIds": ["INBOX", "UNREAD"], "snippet": "hi",
+                       "payload": {"headers": [{"name": "Subject", "value": "Hello"}, {"name": "From", "value": "Bob"}]}}),
+                (404, {"error": "gone"}),
+            ])
+        return httpx.Response(200, json={"messages": [{"id": "1"}, {"id": "2"}], "resultSizeEstimate": 2})
+
+    gmail = GmailService()
+    gmail.metadata_store = None
+    gmail.transport = make_transport(handler)
+    result = asyncio.run(gmail.alist_emails(['INBOX']))
+
+    assert [email['id'] for email in result['emails']] == ['1']
+    assert result['emails'][0]['subject'] == 'Hello' and result['emails'][0]['is_unread']
+    assert result['total_estimate'] == 2 and result['total_is_exact']
+
+
+def test_async_paths_keep_store_and_disk_cache_work_off_the_event_loop():
+    loop_threads, work_threads = set(), []
+
+    class Store:
+        def is_ready(self):
+            work_threads.append(threading.get_ident())
+            return True
+
+        def count(self, label_ids):
+            work_threads.append(threading.get_ident())
+            return 1
+
+        def list_messages(self, label_ids, offset, limit):
+            work_threads.append(threading.get_ident())
+            return [{"id": "1"}]
+
+    gmail = GmailService()
+    gmail.metadata_store = Store()
+    gmail.detail_cache.get = lambda email_id: work_threads.append(threading.get_ident()) or None
+
+    async def run():
+        loop_threads.add(threading.get_ident())
+        await gmail.alist_emails(['INBOX'])
+        await gmail.aget_email_details("1")
+
+    gmail.transport = make_transport(lambda request: httpx.Response(500, json={}))
+    gmail.transport.max_attempts = 1
+    with pytest.raises(Exception):
+        asyncio.run(run())
+
+    assert len(work_threads) == 4 and not loop_threads & set(work_threads)
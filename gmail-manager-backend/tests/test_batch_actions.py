@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from src.gmail_service import GmailService
+
+
+@pytest.fixture
+def gmail():
+    with patch('src.gmail_service.GmailService._get_labels', return_value=({'WORK': 'Label_1'}, [])):
+        service = GmailService()
+    service.metadata_store = None
+    return service
+
+
+class FakeMailbox:
+    """Answers _list_id_page from an in-memory listing that batch actions can shrink."""
+
+    def __init__(self, ids, page_size=2):
+        self.ids = list(ids)
+        self.page_size = page_size
+        self.calls = []
+
+    def list_page(self, label_ids, query, page_token=None):
+        self.calls.append(page_token)
+        start = int(page_token or 0)
+        page = self.ids[start:start + self.page_size]
+        end = start + self.page_size
+        return page, (str(end) if end < len(self.ids) else None)
+
+
+def test_matching_archive_restarts_listing_as_messages_leave_inbox(gmail):
+    mailbox = FakeMailbox(['a', 'b', 'c', 'd', 'e'])
+
+    def run_bulk_modify(groups, progress=None, succeeded=None):
+        ids = groups[0][0]
+        mailbox.ids = [i for i in mailbox.ids if i not in ids]
+        return {"succeeded": ids, "failed": []}
+
+    with patch.object(gmail, '_list_id_page', side_effect=mailbox.list_page), \
+         patch.object(gmail.batch_scheduler, 'run_bulk_modify', side_effect=run_bulk_modify):
+        result = gmail.perform_batch_action_matching('archive', ['INBOX'])
+
+    assert result['succeeded_count'] == 5 and result['total'] == 5
+    assert mailbox.ids == []
+    # Every page is listed from the start because archived messages leave the listing.
+    assert set(mailbox.calls) == {None}
+
+
+def test_matching_label_action_follows_page_tokens(gmail):
+    mailbox = FakeMailbox(['a', 'b', 'c'])
+    bulk = MagicMock(side_effect=lambda groups, progress=None, succeeded=None: {"succeeded": groups[0][0], "failed": []})
+
+    with patch.object(gmail, '_list_id_page', side_effect=mailbox.list_page), \
+         patch.object(gmail.batch_scheduler, 'run_bulk_modify', bulk):
+        result = gmail.perform_batch_action_matching('mark_unread', ['Label_1'], from_sender='bob')
+
+    assert result['succeeded_count'] == 3
+    assert mailbox.calls == [None, '2']
+    assert bulk.call_args_list[0].args[0] == [(['a', 'b'], ['UNREAD'], [])]
+
+
+def test_matching_skips_permanently_failed_ids(gmail):
+    mailbox = FakeMailbox(['a', 'bad'])
+
+    def run(ids, build_request, method, progress=None, succeeded=None):
+        mailbox.ids = [i for i in mailbox.ids if i == 'bad']
+        return {"succeeded": [i for i in ids if i != 'bad'], "failed": [{"id": "bad", "error": "boom"}]}
+
+    with patch.object(gmail, '_list_id_page', side_effect=mailbox.list_page), \
+         patch.object(gmail.batch_scheduler, 'run', side_effect=run):
+        result = gmail.perform_batch_action_matching('trash', ['INBOX'])
+
+    assert result['succeeded_count'] == 1
+    assert result['failed'] == [{"id": "bad", "error": "boom"}]
+
+
+def test_iter_email_ids_yields_each_page_as_it_is_listed(gmail):
+    mailbox = FakeMailbox(['a', 'b', 'c'])
+
+    with patch.object(gmail, '_list_id_page', side_effect=mailbox.list_page):
+        pages = gmail.iter_email_ids(['INBOX'], from_sender='bob')
+        assert next(pages) == ['a', 'b']
+        assert mailbox.calls == [None]
+        assert list(pages) == [['c']]
+        assert gmail.get_email_ids(['INBOX'], from_sender='bob') == ['a', 'b', 'c']
+
+
+def test_cancelled_batch_action_still_mirrors_applied_changes(gmail):
+    from src.jobs import JobCancelled
+
+    def run(ids, build_request, method, progress=None, succeeded=None):
+        succeeded.extend(ids[:2])  # The first batch went through...
+        progress(2, 0, len(ids))  # ...then the job is cancelled.
+
+    def cancel(processed, failed, total):
+        raise JobCancelled()
+
+    gmail.batch_scheduler.run = run
+    gmail._apply_local_label_delta = MagicMock()
+
+    with pytest.raises(JobCancelled):
+        gmail.perform_batch_action('trash', ids=['1', '2', '3'], progress=cancel)
+
+    gmail._apply_local_label_delta.assert_called_once_with(['1', '2'], ['TRASH'], [])
@@ -0,0 +1,176 @@
+from unittest.mock import MagicMock
+from googleapiclient.errors import HttpError
+from src.batch_scheduler import AdaptiveBatchScheduler, is_rate_limit_error, group_label_changes
+from src.quota import QuotaLimiter, TokenBucket, method_for_request, units_for
+
+
+def http_error(status, content=b''):
+    return HttpError(MagicMock(status=status), content)
+
+
+class ScriptedBatch:
+    """Fake BatchHttpRequest whose sub-responses are decided by `answer(request_id)`."""
+
+    def __init__(self, callback, answer, sizes):
+        self.callback = callback
+        self.answer = answer
+        self.sizes = sizes
+        self.request_ids = []
+
+    def add(self, request, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.sizes.append(len(self.request_ids))
+        for request_id in self.request_ids:
+            self.callback(request_id, {}, self.answer(request_id))
+
+
+def make_scheduler(answer, sizes, **kwargs):
+    service = MagicMock()
+    service.new_batch_http_request.side_effect = lambda callback: ScriptedBatch(callback, answer, sizes)
+    bucket = TokenBucket(rate=1_000_000)
+    return AdaptiveBatchScheduler(lambda: service, bucket, sleep=lambda s: None, **kwargs)
+
+
+def test_batch_size_grows_while_batches_succeed():
+    sizes = []
+    scheduler = make_scheduler(lambda request_id: None, sizes, initial_size=10)
+
+    result = scheduler.run([str(i) for i in range(500)], lambda service, i: None, 'messages.modify')
+
+    assert len(result['succeeded']) == 500 and result['failed'] == []
+    assert sizes[:7] == [10, 15, 22, 33, 49, 73, 100]
+    assert max(sizes) == 100
+
+
+def test_only_rate_limited_requests_are_retried_and_batch_shrinks():
+    sizes = []
+    seen = set()
+
+    def answer(request_id):
+        # Odd IDs are throttled on their first attempt only.
+        if int(request_id) % 2 and request_id not in seen:
+            seen.add(request_id)
+            return http_error(429)
+        return None
+
+    scheduler = make_scheduler(answer, sizes, initial_size=20)
+    result = scheduler.run([str(i) for i in range(40)], lambda service, i: None, 'messages.modify')
+
+    assert sorted(result['succeeded'], key=int) == [str(i) for i in range(40)]
+    assert sizes[1] == 10
+
+
+def test_permanent_errors_are_reported_per_id():
+    sizes = []
+
+    def answer(request_id):
+        if request_id == 'missing':
+            return http_error(404)
+        if request_id == 'flaky':
+            return http_error(503)
+        return None
+
+    scheduler = make_scheduler(answer, sizes, max_attempts=3)
+    result = scheduler.run(['ok', 'missing', 'flaky'], lambda service, i: None, 'messages.trash')
+
+    assert result['succeeded'] == ['ok']
+    assert {f['id'] for f in result['failed']} == {'missing', 'flaky'}
+    # 'flaky' is attempted max_attempts times, 'missing' only once.
+    assert sizes == [3, 1, 1]
+
+
+def test_rate_limit_detection():
+    assert is_rate_limit_error(http_error(429))
+    assert is_rate_limit_error(http_error(403, b'{"reason": "userRateLimitExceeded"}'))
+    assert not is_rate_limit_error(http_error(403, b'{"reason": "forbidden"}'))
+
+
+def test_token_bucket_blocks_until_units_available():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    assert bucket.try_acquire(10)
+    assert not bucket.try_acquire(10)
+    waited = bucket.acquire(5)
+    assert waited > 0
+    assert units_for('messages.batchModify') == 50
+
+
+def test_token_bucket_reserve_leaves_units_to_foreground_work():
+    bucket = TokenBucket(rate=1000, capacity=100)
+    assert bucket.acquire(10, reserve=50) == 0
+    # 90 left: background work waits until 50 would remain, foreground work does not.
+    assert bucket.acquire(45, reserve=50) > 0
+    assert bucket.acquire(40) == 0
+    # A request too large for the reserve still goes through on a full bucket.
+    assert bucket.acquire(80, reserve=50) > 0
+
+
+
+def test_quota_limiter_accounts_units_per_method():
+    limiter = QuotaLimiter(rate=1000, capacity=20)
+    limiter.acquire(units_for('messages.list'), method='messages.list')
+    limiter.acquire(units_for('messages.get', 3), method='messages.get')
+    limiter.acquire(units_for('messages.list'), method='messages.list')  # must wait for a refill
+
+    metrics = limiter.metrics()
+    assert metrics['by_method'] == {
+        'messages.get': {'calls': 3, 'units': 15}, 'messages.list': {'calls': 2, 'units': 10},
+    }
+    assert metrics['units_total'] == 25
+    assert metrics['throttled_acquisitions'] == 1 and metrics['throttled_seconds_total'] > 0
+    assert metrics['units_per_second_1s'] == 25
+    assert metrics['utilization_10s'] == round(2.5 / 1000, 3)
+
+
+def test_method_for_request_uses_discovery_method_id():
+    assert method_for_request(MagicMock(methodId='gmail.users.messages.list')) == 'messages.list'
+    assert method_for_request(MagicMock(methodId='gmail.users.settings.filters.create')) == 'settings.filters.create'
+    assert method_for_request(object()) == 'unknown'
+
+
+def test_group_label_changes():
+    groups = group_label_changes({
+        'a': (['L1'], ['INBOX']),
+        'b': (['L1'], ['INBOX']),
+        'c': ([], ['UNREAD']),
+    })
+    assert sorted(groups) == sorted([(['a', 'b'], ['L1'], ['INBOX']), (['c'], [], ['UNREAD'])])
+
+
+def test_bulk_modify_uses_1000_id_slices():
+    service = MagicMock()
+    scheduler = AdaptiveBatchScheduler(lambda: service, TokenBucket(rate=1_000_000), sleep=lambda s: None)
+    ids = [str(i) for i in range(2500)]
+
+    result = scheduler.run_bulk_modify([(ids, [], ['INBOX', 'UNREAD'])])
+
+    assert len(result['succeeded']) == 2500
+    calls = [c for c in service.users().messages().batchModify.call_args_list if c.kwargs]
+    assert [len(c.kwargs['body']['ids']) for c in calls] == [1000, 1000, 500]
+    assert calls[0].kwargs['body']['removeLabelIds'] == ['INBOX', 'UNREAD']
+    service.new_batch_http_request.assert_not_called()
+
+
+def test_bulk_modify_falls_back_to_per_message_on_permanent_error():
+    sizes = []
+    scheduler = make_scheduler(lambda request_id: http_error(404) if request_id == 'gone' else None, sizes)
+    service = scheduler.service_factory()
+    service.users().messages().batchModify().execute.side_effect = http_error(400, b'Invalid id value')
+
+    result = scheduler.run_bulk_modify([(['a', 'gone', 'b'], ['L1'], [])])
+
+    assert result['succeeded'] == ['a', 'b']
+    assert result['failed'][0]['id'] == 'gone'
+
+
+def test_bulk_modify_fails_the_slice_on_errors_every_message_would_get():
+    sizes = []
+    scheduler = make_scheduler(lambda request_id: None, sizes)
+    service = scheduler.service_factory()
+    service.users().messages().batchModify().execute.side_effect = http_error(400, b'Invalid label: L1')
+
+    result = scheduler.run_bulk_modify([([str(i) for i in range(1000)], ['L1'], [])])
+
+    assert result['succeeded'] == [] and len(result['failed']) == 1000
+    assert sizes == []  # No per-message fallback
@@ -0,0 +1,30 @@
+import os
+
+from benchmarks.run import compare, run_size
+
+
+def test_benchmark_cases_run_against_the_fake_server(tmp_path, monkeypatch):
+    # src.config is already imported here: the service must not pick up the local store.
+    monkeypatch.chdir(tmp_path)
+    results = run_size(200, ["list_emails_page_1", "batch_mark_read"], repeat=1)
+
+    listing = results["list_emails_page_1"]
+    assert listing["gmail_calls"] == 27 and listing["http_requests"] == 3
+    assert results["batch_mark_read"]["gmail_calls"] == 1
+    assert all(result["wall_s"] > 0 and result["peak_kib"] > 0 for result in results.values())
+    assert os.listdir(tmp_path) == []  # No metadata.db or email_cache
+
+
+def test_compare_flags_calls_time_and_memory_regressions():
+    baseline = {"wall_s": 1.0, "gmail_calls": 10, "http_requests": 2, "quota_units": 50, "peak_kib": 100}
+    baselines = {"1000": {"case": baseline}}
+
+    assert compare({"1000": {"case": dict(baseline, wall_s=1.4)}}, baselines, 0.5, 0.5, check_time=True) == []
+    slower = {"1000": {"case": dict(baseline, gmail_calls=11, wall_s=1.6, peak_kib=200)}}
+    regressions = compare(slower, baselines, 0.5, 0.5, check_time=True)
+    assert len(regressions) == 3 and regressions[0] == "case @ 1000: gmail_calls 10 -> 11"
+    # Wall time depends on the machine: it is only gated on request.
+    assert len(compare(slower, baselines, 0.5, 0.5)) == 2
+    assert compare({"1000": {"case": dict(baseline, wall_s=30.0)}}, baselines, 0.5, 0.5) == []
+    # Unknown sizes or cases are not compared.
+    assert compare({"5000": {"case": dict(baseline, gmail_calls=99)}}, baselines, 0.5, 0.5) == []
@@ -0,0 +1,65 @@
+import threading
+from unittest.mock import MagicMock, patch
+from src.client_pool import GmailClientPool
+
+
+def make_pool():
+    pool = GmailClientPool(token_file='unused-token.json')
+    creds = MagicMock(valid=True)
+    pool._load_credentials = MagicMock(return_value=creds)
+    return pool, creds
+
+
+def test_client_is_reused_within_a_thread(mock_google_service):
+    pool, _ = make_pool()
+
+    assert pool.get() is pool.get()
+    pool._load_credentials.assert_called_once()
+
+
+def test_each_thread_gets_its_own_client():
+    pool, _ = make_pool()
+    clients = []
+    with patch('src.client_pool.build', side_effect=lambda *a, **k: MagicMock()), \
+         patch('src.client_pool.build_from_document', side_effect=lambda *a, **k: MagicMock()):
+        threads = [threading.Thread(target=lambda: clients.append(pool.get())) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert len({id(c) for c in clients}) == 4
+    pool._load_credentials.assert_called_once()
+
+
+def test_expired_credentials_are_refreshed_once(mock_google_service):
+    pool, creds = make_pool()
+    pool.get()
+    creds.valid = False
+
+    def refresh(request):
+        creds.valid = True
+
+    creds.refresh.side_effect = refresh
+    with patch.object(pool, '_save_credentials') as save, \
+         patch('src.client_pool.build_from_document', return_value=mock_google_service):
+        threads = [threading.Thread(target=pool.get) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    creds.refresh.assert_called_once()
+    save.assert_called_once_with(creds)
+
+
+def test_api_root_overrides_discovery_root_url_and_anonymous_skips_oauth():
+    pool = GmailClientPool(token_file='unused-token.json', api_root='http://127.0.0.1:8085/', anonymous=True)
+    discovered = MagicMock(_rootDesc={"rootUrl": "https://gmail.googleapis.com/", "servicePath": ""})
+    with patch('src.client_pool.build', return_value=discovered), \
+         patch('src.client_pool.build_from_document') as from_document:
+        pool.get()
+
+    document = from_document.call_args.args[0]
+    assert document["rootUrl"] == "http://127.0.0.1:8085/"
+    assert pool.credentials().token is None and pool.credentials().valid
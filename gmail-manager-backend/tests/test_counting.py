@@ -0,0 +1,123 @@
+import pytest
+from unittest.mock import MagicMock
+from src.counting import MessageCounter, reduce_query_to_labels, count_key
+
+
+def execute(request):
+    return request.execute()
+
+
+@pytest.fixture
+def service():
+    mock = MagicMock()
+    mock.users().getProfile().execute.return_value = {'historyId': '1'}
+    return mock
+
+
+def make_counter(service, store=None):
+    return MessageCounter(service_factory=lambda: service, execute=execute, store_provider=lambda: store)
+
+
+def test_reduce_query_to_labels():
+    assert reduce_query_to_labels('category:primary is:unread', ['INBOX']) == ['INBOX', 'CATEGORY_PERSONAL', 'UNREAD']
+    assert reduce_query_to_labels(None, ['INBOX']) == ['INBOX']
+    assert reduce_query_to_labels('from:(bob)', ['INBOX']) is None
+
+
+def test_count_key_ignores_label_order_and_spacing():
+    assert count_key(['B', 'A'], 'from:x  is:unread') == count_key(['A', 'B'], 'from:x is:unread')
+
+
+def test_single_label_uses_label_counters(service):
+    service.users().labels().get().execute.return_value = {'messagesTotal': 1234, 'messagesUnread': 56}
+    counter = make_counter(service)
+
+    assert counter.count(['INBOX'])['count'] == 1234
+    result = counter.count(['INBOX'], 'is:unread')
+    assert (result['count'], result['exact'], result['source']) == (56, True, 'label')
+    service.users().messages().list.assert_not_called()
+
+
+def test_store_answers_label_only_queries(service):
+    store = MagicMock()
+    store.count.return_value = 7
+    counter = make_counter(service, store=store)
+
+    assert counter.count(['INBOX'], 'category:primary')['source'] == 'store'
+    store.count.assert_called_with(['INBOX', 'CATEGORY_PERSONAL'])
+
+
+def test_walk_count_is_memoized_until_history_changes(service):
+    service.users().messages().list().execute.side_effect = [
+        {'messages': [{'id': '1'}, {'id': '2'}], 'nextPageToken': 'p2'},
+        {'messages': [{'id': '3'}]},
+        {'messages': [{'id': '1'}]},
+    ]
+    counter = make_counter(service)
+    counter.history_ttl = 0
+
+    assert counter.count(['INBOX'], 'from:bob')['count'] == 3
+    cached = counter.count(['INBOX'], 'from:bob')
+    assert (cached['count'], cached['exact'], cached['source']) == (3, True, 'cache')
+
+    service.users().getProfile().execute.return_value = {'historyId': '2'}
+    assert counter.count(['INBOX'], 'from:bob')['count'] == 1
+
+
+def test_estimate_mode_returns_estimate_and_counts_in_background(service):
+    def list_request(**kwargs):
+        request = MagicMock()
+        if kwargs.get('maxResults') == 1:
+            request.execute.return_value = {'resultSizeEstimate': 100}
+        else:
+            request.execute.return_value = {'messages': [{'id': str(i)} for i in range(42)]}
+        return request
+
+    service.users().messages().list.side_effect = list_request
+    counter = make_counter(service)
+
+    result = counter.count(['INBOX'], 'from:bob', mode='estimate')
+    assert result['exact'] is False and result['count'] == 100
+
+    counter._executor.shutdown(wait=True)
+    result = counter.count(['INBOX'], 'from:bob')
+    assert (result['count'], result['exact'], result['source']) == (42, True, 'cache')
+
+
+def test_status_long_polls_background_count(service):
+    service.users().messages().list().execute.return_value = {'messages': [{'id': '1'}, {'id': '2'}]}
+    counter = make_counter(service)
+
+    result = counter.count(['INBOX'], 'from:bob', mode='estimate', estimate=10)
+    assert result['count'] == 10 and result['exact'] is False
+
+    status = counter.status(result['fingerprint'], wait=5)
+    assert status == {'fingerprint': result['fingerprint'], 'count': 2, 'exact': True, 'status': 'done'}
+    assert counter.status('unknown') is None
+
+
+def test_status_reports_finished_counts_without_a_history_id(service):
+    service.users().getProfile().execute.side_effect = Exception("profile unavailable")
+    service.users().messages().list().execute.return_value = {'messages': [{'id': '1'}, {'id': '2'}]}
+    counter = make_counter(service)
+    result = counter.count(['INBOX'], 'from:bob', mode='estimate', estimate=10)
+    counter._executor.shutdown(wait=True)
+    walks = service.users().messages().list().execute.call_count
+
+    status = counter.status(result['fingerprint'])
+
+    assert (status['status'], status['count']) == ('done', 2)
+    assert service.users().messages().list().execute.call_count == walks  # No new page walk
+
+
+def test_status_rechecks_the_history_id(service):
+    service.users().messages().list().execute.return_value = {'messages': [{'id': '1'}]}
+    counter = make_counter(service)
+    counter.history_ttl = 0
+    fingerprint = counter.count(['INBOX'], 'from:bob')['fingerprint']
+    assert counter.status(fingerprint)['status'] == 'done'
+
+    service.users().getProfile().execute.return_value = {'historyId': '2'}
+    service.users().messages().list().execute.return_value = {'messages': [{'id': '1'}, {'id': '2'}]}
+
+    assert counter.status(fingerprint, wait=5)['count'] == 2
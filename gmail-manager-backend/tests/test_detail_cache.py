@@ -0,0 +1,80 @@
+import pytest
+from src.detail_cache import EmailDetailCache, content_size
+from src.gmail_service import GmailService
+from src import metrics
+
+
+def content(email_id, body_size=1000):
+    return {"id": email_id, "thread_id": "t", "snippet": "", "subject": "s", "sender": "a",
+            "to": "", "date": "", "body": "x" * body_size}
+
+
+def test_lru_evicts_by_total_body_bytes():
+    cache = EmailDetailCache(max_bytes=3 * content_size(content('a')), disk_dir=None)
+    for email_id in 'abc':
+        cache.put(email_id, content(email_id), ['INBOX'])
+    cache.get('a')  # 'a' becomes most recently used
+    cache.put('d', content('d'), ['INBOX'])
+
+    assert cache.get('b') is None
+    assert all(cache.get(email_id) for email_id in 'acd')
+    assert cache.memory_bytes <= cache.max_bytes
+
+    # One huge body pushes out several small ones.
+    cache.put('big', content('big', 3000), [])
+    assert len(cache) == 1
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    EmailDetailCache(disk_dir=str(tmp_path)).put('abc123', content('abc123'), ['UNREAD'])
+
+    fresh = EmailDetailCache(disk_dir=str(tmp_path))
+    cached_content, label_ids, age = fresh.get('abc123')
+
+    assert cached_content['body'] == content('abc123')['body']
+    assert label_ids is None and age is None
+    assert fresh.get('../etc/passwd') is None
+
+
+def test_contains_neither_reads_the_disk_nor_counts_as_a_lookup(tmp_path):
+    EmailDetailCache(disk_dir=str(tmp_path)).put('abc123', content('abc123'), [])
+    fresh = EmailDetailCache(disk_dir=str(tmp_path))
+    metrics.REGISTRY.reset()
+
+    assert fresh.contains('abc123') and not fresh.contains('def456')
+    assert len(fresh) == 0  # Not loaded into memory
+    assert metrics.CACHE_REQUESTS.value('email_detail', 'hit') == 0
+    assert metrics.CACHE_REQUESTS.value('email_detail', 'miss') == 0
+
+def test_label_delta_updates_cached_labels():
+    cache = EmailDetailCache(disk_dir=None)
+    cache.put('a', content('a'), ['INBOX', 'UNREAD'])
+    cache.apply_label_delta(['a'], remove_label_ids=['UNREAD'])
+    assert cache.get('a')[1] == ['INBOX']
+
+
+@pytest.fixture
+def gmail(tmp_path, mock_google_service):
+    service = GmailService()
+    service.client_pool.get = lambda: mock_google_service
+    service.metadata_store = None
+    service.detail_cache = EmailDetailCache(disk_dir=str(tmp_path))
+    return service
+
+
+def test_get_email_details_reopens_without_refetching_the_body(gmail, mock_google_service):
+    messages = mock_google_service.users().messages()
+    messages.get.return_value.execute.return_value = {
+        "id": "m1", "threadId": "t1", "snippet": "hi", "labelIds": ["INBOX", "UNREAD"],
+        "payload": {"mimeType": "text/plain", "headers": [{"name": "Subject", "value": "Hello"}],
+                    "body": {"data": "aGk="}},
+    }
+
+    first = gmail.get_email_details("m1")
+    gmail.modify_email("m1", add_label_ids=[], remove_label_ids=["UNREAD"])
+    second = gmail.get_email_details("m1")
+
+    assert first['body'] == second['body'] == "hi"
+    assert first['is_unread'] and not second['is_unread']
+    formats = [c.kwargs.get('format') for c in messages.get.call_args_list if c.kwargs]
+    assert formats == ['full']
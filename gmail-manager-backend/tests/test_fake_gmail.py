@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+
+from src.async_transport import AsyncGmailTransport
+from src.fake_gmail import FakeGmailServer, FakeMailbox, create_app
+from src.gmail_service import GmailService
+from src.quota import TokenBucket
+
+
+def make_server(size=200, **kwargs):
+    return FakeGmailServer(FakeMailbox(size=size, seed=1), **kwargs)
+
+
+def test_mailbox_is_deterministic_and_hides_spam_and_trash():
+    first, second = FakeMailbox(size=100, seed=3), FakeMailbox(size=100, seed=3)
+    assert first.order == second.order
+    assert [first.messages[i].label_ids for i in first.order] == [second.messages[i].label_ids for i in second.order]
+
+    everything = first.search(include_spam_trash=True)
+    visible = first.search()
+    hidden = [i for i in everything if {'SPAM', 'TRASH'} & set(first.messages[i].label_ids)]
+    assert len(visible) == len(everything) - len(hidden)
+    assert first.search(['TRASH']) == [i for i in hidden if 'TRASH' in first.messages[i].label_ids]
+
+
+def test_list_paginates_and_supports_backend_queries():
+    server = make_server()
+    ids, page_token = [], None
+    while True:
+        status, page = server.call("GET", "messages", {"labelIds": ["INBOX"], "maxResults": ["50"],
+                                                       **({"pageToken": [page_token]} if page_token else {})})
+        assert status == 200
+        ids += [m['id'] for m in page.get('messages', [])]
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            break
+    assert ids == server.mailbox.search(['INBOX']) and page['resultSizeEstimate'] == len(ids)
+
+    sender = server.mailbox.messages[ids[0]].sender
+    _, result = server.call("GET", "messages", {"q": [f"from:({sender.split('<')[1][:-1]}) -is:read"]})
+    assert all(sender == server.mailbox.messages[m['id']].sender for m in result.get('messages', []))
+
+    status, error = server.call("GET", "messages", {"q": ["has:attachment"]})
+    assert status == 400 and error['error']['errors'][0]['reason'] == "invalidArgument"
+
+
+def test_modifications_are_recorded_in_history():
+    server = make_server()
+    start = int(server.mailbox.profile()['historyId'])
+    message_id = server.mailbox.search(['INBOX'])[0]
+
+    server.call("POST", f"messages/{message_id}/modify", body={"removeLabelIds": ["INBOX"], "addLabelIds": ["Label_1"]})
+    server.call("POST", "messages/batchModify", body={"ids": [message_id], "addLabelIds": ["Label_1"]})  # no-op
+    new_id = server.mailbox.deliver()[0]
+
+    status, history = server.call("GET", "history", {"startHistoryId": [str(start)]})
+    assert status == 200 and len(history['history']) == 3
+    assert history['history'][0]['labelsAdded'][0]['labelIds'] == ["Label_1"]
+    assert 'INBOX' not in history['history'][1]['labelsRemoved'][0]['message']['labelIds']
+    assert history['history'][2]['messagesAdded'][0]['message']['id'] == new_id
+
+    status, _ = server.call("GET", "history", {"startHistoryId": [str(start)], "historyTypes": ["labelRemoved"]})
+    assert status == 200
+    status, _ = server.call("GET", "messages/unknown")
+    assert status == 404
+
+
+def test_quota_and_error_injection_answer_429():
+    server = make_server(quota_units_per_second=1, quota_burst=10)
+    statuses = [server.call("GET", "messages", {})[0] for _ in range(3)]
+    assert statuses == [200, 200, 429] and server.stats["rate_limited"] == 1
+
+    flaky = make_server(error_rate=1.0)
+    status, error = flaky.call("GET", "labels")
+    assert status == 429 and error['error']['errors'][0]['reason'] == "rateLimitExceeded"
+
+
+def test_gmail_service_lists_through_the_fake_server():
+    server = make_server(size=300)
+    gmail = GmailService()
+    gmail.metadata_store = None
+    gmail.transport = AsyncGmailTransport(
+        lambda: SimpleNamespace(valid=True, token=None), TokenBucket(rate=1e6),
+        api_root="http://fake", http_transport=httpx.ASGITransport(app=create_app(server)),
+    )
+
+    result = asyncio.run(gmail.alist_emails(['INBOX'], max_results=150))
+
+    expected = server.mailbox.search(['INBOX'])[:150]
+    assert [email['id'] for email in result['emails']] == expected
+    assert result['emails'][0]['subject'] == server.mailbox.messages[expected[0]].subject
+    assert server.stats["batch_requests"] == 2 and server.stats["by_method"]["messages.get"] == 150
@@ -7,11 +7,11 @@ class TestGmailServiceFilters:
     @pytest.fixture
     def service_instance(self, mock_google_service):
         # We need to mock credentials loading too since __init__ calls it
-        with patch('src.gmail_service.Credentials') as mock_creds:
+        with patch('src.client_pool.Credentials') as mock_creds:
             with patch('src.gmail_service.GmailService._get_labels', return_value=({}, [])):
                  service = GmailService()
-                 # Replace the internal service with our mock
-                 service.service = mock_google_service
+                 # Replace the pooled clients with our mock
+                 service.client_pool.get = lambda: mock_google_service
                  return service
 
     # Note: Constructing GmailService is tricky because of __init__ side effects (API calls).
@@ -33,13 +33,25 @@ class TestGmailServiceFilters:
             with patch('src.gmail_service.GmailService._get_labels', return_value=({}, [])):
                  service = GmailService()
         
-        # Action
-        filters = service.list_filters()
+            # Action (clients come from the pool per call, so keep the mock in place)
+            filters = service.list_filters()
         
         # Assert
         assert filters == [{'id': '123'}]
         mock_filters.list.assert_called_with(userId='me')
 
+    def test_calls_are_accounted_by_the_quota_limiter(self, mock_google_service):
+        mock_filters = mock_google_service.users().settings().filters()
+        mock_filters.list().execute.return_value = {'filter': []}
+        mock_filters.list().methodId = 'gmail.users.settings.filters.list'
+
+        with patch('src.gmail_service.GmailService._get_gmail_service', return_value=mock_google_service):
+            with patch('src.gmail_service.GmailService._get_labels', return_value=({}, [])):
+                 service = GmailService()
+            service.list_filters()
+
+        assert service.quota.metrics()['by_method']['settings.filters.list'] == {'calls': 1, 'units': 1}
+
     def test_create_filter(self, mock_google_service):
         mock_filters = mock_google_service.users().settings().filters()
         mock_filters.create().execute.return_value = {'id': 'new_filter'}
@@ -48,8 +60,8 @@ class TestGmailServiceFilters:
              with patch('src.gmail_service.GmailService._get_labels', return_value=({}, [])):
                  service = GmailService()
         
-        filter_obj = {'criteria': {'from': 'test@example.com'}}
-        result = service.create_filter(filter_obj)
+             filter_obj = {'criteria': {'from': 'test@example.com'}}
+             result = service.create_filter(filter_obj)
         
         assert result == {'id': 'new_filter'}
         mock_filters.create.assert_called_with(userId='me', body=filter_obj)
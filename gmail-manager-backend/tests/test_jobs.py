@@ -0,0 +1,128 @@
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from src.jobs import JobManager, JobCancelled, SUCCEEDED, FAILED, CANCELLED, RUNNING
+
+
+def wait_for(manager, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job['status'] in (SUCCEEDED, FAILED, CANCELLED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(db_path=str(tmp_path / "jobs.db"), max_workers=1, persist_interval=0)
+
+
+def test_job_reports_progress_and_result(manager):
+    def work(ctx):
+        for done in range(1, 4):
+            ctx.progress(done * 10, 1, 30)
+        return {"ids": ["a", "b"]}
+
+    job = manager.submit("email_ids", work, {"label_ids": ["INBOX"]})
+    finished = wait_for(manager, job['id'])
+
+    assert finished['status'] == SUCCEEDED
+    assert (finished['processed'], finished['failed'], finished['total']) == (30, 1, 30)
+    assert finished['result'] == {"ids": ["a", "b"]}
+    assert finished['params'] == {"label_ids": ["INBOX"]}
+    assert finished['throughput'] > 0
+    # Listings leave the (possibly large) results out.
+    assert manager.list()[0]['id'] == job['id'] and manager.list()[0]['result'] is None
+
+
+def test_failed_job_records_error(manager):
+    def work(ctx):
+        raise RuntimeError("boom")
+
+    job = manager.submit("batch_action", work)
+    finished = wait_for(manager, job['id'])
+
+    assert finished['status'] == FAILED
+    assert finished['error'] == "boom"
+
+
+def test_cancel_stops_job_at_next_progress_report(manager):
+    started, release = threading.Event(), threading.Event()
+    raised = []
+
+    def work(ctx):
+        started.set()
+        release.wait(5)
+        try:
+            ctx.progress(1, 0, 100)
+        except JobCancelled:
+            raised.append(True)
+            raise
+        raise AssertionError("progress should have raised")
+
+    job = manager.submit("batch_action", work)
+    started.wait(5)
+    assert manager.get(job['id'])['status'] == RUNNING
+
+    manager.cancel(job['id'])
+    release.set()
+
+    assert wait_for(manager, job['id'])['status'] == CANCELLED
+    assert raised == [True]
+    assert manager.cancel("unknown") is None
+
+
+def test_jobs_survive_restart_and_running_jobs_are_marked_failed(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    first = JobManager(db_path=db_path, max_workers=1)
+    done = first.submit("email_ids", lambda ctx: {"ids": []})
+    wait_for(first, done['id'])
+
+    release = threading.Event()
+    running = first.submit("batch_action", lambda ctx: release.wait(5))
+
+    second = JobManager(db_path=db_path, max_workers=1)
+    assert second.get(done['id'])['status'] == SUCCEEDED
+    interrupted = second.get(running['id'])
+    assert interrupted['status'] == FAILED
+    assert "restart" in interrupted['error']
+    assert [job['id'] for job in second.list()] == [running['id'], done['id']]
+    release.set()
+
+
+# --- API ---
+
+@pytest.fixture
+def job_manager(manager):
+    with patch('src.main.job_manager', manager):
+        yield manager
+
+
+def test_batch_action_api_background(client, mock_gmail_service, job_manager):
+    mock_gmail_service.perform_batch_action.return_value = {
+        'action': 'archive', 'total': 2, 'succeeded_count': 2, 'succeeded': ['1', '2'], 'failed': []
+    }
+
+    response = client.post("/actions/batch?background=true", json={"action": "archive", "ids": ["1", "2"]})
+
+    assert response.status_code == 202
+    job_id = response.json()['id']
+    wait_for(job_manager, job_id)
+
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job['status'] == SUCCEEDED
+    assert job['kind'] == 'batch_action'
+    assert job['result']['succeeded'] == ['1', '2']
+    assert 'progress' in mock_gmail_service.perform_batch_action.call_args.kwargs
+
+    listing = client.get("/jobs").json()['jobs']
+    assert [j['id'] for j in listing] == [job_id]
+    assert listing[0]['result'] is None
+
+
+def test_job_api_unknown_job(client, job_manager):
+    assert client.get("/jobs/nope").status_code == 404
+    assert client.post("/jobs/nope/cancel").status_code == 404
@@ -0,0 +1,93 @@
+import threading
+import time
+from unittest.mock import MagicMock
+from src.label_registry import LabelRegistry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def labels(*names):
+    labels_list = [{"id": f"Label_{name}", "name": name, "type": "user"} for name in names]
+    return {label["name"].upper(): label["id"] for label in labels_list}, labels_list
+
+
+def test_labels_are_loaded_lazily_and_refreshed_after_ttl():
+    clock = Clock()
+    fetch = MagicMock(side_effect=[labels("Work"), labels("Work", "Travel")])
+    registry = LabelRegistry(fetch, ttl=60, clock=clock)
+
+    fetch.assert_not_called()
+    assert registry.labels_map == {"WORK": "Label_Work"}
+    assert registry.resolve("work") == "Label_Work"
+    assert fetch.call_count == 1
+
+    clock.now = 61
+    assert registry.resolve("Travel") == "Label_Travel"
+    assert fetch.call_count == 2
+
+
+def test_unknown_name_refreshes_once_then_is_negatively_cached():
+    clock = Clock()
+    fetch = MagicMock(side_effect=[labels("Work"), labels("Work", "New"), labels("Work", "New")])
+    registry = LabelRegistry(fetch, ttl=600, miss_interval=5, clock=clock)
+
+    assert registry.resolve("New") == "Label_New"
+    assert fetch.call_count == 2
+
+    assert registry.resolve("Missing") is None
+    assert registry.resolve("Missing") is None
+    assert fetch.call_count == 3
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) > 1:
+            time.sleep(0.1)
+            return labels("Work", "New")
+        return labels("Work")
+
+    registry = LabelRegistry(fetch, ttl=600)
+    registry.labels_map
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.resolve("New"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["Label_New"] * 8
+    assert len(calls) == 2
+
+
+def test_unknown_label_ids_in_history_invalidate_the_snapshot():
+    fetch = MagicMock(side_effect=[labels("Work"), labels("Work", "New")])
+    registry = LabelRegistry(fetch, ttl=600)
+    registry.labels_map
+
+    registry.observe_label_ids({"Label_Work"})
+    assert fetch.call_count == 1
+    registry.observe_label_ids({"Label_New"})
+    assert registry.labels_map == {"WORK": "Label_Work", "NEW": "Label_New"}
+    assert fetch.call_count == 2
+
+
+def test_failed_refresh_keeps_previous_snapshot():
+    clock = Clock()
+    fetch = MagicMock(side_effect=[labels("Work"), Exception("network down")])
+    registry = LabelRegistry(fetch, ttl=60, clock=clock)
+    registry.labels_map
+
+    clock.now = 61
+    assert registry.labels_map == {"WORK": "Label_Work"}
+    # The failure is not retried on every access.
+    registry.labels_list
+    assert fetch.call_count == 2
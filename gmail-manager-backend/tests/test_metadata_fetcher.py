@@ -0,0 +1,136 @@
+import threading
+import time
+from unittest.mock import MagicMock
+from googleapiclient.errors import HttpError
+from src.metadata_fetcher import MetadataFetcher, extract_headers
+from src.quota import TokenBucket
+
+
+def http_error(status):
+    return HttpError(MagicMock(status=status), b'')
+
+
+class FakeBatch:
+    def __init__(self, callback, answer, sizes):
+        self.callback = callback
+        self.answer = answer
+        self.sizes = sizes
+        self.request_ids = []
+
+    def add(self, request, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.sizes.append(len(self.request_ids))
+        for request_id in self.request_ids:
+            error = self.answer(request_id)
+            response = None if error else {
+                "id": request_id, "threadId": f"t{request_id}", "labelIds": ["UNREAD"],
+                "payload": {"headers": [{"name": "subject", "value": f"s{request_id}"}]},
+            }
+            self.callback(request_id, response, error)
+
+
+def make_fetcher(answer=lambda request_id: None, sizes=None, **kwargs):
+    sizes = [] if sizes is None else sizes
+    service = MagicMock()
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, answer, sizes)
+    return MetadataFetcher(lambda: service, TokenBucket(rate=1_000_000), sleep=lambda s: None, **kwargs)
+
+
+def test_extract_headers_single_pass():
+    headers = [
+        {"name": "From", "value": "a@example.com"},
+        {"name": "SUBJECT", "value": "Hello"},
+        {"name": "Subject", "value": "ignored duplicate"},
+        {"name": "To", "value": "b@example.com"},
+        {"name": "Cc", "value": "c@example.com"},
+        {"name": "To", "value": "d@example.com"},
+    ]
+
+    found = extract_headers(headers, ('Subject', 'From', 'Date'), multi=('To', 'Cc'))
+
+    assert found == {"From": "a@example.com", "Subject": "Hello",
+                     "To": ["b@example.com", "d@example.com"], "Cc": ["c@example.com"]}
+
+
+def test_fetch_records_keeps_input_order_in_batches_of_100():
+    sizes = []
+    fetcher = make_fetcher(sizes=sizes)
+    ids = [str(i) for i in range(250)]
+
+    records = fetcher.fetch_records(ids)
+
+    assert [r.id for r in records] == ids
+    assert records[0].subject == "s0"
+    assert records[0].is_unread
+    assert sorted(sizes) == [50, 100, 100]
+
+
+def test_retryable_failures_are_retried_and_missing_messages_skipped():
+    seen = set()
+    lock = threading.Lock()
+
+    def answer(request_id):
+        if request_id == 'gone':
+            return http_error(404)
+        with lock:
+            if request_id == 'busy' and request_id not in seen:
+                seen.add(request_id)
+                return http_error(429)
+        return None
+
+    records = make_fetcher(answer).fetch_records(['a', 'gone', 'busy'])
+
+    assert [r.id for r in records] == ['a', 'busy']
+
+
+def test_ids_are_consumed_lazily():
+    consumed = []
+
+    def ids():
+        for i in range(1000):
+            consumed.append(i)
+            yield str(i)
+
+    fetcher = make_fetcher(batch_size=10, max_workers=2)
+    records = fetcher.iter_records(ids())
+    next(records)
+
+    assert len(consumed) <= 31
+
+
+def test_500_message_page_is_hydrated_by_concurrent_batches():
+    """Five 100-call batches with 200 ms latency each: concurrent, in one round trip, in order."""
+    sizes = []
+    service = MagicMock()
+
+    def new_batch(callback):
+        batch = FakeBatch(callback, lambda request_id: None, sizes)
+        execute = batch.execute
+        batch.execute = lambda: (time.sleep(0.2), execute())
+        return batch
+
+    service.new_batch_http_request.side_effect = new_batch
+    fetcher = MetadataFetcher(lambda: service, TokenBucket(rate=250, capacity=2500), max_workers=5)
+    ids = [str(i) for i in range(500)]
+
+    started = time.monotonic()
+    records = fetcher.fetch_records(ids)
+    elapsed = time.monotonic() - started
+
+    assert [r.id for r in records] == ids
+    assert sizes == [100] * 5
+    assert elapsed < 0.6  # Serial batches would take at least 1 s
+
+
+def test_default_quota_bursts_one_second_and_sync_batches_fit_the_reserve(monkeypatch):
+    import src.gmail_service as gmail_service
+    monkeypatch.setattr(gmail_service, "METADATA_STORE_ENABLED", True)
+    monkeypatch.setattr(gmail_service, "METADATA_DB_FILE", ":memory:")
+    gmail = gmail_service.GmailService()
+
+    assert gmail.quota.capacity == 250
+    store = gmail.metadata_store
+    # 25 messages.get calls (125 units) leave the 125-unit sync reserve to foreground requests.
+    assert store.fetcher.batch_size == 25 and store.quota_reserve == 125
@@ -0,0 +1,188 @@
+import pytest
+from unittest.mock import MagicMock
+from src.metadata_store import MetadataStore, message_to_row, METADATA_HEADERS
+from src.subjects import NO_SUBJECT, SubjectAggregator
+
+
+def make_row(msg_id, labels, subject="Hello", internal_date=0):
+    return {
+        "id": msg_id, "thread_id": f"t{msg_id}", "label_ids": labels,
+        "subject": subject, "sender": "a@example.com", "date": "", "snippet": "",
+        "internal_date": internal_date, "size_estimate": 100,
+    }
+
+
+class FakeBatch:
+    """Mimics BatchHttpRequest: collects requests and answers them through the callback."""
+
+    def __init__(self, callback, responses):
+        self.callback = callback
+        self.responses = responses
+        self.request_ids = []
+
+    def add(self, request, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        for request_id in self.request_ids:
+            self.callback(request_id, self.responses[request_id], None)
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = MetadataStore(str(tmp_path / "metadata.db"))
+    yield s
+    s.close()
+
+
+def test_message_to_row_extracts_headers():
+    row = message_to_row({
+        "id": "1", "threadId": "t1", "labelIds": ["INBOX"], "snippet": "hi", "internalDate": "42",
+        "payload": {"headers": [
+            {"name": "Subject", "value": "S"}, {"name": "From", "value": "F"}, {"name": "Date", "value": "D"},
+        ]},
+    })
+    assert row["subject"] == "S" and row["sender"] == "F" and row["date"] == "D"
+    assert row["internal_date"] == 42 and row["label_ids"] == ["INBOX"]
+
+
+def test_label_queries_match_messages_list_semantics(store):
+    store.upsert_messages([
+        make_row("1", ["INBOX", "UNREAD"], internal_date=3),
+        make_row("2", ["INBOX"], internal_date=2),
+        make_row("3", ["INBOX", "TRASH"], internal_date=1),
+    ])
+    assert store.count(["INBOX"]) == 2
+    assert store.count(["INBOX", "UNREAD"]) == 1
+    assert store.count(["TRASH"]) == 1
+    emails = store.list_messages(["INBOX"], offset=0, limit=10)
+    assert [e["id"] for e in emails] == ["1", "2"]
+    assert emails[0]["is_unread"] is True
+
+
+def test_subject_counts_respects_limit(store):
+    store.upsert_messages([
+        make_row("1", ["INBOX"], subject="A", internal_date=3),
+        make_row("2", ["INBOX"], subject="A", internal_date=2),
+        make_row("3", ["INBOX"], subject="B", internal_date=1),
+    ])
+    assert store.subject_counts(["INBOX"]) == [{"subject": "A", "count": 2}, {"subject": "B", "count": 1}]
+    assert store.subject_counts(["INBOX"], limit=1) == [{"subject": "A", "count": 1}]
+
+
+def test_missing_subject_matches_the_streamed_aggregation(store):
+    row = message_to_row({"id": "1", "threadId": "t1", "labelIds": ["INBOX"], "payload": {"headers": []}})
+    store.upsert_messages([row])
+    expected = SubjectAggregator().add_all([None]).top()
+    assert store.subject_counts(["INBOX"]) == expected == [{"subject": NO_SUBJECT, "count": 1}]
+    assert store.list_messages(["INBOX"])[0]["subject"] == NO_SUBJECT
+
+
+def test_local_listing_rejects_malformed_page_tokens(store):
+    from src.gmail_service import GmailService
+    store.upsert_messages([make_row(str(i), ["INBOX"], internal_date=i) for i in range(3)])
+    with store._connect() as conn:
+        store._set_state(conn, "backfill_complete", "1")
+    gmail = GmailService()
+    gmail.metadata_store = store
+
+    page = gmail.list_emails(["INBOX"], max_results=2)
+    assert page["next_page_token"] == "local:2"
+    assert [e["id"] for e in gmail.list_emails(["INBOX"], page_token="local:2", max_results=2)["emails"]] == ["0"]
+    for token in ("local:abc", "local:-1", "local:"):
+        with pytest.raises(ValueError):
+            gmail.list_emails(["INBOX"], page_token=token)
+
+def test_apply_label_delta(store):
+    store.upsert_messages([make_row("1", ["INBOX", "UNREAD"])])
+    store.apply_label_delta(["1"], add_label_ids=["Label_1"], remove_label_ids=["INBOX", "UNREAD"])
+    assert store.count(["INBOX"]) == 0
+    assert store.count(["Label_1"]) == 1
+
+
+def test_apply_history(store):
+    store.upsert_messages([make_row("1", ["INBOX"]), make_row("2", ["INBOX"])])
+    with store._connect() as conn:
+        store._set_state(conn, "history_id", "100")
+
+    service = MagicMock()
+    service.users().history().list().execute.return_value = {
+        "historyId": "105",
+        "history": [
+            {"messagesAdded": [{"message": {"id": "3"}}]},
+            {"messagesDeleted": [{"message": {"id": "2"}}]},
+            {"labelsRemoved": [{"message": {"id": "1", "labelIds": ["UNREAD"]}, "labelIds": ["INBOX"]}]},
+        ],
+    }
+    new_message = {"id": "3", "threadId": "t3", "labelIds": ["INBOX"], "snippet": "",
+                   "payload": {"headers": [{"name": "Subject", "value": "New"}]}}
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, {"3": new_message})
+
+    assert store.apply_history(service) == 3
+    assert store.get_history_id() == "105"
+    assert store.list_ids(["INBOX"]) == ["3"]
+    assert store.count(["UNREAD"]) == 1
+
+
+def test_apply_history_expired_resets_store(store):
+    from googleapiclient.errors import HttpError
+    store.upsert_messages([make_row("1", ["INBOX"])])
+    with store._connect() as conn:
+        store._set_state(conn, "history_id", "100")
+        store._set_state(conn, "backfill_complete", "1")
+
+    service = MagicMock()
+    service.users().history().list().execute.side_effect = HttpError(MagicMock(status=404), b"")
+
+    store.apply_history(service)
+    assert not store.is_ready()
+    assert store.count([]) == 0
+
+
+def test_sync_fetches_through_the_shared_fetcher(tmp_path):
+    fetcher = MagicMock()
+    fetcher.iter_responses.return_value = iter([
+        {"id": "1", "threadId": "t1", "labelIds": ["INBOX"], "payload": {"headers": [{"name": "Subject", "value": "S"}]}},
+    ])
+    store = MetadataStore(str(tmp_path / "metadata.db"), fetcher=fetcher)
+    service = MagicMock()
+    service.users().getProfile().execute.return_value = {"historyId": "10"}
+    service.users().messages().list().execute.return_value = {"messages": [{"id": "1"}, {"id": "2"}]}
+    try:
+        store.backfill(service)
+        fetcher.iter_responses.assert_called_once_with(["1", "2"], METADATA_HEADERS, failed_ids=[])
+        service.new_batch_http_request.assert_not_called()
+        assert store.list_ids(["INBOX"]) == ["1"]
+    finally:
+        store.close()
+
+
+def test_failed_fetches_are_retried_on_the_next_sync(tmp_path):
+    attempts = []
+
+    def iter_responses(ids, headers, failed_ids):
+        attempts.append(list(ids))
+        if len(attempts) == 1:
+            failed_ids.append("2")  # Given up on during the backfill
+        for message_id in ids:
+            if message_id not in failed_ids:
+                yield {"id": message_id, "threadId": f"t{message_id}", "labelIds": ["INBOX"], "payload": {"headers": []}}
+
+    fetcher = MagicMock()
+    fetcher.iter_responses.side_effect = iter_responses
+    store = MetadataStore(str(tmp_path / "metadata.db"), fetcher=fetcher)
+    service = MagicMock()
+    service.users().getProfile().execute.return_value = {"historyId": "10"}
+    service.users().messages().list().execute.return_value = {"messages": [{"id": "1"}, {"id": "2"}]}
+    service.users().history().list().execute.return_value = {"historyId": "10"}
+    try:
+        store.backfill(service)
+        assert store.is_ready() and store.list_ids(["INBOX"]) == ["1"]
+        assert store.pending_ids() == ["2"]
+
+        store.sync(service)
+        assert attempts[1] == ["2"]
+        assert sorted(store.list_ids(["INBOX"])) == ["1", "2"]
+        assert store.pending_ids() == []
+    finally:
+        store.close()
@@ -0,0 +1,69 @@
+from src import metrics
+from src.batch_scheduler import AdaptiveBatchScheduler
+from src.client_pool import GmailClientPool
+from src.fake_gmail import FakeGmailServer, FakeHttp, FakeMailbox
+from src.gmail_service import GmailService
+from src.quota import TokenBucket
+
+
+def fake_pool(server):
+    return GmailClientPool(api_root="http://fake-gmail", anonymous=True, http_factory=lambda: FakeHttp(server))
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0), registry=registry)
+    histogram.observe("/a", value=0.05)
+    histogram.observe("/a", value=0.5)
+    histogram.observe("/a", value=5)
+
+    text = registry.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'latency_seconds_sum{route="/a"} 5.55' in text
+
+
+def test_gmail_calls_and_batches_are_instrumented():
+    metrics.REGISTRY.reset()
+    server = FakeGmailServer(FakeMailbox(size=100, seed=2))
+    gmail = GmailService()
+    gmail.metadata_store = None
+    gmail.client_pool = fake_pool(server)
+
+    gmail.list_emails(['INBOX'], max_results=10)
+
+    assert metrics.GMAIL_CALL_SECONDS.count('messages.list') == 1
+    assert metrics.GMAIL_CALLS.value('messages.get', '200') == 10
+    assert metrics.GMAIL_BATCH_SIZE.count('messages.get') == 1
+    assert 'gmail_manager_gmail_batch_size_sum{method="messages.get"} 10.0' in metrics.render()
+
+
+def test_batch_failures_and_backoff_are_counted():
+    metrics.REGISTRY.reset()
+    server = FakeGmailServer(FakeMailbox(size=10, seed=2), error_rate=1.0)
+    scheduler = AdaptiveBatchScheduler(fake_pool(server).get, TokenBucket(rate=1e6), max_attempts=2, sleep=lambda delay: None)
+
+    result = scheduler.run([server.mailbox.order[0]], lambda service, i: service.users().messages().trash(userId='me', id=i),
+                           'messages.trash')
+
+    assert len(result["failed"]) == 1
+    assert metrics.GMAIL_BATCH_FAILED_CALLS.value('messages.trash', '429') == 2
+    assert metrics.GMAIL_RETRIES.value('batch_scheduler') == 1
+    assert metrics.GMAIL_BACKOFF_SECONDS.value('batch_scheduler') > 0
+
+
+def test_cache_hit_ratio_and_quota_series():
+    metrics.REGISTRY.reset()
+    metrics.observe_cache('labels', hit=True)
+    metrics.observe_cache('labels', hit=True)
+    metrics.observe_cache('labels', hit=False)
+    quota = {"by_method": {"messages.get": {"calls": 2, "units": 10}}, "throttled_acquisitions": 1,
+             "throttled_seconds_total": 0.5, "units_per_second_10s": 1.0, "utilization_10s": 0.004,
+             "available_units": 240.0}
+
+    text = metrics.render(quota)
+    assert 'gmail_manager_cache_hit_ratio{cache="labels"} 0.6667' in text
+    assert 'gmail_manager_quota_units_total{method="messages.get"} 10' in text
+    assert 'gmail_manager_quota_throttled_seconds_total 0.5' in text
@@ -0,0 +1,86 @@
+import base64
+from unittest.mock import MagicMock
+from src import mime_parser
+from src.gmail_service import GmailService
+
+
+def b64(text, encoding='utf-8'):
+    return base64.urlsafe_b64encode(text.encode(encoding)).decode('ascii')
+
+
+def part(mime_type, text=None, headers=None, **body):
+    if text is not None:
+        body['data'] = b64(text)
+    return {"mimeType": mime_type, "headers": headers or [], "body": body}
+
+
+def test_html_is_preferred_over_plain_text_in_nested_parts():
+    payload = {"mimeType": "multipart/mixed", "parts": [
+        {"mimeType": "multipart/alternative", "parts": [
+            part("text/plain", "plain"),
+            part("text/html", "<p>html</p>"),
+        ]},
+        dict(part("text/html", "<p>attached</p>"), filename="page.html"),
+    ]}
+
+    assert mime_parser.parse_payload(payload) == ("<p>html</p>", False)
+
+
+def test_plain_text_fallback_keeps_line_breaks_and_charset():
+    payload = part("text/plain", headers=[{"name": "Content-Type", "value": 'text/plain; charset="iso-8859-1"'}],
+                   data=b64("café\nbye", 'iso-8859-1'))
+
+    assert mime_parser.parse_payload(payload) == ("café<br>bye", False)
+
+
+def test_large_bodies_are_truncated_without_decoding_everything():
+    payload = part("text/html", "x" * 10_000)
+
+    body, truncated = mime_parser.parse_payload(payload, max_bytes=1000)
+
+    assert truncated and body == "x" * 1000
+    assert mime_parser.parse_payload(payload, max_bytes=10_000) == ("x" * 10_000, False)
+
+
+def test_attachment_backed_bodies_are_fetched_on_demand():
+    payload = part("text/html", attachmentId="att-1", size=5_000_000)
+    fetch = MagicMock(return_value=b64("<p>big</p>"))
+
+    assert mime_parser.parse_payload(payload, fetch) == ("<p>big</p>", False)
+    fetch.assert_called_once_with("att-1")
+    assert mime_parser.parse_payload(payload) is None
+
+
+def test_raw_fallback_uses_the_email_parser():
+    raw = b64(
+        "Content-Type: multipart/alternative; boundary=XX\r\n\r\n"
+        "--XX\r\nContent-Type: text/plain\r\n\r\nhello\r\n"
+        "--XX\r\nContent-Type: text/html\r\n\r\n<b>hello</b>\r\n--XX--\r\n"
+    )
+
+    assert mime_parser.parse_raw(raw) == ("<b>hello</b>", False)
+
+
+def test_gmail_service_falls_back_to_raw_for_unparseable_payloads(mock_google_service):
+    gmail = GmailService()
+    gmail.client_pool.get = lambda: mock_google_service
+    messages = mock_google_service.users().messages()
+    messages.get.return_value.execute.return_value = {"raw": b64("Content-Type: text/plain\r\n\r\nfrom raw")}
+    msg = {"id": "m1", "payload": {"mimeType": "multipart/related", "parts": [part("image/png", "png")]}}
+
+    assert gmail._parse_email_body(msg) == ("from raw", False)
+    assert messages.get.call_args.kwargs['format'] == 'raw'
+
+
+def test_gmail_service_body_parse_without_fetches_leaves_such_messages(mock_google_service):
+    gmail = GmailService()
+    gmail.client_pool.get = lambda: mock_google_service
+    messages = mock_google_service.users().messages()
+    messages.get.reset_mock()
+    unparseable = {"id": "m1", "payload": {"mimeType": "multipart/related", "parts": [part("image/png", "png")]}}
+    in_attachment = {"id": "m2", "payload": {"mimeType": "text/html", "body": {"attachmentId": "att-1"}}}
+
+    assert gmail._parse_email_body(unparseable, allow_fetch=False) is None
+    assert gmail._parse_email_body(in_attachment, allow_fetch=False) is None
+    messages.get.assert_not_called()
+    messages.attachments().get.assert_not_called()
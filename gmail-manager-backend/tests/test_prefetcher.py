@@ -0,0 +1,97 @@
+import time
+from unittest.mock import MagicMock
+from src.detail_cache import EmailDetailCache
+from src.prefetcher import DetailPrefetcher
+from src.quota import TokenBucket
+
+
+class FakeBatch:
+    def __init__(self, callback, fetched):
+        self.callback = callback
+        self.fetched = fetched
+        self.request_ids = []
+
+    def add(self, request, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.fetched.append(list(self.request_ids))
+        for request_id in self.request_ids:
+            self.callback(request_id, {"id": request_id, "labelIds": ["INBOX"]}, None)
+
+
+def make_prefetcher(bucket=None, to_content=None, **kwargs):
+    fetched = []
+    service = MagicMock()
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, fetched)
+    cache = EmailDetailCache(disk_dir=None)
+    prefetcher = DetailPrefetcher(
+        lambda: service, bucket or TokenBucket(rate=1_000_000), cache,
+        to_content=to_content or (lambda msg: {"id": msg["id"], "body": f"body of {msg['id']}"}), **kwargs
+    )
+    return prefetcher, cache, fetched
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_enqueued_page_is_fetched_in_batches_into_the_cache():
+    prefetcher, cache, fetched = make_prefetcher(batch_size=2)
+    cache.put('c', {"id": 'c', "body": "already cached"}, [])
+
+    prefetcher.enqueue(['a', 'b', 'c', 'd'])
+    wait_until(lambda: cache.get('d') is not None)
+
+    assert fetched == [['a', 'b'], ['d']]
+    assert cache.get('a')[0]['body'] == "body of a"
+    assert cache.get('a')[1] == ["INBOX"]
+    prefetcher.stop()
+
+
+def test_prefetch_leaves_the_quota_reserve_to_foreground_requests():
+    bucket = TokenBucket(rate=1, capacity=100)
+    prefetcher, cache, fetched = make_prefetcher(bucket=bucket, reserve=80)
+
+    prefetcher.enqueue(['a', 'b'])  # needs 10 units, only 20 may be spent
+    wait_until(lambda: cache.get('b') is not None)
+    prefetcher.enqueue(['c', 'd', 'e', 'f', 'g'])  # would dip into the reserve
+    time.sleep(0.1)
+
+    assert fetched == [['a', 'b']]
+    assert prefetcher.cancel() == 0  # the chunk is waiting for quota, not queued
+    time.sleep(0.1)
+    assert fetched == [['a', 'b']]
+    prefetcher.stop()
+
+
+def test_new_page_replaces_the_queue():
+    prefetcher, cache, fetched = make_prefetcher()
+    prefetcher._queue.extend(['old1', 'old2'])
+
+    prefetcher.enqueue(['new'])
+    wait_until(lambda: cache.get('new') is not None)
+
+    assert fetched == [['new']]
+    prefetcher.stop()
+
+
+def test_unparseable_or_skipped_messages_do_not_drop_the_rest_of_the_batch():
+    def to_content(msg):
+        if msg["id"] == "bad":
+            raise ValueError("broken MIME payload")
+        if msg["id"] == "attachment":
+            return None  # Needs more Gmail calls
+        return {"id": msg["id"], "body": "ok"}
+
+    prefetcher, cache, fetched = make_prefetcher(to_content=to_content)
+
+    prefetcher.enqueue(['bad', 'attachment', 'good'])
+    wait_until(lambda: cache.get('good') is not None)
+
+    assert fetched == [['bad', 'attachment', 'good']]
+    assert cache.get('bad') is None and cache.get('attachment') is None
+    prefetcher.stop()
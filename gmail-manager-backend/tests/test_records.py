@@ -0,0 +1,61 @@
+import tracemalloc
+from src.records import MessageRecord
+
+
+def gmail_message(i):
+    return {
+        "id": f"18c{i:013x}", "threadId": f"18c{i:013x}", "snippet": "Your weekly summary is ready",
+        "labelIds": ["INBOX", "CATEGORY_UPDATES", "UNREAD"], "internalDate": "1700000000000", "sizeEstimate": 4200,
+        "payload": {"headers": [
+            {"name": "Subject", "value": "Weekly summary"},
+            {"name": "From", "value": "News <news@example.com>"},
+            {"name": "Date", "value": "Tue, 14 Nov 2023 22:13:20 +0000"},
+        ]},
+    }
+
+
+def dict_record(msg):
+    """The flat per-message dict list_emails built before records existed."""
+    headers = {h['name']: h['value'] for h in msg['payload']['headers']}
+    return {
+        "id": msg['id'],
+        "thread_id": msg['threadId'],
+        "snippet": msg['snippet'],
+        "subject": headers.get('Subject', 'No Subject'),
+        "sender": headers.get('From', 'Unknown Sender'),
+        "date": headers.get('Date', ''),
+        "is_unread": 'UNREAD' in msg['labelIds'],
+    }
+
+
+def measure(build, messages):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [build(msg) for msg in messages]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, records
+
+
+def test_record_reads_headers_and_converts_to_email():
+    record = MessageRecord.from_message(gmail_message(1))
+
+    assert (record.subject, record.sender, record.date) == (
+        "Weekly summary", "News <news@example.com>", "Tue, 14 Nov 2023 22:13:20 +0000")
+    assert record.to_email() == {
+        "id": record.id, "thread_id": record.thread_id, "snippet": "Your weekly summary is ready",
+        "subject": "Weekly summary", "sender": "News <news@example.com>",
+        "date": "Tue, 14 Nov 2023 22:13:20 +0000", "is_unread": True,
+    }
+    assert MessageRecord("x").to_email()["subject"] == "(No Subject)"
+
+
+def test_records_use_less_memory_than_dicts():
+    """Memory benchmark: 20k slot records vs the flat list_emails dicts (strings are shared by both)."""
+    messages = [gmail_message(i) for i in range(20_000)]
+
+    dict_bytes, _ = measure(dict_record, messages)
+    record_bytes, _ = measure(MessageRecord.from_message, messages)
+
+    # About 74% (4.0 vs 5.4 MiB), although records also keep the labels, date and size.
+    assert record_bytes < dict_bytes * 0.8
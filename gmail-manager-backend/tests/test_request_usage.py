@@ -0,0 +1,87 @@
+import contextvars
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import src.main as main
+from src import request_usage
+from src.client_pool import GmailClientPool
+from src.fake_gmail import FakeGmailServer, FakeHttp, FakeMailbox
+from src.gmail_service import GmailService
+from src.result_cache import ResultCache
+
+
+@pytest.fixture
+def fake_client():
+    server = FakeGmailServer(FakeMailbox(size=1000, seed=2))
+    gmail = GmailService()
+    gmail.metadata_store = None
+    gmail.quota.reconfigure(10 ** 9)  # No quota pacing: these tests count calls, not time
+    gmail.client_pool = GmailClientPool(api_root="http://fake-gmail", anonymous=True,
+                                        http_factory=lambda: FakeHttp(server))
+    with patch.object(main, "gmail_service", gmail), \
+            patch.object(main, "dashboard_cache", ResultCache(ttl=60, max_age=3600)):
+        yield TestClient(main.app), server
+
+
+def test_usage_charges_calls_against_the_budget():
+    usage = request_usage.RequestUsage(budget=5)
+    usage.charge()
+    usage.charge(4, batch=True)
+    with pytest.raises(request_usage.GmailCallBudgetExceeded):
+        usage.charge()
+
+    headers = usage.headers()
+    assert headers["X-Gmail-Calls"] == "5" and headers["X-Gmail-Batch-Calls"] == "4"
+    assert 'gmail;dur=0.0;desc="5 calls, 1 batches"' in headers["Server-Timing"]
+    assert headers["X-Gmail-Budget-Exceeded"] == "true"
+    assert request_usage.parse_budgets(" /dashboard/full=300, /emails=50,") == {"/dashboard/full": 300, "/emails": 50}
+
+
+def test_responses_report_gmail_usage(fake_client):
+    client, server = fake_client
+
+    response = client.get("/dashboard/full")
+
+    assert response.status_code == 200
+    # The subject sample is hydrated by metadata fetcher threads; their batches count too.
+    assert response.headers["X-Gmail-Calls"] == str(server.stats["calls"])
+    assert response.headers["X-Gmail-Batch-Calls"] == "200"
+    assert int(response.headers["X-Gmail-Bytes"]) > 0
+    assert response.headers["Server-Timing"].startswith("total;dur=")
+    assert "X-Gmail-Budget-Exceeded" not in response.headers
+
+
+def test_budget_degrades_or_aborts(fake_client):
+    client, server = fake_client
+
+    with patch.dict(main.call_budgets, {"/dashboard/full": 20}):
+        degraded = client.get("/dashboard/full")
+        assert degraded.status_code == 200 and degraded.json()["subjects"] == []
+        assert degraded.headers["X-Gmail-Budget-Exceeded"] == "true"
+        assert int(degraded.headers["X-Gmail-Calls"]) <= 20
+
+        with patch.object(main, "GMAIL_CALL_BUDGET_MODE", "abort"):
+            aborted = client.get("/dashboard/full")
+        assert aborted.status_code == 503
+        assert aborted.headers["X-Gmail-Call-Budget"] == "20"
+    assert server.stats["by_method"].get("messages.get", 0) == 0
+
+
+def test_calls_over_the_budget_take_no_quota(mock_google_service):
+    gmail = GmailService()
+    gmail.client_pool.get = lambda: mock_google_service
+    request = mock_google_service.users().labels().list(userId='me')
+
+    def over_budget():
+        usage = request_usage.start(budget=1)
+        gmail._execute(request)
+        taken = gmail.quota.metrics()["units_total"]
+        with pytest.raises(request_usage.GmailCallBudgetExceeded):
+            gmail._execute(request)
+        return usage, taken
+
+    # In a copied context, so the usage does not leak into other tests.
+    usage, taken = contextvars.copy_context().run(over_budget)
+    assert usage.calls == 1 and gmail.quota.metrics()["units_total"] == taken
@@ -0,0 +1,98 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.result_cache import ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def counting(value="v"):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return f"{value}{len(calls)}"
+    return compute, calls
+
+
+def test_serves_fresh_then_stale_while_refreshing():
+    clock = Clock()
+    cache = ResultCache(ttl=10, max_age=100, clock=clock)
+    compute, calls = counting()
+
+    assert cache.get("k", compute) == ("v1", 1000.0, False)
+    clock.now += 5
+    assert cache.get("k", compute) == ("v1", 1000.0, False)
+
+    clock.now += 10
+    assert cache.get("k", compute) == ("v1", 1000.0, True)  # Served at once...
+    cache._executor.shutdown(wait=True)  # ...and refreshed in the background.
+    assert len(calls) == 2 and cache.lookup("k", compute) == ("v2", 1015.0, False)
+
+    clock.now += 200
+    assert cache.lookup("k", compute) is None
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache(ttl=10, max_age=100)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"total": 1}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(cache.get, "k", compute)
+        started.wait(5)
+        others = [pool.submit(cache.get, "k", compute) for _ in range(3)]
+        release.set()
+        results = [first.result()] + [f.result() for f in others]
+
+    assert len(calls) == 1
+    assert all(result[0] == {"total": 1} for result in results)
+
+
+def test_mark_stale_covers_computations_in_progress():
+    cache = ResultCache(ttl=10, max_age=100)
+    compute, calls = counting()
+    cache.get("a", compute)
+
+    def modified_while_computing():
+        cache.mark_stale()
+        return "b"
+
+    assert cache.get("b", modified_while_computing)[2] is True
+    assert cache.lookup("a", compute)[2] is True
+    cache._executor.shutdown(wait=True)
+    value, _, stale = cache.lookup("a", compute)
+    assert value == "v2" and not stale
+
+
+def test_failed_computations_are_not_cached():
+    clock = Clock()
+    cache = ResultCache(ttl=10, max_age=100, clock=clock)
+    compute, calls = counting()
+
+    def failing():
+        raise RuntimeError("Gmail unavailable")
+
+    with pytest.raises(RuntimeError):
+        cache.get("k", failing)
+    assert cache.lookup("k", compute) is None
+    assert cache.get("k", compute) == ("v1", 1000.0, False)
+
+    clock.now += 15  # A failed background refresh keeps the previous result.
+    assert cache.get("k", failing) == ("v1", 1000.0, True)
+    cache._executor.shutdown(wait=True)
+    assert cache._entries["k"][0] == "v1" and calls == [1]
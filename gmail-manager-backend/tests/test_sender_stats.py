@@ -0,0 +1,143 @@
+import sqlite3
+
+import pytest
+
+from src.metadata_store import MetadataStore, HIDDEN_LABELS
+from src.sender_stats import SenderAggregator, aggregate_keys, label_key, parse_sender
+
+
+def make_row(msg_id, labels, sender="Shop <news@shop.com>", internal_date=0, size=100):
+    return {
+        "id": msg_id, "thread_id": f"t{msg_id}", "label_ids": labels,
+        "subject": "Hello", "sender": sender, "date": "", "snippet": "",
+        "internal_date": internal_date, "size_estimate": size,
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = MetadataStore(str(tmp_path / "metadata.db"))
+    yield s
+    s.close()
+
+
+def by_key(stats):
+    return {stat['key']: stat for stat in stats}
+
+
+def test_parse_sender_normalizes_address_and_domain():
+    assert parse_sender("Shop News <News@Shop.COM>") == ("news@shop.com", "Shop News", "shop.com")
+    assert parse_sender("bob@example.org") == ("bob@example.org", "", "example.org")
+    assert parse_sender("") == ("", "", "")
+
+
+def test_aggregate_keys_follow_messages_list_semantics():
+    assert aggregate_keys(['INBOX', 'CATEGORY_PROMOTIONS', 'UNREAD'], HIDDEN_LABELS) == [
+        '*', 'CATEGORY_PROMOTIONS', 'INBOX', 'UNREAD', 'CATEGORY_PROMOTIONS&INBOX'
+    ]
+    assert aggregate_keys(['TRASH', 'INBOX'], HIDDEN_LABELS) == ['TRASH']
+    assert label_key(['INBOX', 'CATEGORY_PROMOTIONS']) == 'CATEGORY_PROMOTIONS&INBOX'
+    assert label_key(['Label_1', 'Label_2']) is None
+
+
+def test_sender_stats_aggregate_count_unread_dates_and_bytes(store):
+    store.upsert_messages([
+        make_row("1", ["INBOX", "CATEGORY_PROMOTIONS", "UNREAD"], internal_date=1000, size=10),
+        make_row("2", ["INBOX", "CATEGORY_PROMOTIONS"], internal_date=3000, size=20),
+        make_row("3", ["INBOX", "CATEGORY_PROMOTIONS", "UNREAD"], sender="bob@other.org", internal_date=2000),
+        make_row("4", ["INBOX", "CATEGORY_PERSONAL"], internal_date=5000),
+    ])
+    stats = store.sender_stats(["INBOX", "CATEGORY_PROMOTIONS"])
+    assert [stat['key'] for stat in stats] == ["news@shop.com", "bob@other.org"]
+    shop = stats[0]
+    assert (shop['count'], shop['unread_count'], shop['unread_ratio'], shop['estimated_bytes']) == (2, 1, 0.5, 30)
+    assert shop['name'] == "Shop"
+    assert shop['newest_date'].startswith("1970-01-01T00:00:03")
+    assert shop['oldest_date'].startswith("1970-01-01T00:00:01")
+
+    assert by_key(store.sender_stats(["INBOX"]))["news@shop.com"]['count'] == 3
+    assert store.sender_stats(["INBOX", "CATEGORY_PROMOTIONS"], sort="unread_ratio")[0]['key'] == "bob@other.org"
+    domains = by_key(store.sender_stats([], group_by="domain"))
+    assert domains["shop.com"]['count'] == 3 and domains["other.org"]['unread_count'] == 1
+
+
+def test_sender_stats_follow_label_changes_and_deletions(store):
+    store.upsert_messages([
+        make_row("1", ["INBOX", "UNREAD"], internal_date=1000),
+        make_row("2", ["INBOX", "UNREAD"], internal_date=3000),
+    ])
+    store.apply_label_delta(["1"], remove_label_ids=["UNREAD"])
+    assert store.sender_stats(["INBOX"])[0]['unread_count'] == 1
+
+    # Archiving the newest message must pull the newest date back.
+    store.set_labels({"2": ["UNREAD"]})
+    inbox = store.sender_stats(["INBOX"])[0]
+    assert inbox['count'] == 1 and inbox['newest_date'].startswith("1970-01-01T00:00:01")
+
+    store.delete_messages(["1"])
+    assert store.sender_stats(["INBOX"]) == []
+    assert store.sender_stats(["UNREAD"])[0]['count'] == 1
+
+    store.set_labels({"2": ["TRASH"]})
+    assert store.sender_stats([]) == []
+    assert store.sender_stats(["TRASH"])[0]['count'] == 1
+
+
+def test_incremental_aggregates_match_a_full_rebuild(store):
+    store.upsert_messages([
+        make_row(str(i), ["INBOX", "UNREAD"] if i % 3 else ["INBOX", "Label_1"],
+                 sender=f"user{i % 4}@d{i % 2}.com", internal_date=i * 1000, size=i)
+        for i in range(40)
+    ])
+    store.apply_label_delta([str(i) for i in range(0, 40, 5)], add_label_ids=["Label_1"], remove_label_ids=["INBOX"])
+    store.delete_messages([str(i) for i in range(0, 40, 7)])
+    store.upsert_messages([make_row("3", ["TRASH"], sender="late@d9.com", internal_date=99000)])
+
+    def snapshot():
+        return {
+            (key, group_by): store.sender_stats(labels, group_by=group_by, limit=1000)
+            for key, labels in [("all", []), ("inbox", ["INBOX"]), ("label", ["Label_1"]), ("trash", ["TRASH"])]
+            for group_by in ("address", "domain")
+        }
+
+    incremental = snapshot()
+    conn = store._connect()
+    with conn:
+        store._rebuild_sender_stats(conn)
+    assert snapshot() == incremental
+    # Label combinations without their own aggregate are grouped on the fly.
+    combined = store.sender_stats(["INBOX", "UNREAD"], limit=1000)
+    assert sum(stat['count'] for stat in combined) == store.count(["INBOX", "UNREAD"])
+    assert all(stat['unread_ratio'] == 1.0 for stat in combined)
+
+
+def test_existing_database_is_migrated(tmp_path):
+    db_path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE messages (id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, label_ids TEXT NOT NULL DEFAULT '[]',
+            subject TEXT, sender TEXT, date TEXT, snippet TEXT, internal_date INTEGER NOT NULL DEFAULT 0,
+            size_estimate INTEGER NOT NULL DEFAULT 0);
+        INSERT INTO messages VALUES ('1', 't1', '["INBOX"]', 'Hi', 'Bob <Bob@Example.com>', '', '', 5, 7);
+    """)
+    conn.close()
+
+    store = MetadataStore(db_path)
+    try:
+        stats = store.sender_stats(["INBOX"])
+        assert stats[0]['key'] == "bob@example.com" and stats[0]['estimated_bytes'] == 7
+    finally:
+        store.close()
+
+
+def test_sender_aggregator_groups_streamed_messages():
+    aggregator = SenderAggregator(group_by="domain")
+    aggregator.add("A <a@x.com>", ("INBOX", "UNREAD"), 1000, 5)
+    aggregator.add("b@x.com", ("INBOX",), 2000, 5)
+    aggregator.add("c@y.com", ("INBOX",), 3000, 1)
+    top = aggregator.top("count", 1)
+    assert top == [{
+        "key": "x.com", "name": "", "domain": "x.com", "count": 2, "unread_count": 1, "unread_ratio": 0.5,
+        "newest_date": "1970-01-01T00:00:02+00:00", "oldest_date": "1970-01-01T00:00:01+00:00",
+        "estimated_bytes": 10,
+    }]
@@ -0,0 +1,68 @@
+import random
+from collections import Counter
+from unittest.mock import MagicMock, patch
+from src.gmail_service import GmailService
+from src.records import MessageRecord
+from src.subjects import normalize_subject, SpaceSaving, SubjectAggregator
+
+
+def test_normalize_subject_collapses_near_duplicates():
+    assert normalize_subject("RE: Fwd: Order #1234 shipped") == normalize_subject("Order #98 shipped")
+    assert normalize_subject("Re[2]: [JIRA-123] Build failed") == "# Build failed"
+    assert normalize_subject("Ticket: 55123 updated") == "Ticket # updated"
+    assert normalize_subject("Your code is 483920") == "Your code is #"
+    assert normalize_subject("") == "(No Subject)"
+    assert normalize_subject("Weekly digest") == "Weekly digest"
+
+
+def test_space_saving_keeps_heavy_hitters_with_bounded_memory():
+    rng = random.Random(7)
+    stream = ["heavy-a"] * 3000 + ["heavy-b"] * 2000 + [f"rare-{rng.randrange(20000)}" for _ in range(20000)]
+    rng.shuffle(stream)
+    sketch = SpaceSaving(capacity=100)
+    for key in stream:
+        sketch.add(key)
+
+    exact = Counter(stream)
+    top = sketch.most_common(2)
+    assert [key for key, _ in top] == ["heavy-a", "heavy-b"]
+    for key, count in top:
+        assert exact[key] <= count <= exact[key] + sketch.error(key)
+    assert len(sketch.counts) == 100
+
+
+def test_aggregator_exact_and_normalized():
+    subjects = ["Re: Invoice 1", "Invoice 2", "Hello", None]
+    assert SubjectAggregator().add_all(subjects).top() == [
+        {"subject": "Re: Invoice 1", "count": 1}, {"subject": "Invoice 2", "count": 1},
+        {"subject": "Hello", "count": 1}, {"subject": "(No Subject)", "count": 1},
+    ]
+    assert SubjectAggregator(normalize=True).add_all(subjects).top(1) == [{"subject": "Invoice #", "count": 2}]
+
+
+def test_exact_mode_streams_the_whole_label_from_gmail():
+    gmail = GmailService()
+    gmail.metadata_store = None
+    pages = [[str(i) for i in range(500)], [str(i) for i in range(500, 700)]]
+    subjects = {str(i): f"Newsletter #{i}" if i % 2 else "Hi" for i in range(700)}
+    gmail.metadata_fetcher.iter_records = MagicMock(
+        side_effect=lambda ids, headers: (MessageRecord(i, subject=subjects[i]) for i in ids)
+    )
+
+    with patch.object(gmail, '_iter_id_pages', return_value=iter(pages)):
+        counts = gmail.get_subject_counts(['INBOX'], mode="exact", normalize=True, top=5)
+
+    assert counts == [{"subject": "Hi", "count": 350}, {"subject": "Newsletter #", "count": 350}]
+
+
+def test_sample_mode_stops_after_limit():
+    gmail = GmailService()
+    gmail.metadata_store = None
+    gmail.metadata_fetcher.iter_records = MagicMock(
+        side_effect=lambda ids, headers: (MessageRecord(i, subject="Hi") for i in ids)
+    )
+
+    with patch.object(gmail, '_iter_id_pages', return_value=iter([[str(i) for i in range(500)]] * 3)):
+        counts = gmail.get_subject_counts(['INBOX'], limit=200)
+
+    assert counts == [{"subject": "Hi", "count": 200}]
@@ -31,16 +31,42 @@ import { Progress } from '@/components/ui/progress'
 
 
 const API_BASE = '/api'
-const BATCH_CHUNK_SIZE = 20; // Number of emails to process per frontend request
+const JOB_POLL_INTERVAL_MS = 1000; // How often to poll a background job's progress
 
 interface EmailResponse {
   emails: any[]
   next_page_token?: string
   total_estimate?: number
+  total_is_exact?: boolean
+  count_fingerprint?: string
 }
 
-interface EmailIdListResponse {
-    ids: string[]
+interface EmailCountResponse {
+  fingerprint: string
+  count: number | null
+  exact: boolean
+  status: 'pending' | 'done'
+}
+
+interface BatchActionResponse {
+    action: string
+    total: number
+    succeeded: string[]
+    succeeded_count: number
+    failed: { id: string, error: string }[]
+}
+
+interface JobResponse {
+    id: string
+    kind: string
+    status: 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled'
+    processed: number
+    failed: number
+    total: number | null
+    throughput: number | null
+    eta_seconds: number | null
+    error: string | null
+    result: any
 }
 
 interface Label {
@@ -87,7 +113,8 @@ function HomeContent() {
   const [selectedEmailId, setSelectedEmailId] = useState<string | null>(null)
   const [allLabels, setAllLabels] = useState<Label[]>([]);
   const [showArchiveConfirm, setShowArchiveConfirm] = useState(false);
-  const [idsToArchive, setIdsToArchive] = useState<string[] | null>(null);
+  // What the archive prompt acts on: the labelled IDs, or (ids null) every matching email received before the label job
+  const [archiveTarget, setArchiveTarget] = useState<{ ids: string[] | null, receivedBefore: number } | null>(null);
   const [selectedEmailSubjects, setSelectedEmailSubjects] = useState<string[]>([]);
   const [progress, setProgress] = useState<ProgressState | null>(null);
   
@@ -133,8 +160,33 @@ function HomeContent() {
   }, [getApiFilters, currentPageIndex, pageTokens, itemsPerPage]);
 
 
+  // Fingerprint of the count we are currently waiting for; cleared when the listing changes
+  const countPollRef = useRef<string | null>(null)
+
+  // Long-polls the backend for the exact total while it is counted in the background
+  const pollExactTotal = useCallback(async (fingerprint: string) => {
+    countPollRef.current = fingerprint
+    while (countPollRef.current === fingerprint) {
+      try {
+        const res = await fetch(`${API_BASE}/emails/count?fingerprint=${fingerprint}&wait=20`)
+        if (!res.ok) return
+        const data: EmailCountResponse = await res.json()
+        if (data.status === 'done') {
+          if (countPollRef.current === fingerprint && data.count !== null) {
+            setTotalEstimate(data.count)
+          }
+          return
+        }
+      } catch (error) {
+        console.error('Failed to fetch exact email count:', error)
+        return
+      }
+    }
+  }, [])
+
   const fetchEmails = useCallback(async (tokenOverride?: string) => {
     if (currentView !== 'emails') return;
+    countPollRef.current = null
     setLoading(true)
     // Don't clear selection if we are just navigating pages and "Select All Matching" is active
     // But standard behavior is usually to clear on page change unless "All Matching" is set.
@@ -145,12 +197,16 @@ function HomeContent() {
     
     try {
       const queryString = buildQueryParams(tokenOverride);
-      const response = await fetch(`${API_BASE}/emails?${queryString}`)
+      // Warm the listed emails' content in the background so opening one is instant
+      const response = await fetch(`${API_BASE}/emails?${queryString}&prefetch=true`)
       if (response.ok) {
         const data: EmailResponse = await response.json()
         setEmails(data.emails || [])
         setTotalEstimate(data.total_estimate || 0)
         setNextPageToken(data.next_page_token || null)
+        if (data.total_is_exact === false && data.count_fingerprint) {
+          pollExactTotal(data.count_fingerprint)
+        }
       }
     } catch (error) {
       console.error('Failed to fetch emails:', error)
@@ -160,13 +216,20 @@ function HomeContent() {
     } finally {
       setLoading(false)
     }
-  }, [currentView, buildQueryParams, isAllMatchingSelected]);
+  }, [currentView, buildQueryParams, isAllMatchingSelected, pollExactTotal]);
 
   // Trigger fetch on dependency changes
   useEffect(() => {
     fetchEmails();
   }, [currentPageIndex, itemsPerPage, selection, currentFilters]); // Removed fetchEmails from dependency to avoid loops, rely on explicit deps
 
+  // Stop warming email content once the user leaves the list view
+  useEffect(() => {
+    if (currentView !== 'emails') {
+      fetch(`${API_BASE}/emails/prefetch/cancel`, { method: 'POST' }).catch(() => {});
+    }
+  }, [currentView]);
+
   useEffect(() => {
     const fetchAllLabels = async () => {
         setLoadingLabels(true);
@@ -248,60 +311,66 @@ function HomeContent() {
       setSelectedEmails(new Set());
   }
   
-  // Generic helper to chunk operations on the frontend
+  // Runs a batch action server-side on `ids`, or on every email matching the current filters
+  // (narrowed by `extraFilters`) when null
+  const runBatchJob = async (baseBody: any, description: string, ids: string[] | null, extraFilters: any = {}): Promise<BatchActionResponse> => {
+    const body = ids
+        ? { ...baseBody, ids, select_all_matching: false }
+        : { ...baseBody, select_all_matching: true, query_params: { ...getApiFilters(), ...extraFilters } };
+    setProgress({ current: 0, total: ids?.length ?? 0, message: `${description} (${ids ? `0/${ids.length}` : 'all matching emails'})...` });
+    // Runs as a background job on the server; poll it for progress
+    const res = await fetch(`${API_BASE}/actions/batch?background=true`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    if (!res.ok) throw new Error(`Batch action failed (${res.status})`);
+    let job: JobResponse = await res.json();
+    while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        const pollRes = await fetch(`${API_BASE}/jobs/${job.id}`);
+        if (!pollRes.ok) throw new Error(`Job status failed (${pollRes.status})`);
+        job = await pollRes.json();
+        const total = job.total ?? 0;
+        setProgress({ current: job.processed, total, message: `${description} (${job.processed}/${total || '?'})` });
+    }
+    if (job.status !== 'succeeded' || !job.result) throw new Error(job.error || `Batch job ${job.status}`);
+    const data: BatchActionResponse = job.result;
+    if (data.failed.length > 0) {
+        toast({ variant: "destructive", title: "Partial failure", description: `${data.failed.length} of ${data.total} emails could not be processed.${selectedEmailId ? '' : ' They are still selected so you can retry.'}` });
+    }
+    return data;
+  }
+
+  // Leaves only the emails that failed selected, so the action can be retried on them
+  const keepFailedSelected = (data: BatchActionResponse) => {
+      setIsAllMatchingSelected(false);
+      setSelectedEmails(new Set(data.failed.map(f => f.id)));
+  }
+
+  // Generic helper for batch actions on the selection (or on all matching emails)
   const processBatchOperation = async (
       action: string, 
       baseBody: any, 
       description: string, 
-      targetIds: string[] | null
+      targetIds: string[] | null,
+      extraFilters: any = {}
     ) => {
     setLoading(true);
     
     try {
-        let idsToProcess: string[] = [];
-
-        if (isAllMatchingSelected) {
-            setProgress({ current: 0, total: 0, message: `Retrieving list of emails...` });
-            
-            // Fetch all IDs from backend first
-            const params = new URLSearchParams();
-            const apiFilters = getApiFilters();
-            Object.entries(apiFilters).forEach(([key, value]) => {
-                if (value) params.append(key, String(value));
-            });
-            
-            const res = await fetch(`${API_BASE}/emails/ids?${params.toString()}`);
-            if (!res.ok) throw new Error("Failed to fetch email IDs");
-            const data: EmailIdListResponse = await res.json();
-            idsToProcess = data.ids;
-        } else if (targetIds) {
-            idsToProcess = targetIds;
-        }
-
-        if (idsToProcess.length > 0) {
-            const total = idsToProcess.length;
-            let processed = 0;
-            setProgress({ current: 0, total, message: `${description} (0/${total})` });
+        // The backend streams every matching ID into the batch pipeline itself when all matching are selected
+        const ids = isAllMatchingSelected ? null : targetIds;
+        if (!ids && !isAllMatchingSelected) return;
+        const data = await runBatchJob(baseBody, description, ids, extraFilters);
 
-            for (let i = 0; i < total; i += BATCH_CHUNK_SIZE) {
-                const chunk = idsToProcess.slice(i, i + BATCH_CHUNK_SIZE);
-                const body = { ...baseBody, ids: chunk, select_all_matching: false };
-                
-                await fetch(`${API_BASE}/actions/batch`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(body)
-                });
-                
-                processed += chunk.length;
-                setProgress({ current: processed, total, message: `${description} (${processed}/${total})` });
-            }
-        }
-
-        toast({ title: "Success", description: "Action completed successfully." });
-        
         // Cleanup
-        if (!selectedEmailId) handleClearSelection(); // Don't clear if single view
+        if (data.failed.length === 0) {
+            toast({ title: "Success", description: "Action completed successfully." });
+            if (!selectedEmailId) handleClearSelection(); // Don't clear if single view
+        } else if (!selectedEmailId) {
+            keepFailedSelected(data);
+        }
         await fetchEmails();
         
     } catch (error) {
@@ -333,51 +402,23 @@ function HomeContent() {
     setLoading(true);
     
     try {
-        let idsToProcess: string[] = [];
-
-        if (isAllMatchingSelected) {
-            setProgress({ current: 0, total: 0, message: `Retrieving list of emails...` });
-            const params = new URLSearchParams();
-            const apiFilters = getApiFilters();
-            Object.entries(apiFilters).forEach(([key, value]) => {
-                if (value) params.append(key, String(value));
-            });
-            const res = await fetch(`${API_BASE}/emails/ids?${params.toString()}`);
-            if (!res.ok) throw new Error("Failed to fetch email IDs");
-            const data: EmailIdListResponse = await res.json();
-            idsToProcess = data.ids;
-        } else {
-            idsToProcess = ids;
-        }
-        
-        if (idsToProcess.length > 0) {
-            const total = idsToProcess.length;
-            let processed = 0;
-            setProgress({ current: 0, total, message: `Assigning labels (0/${total})` });
-
-            for (let i = 0; i < total; i += BATCH_CHUNK_SIZE) {
-                const chunk = idsToProcess.slice(i, i + BATCH_CHUNK_SIZE);
-                const body = { 
-                    action: 'assign_labels', 
-                    add_label_names: labels,
-                    ids: chunk, 
-                    select_all_matching: false 
-                };
-                
-                await fetch(`${API_BASE}/actions/batch`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(body)
-                });
-                processed += chunk.length;
-                setProgress({ current: processed, total, message: `Assigning labels (${processed}/${total})` });
-            }
-        }
-
+        // Labels are assigned server-side. On "all matching" the server does not return the IDs,
+        // so the follow-up archive is limited to emails received before this job started
+        const receivedBefore = Math.floor(Date.now() / 1000);
+        const data = await runBatchJob(
+            { action: 'assign_labels', add_label_names: labels }, 'Assigning labels', isAllMatchingSelected ? null : ids
+        );
+
+      if (data.failed.length > 0) {
+          // No archive prompt until the failed ones are retried
+          if (!selectedEmailId) keepFailedSelected(data);
+          await fetchEmails();
+          return;
+      }
       toast({ title: "Success", description: "Labels assigned." })
-      
-      // Save the IDs we just processed so archive logic knows what to act on
-      setIdsToArchive(idsToProcess);
+
+      // Remember what we just labelled so the archive acts on the same emails
+      setArchiveTarget({ ids: isAllMatchingSelected ? null : ids, receivedBefore });
       setShowArchiveConfirm(true);
       
       // We refresh in background but keep loading state false here (managed by alert dialog now)
@@ -393,25 +434,16 @@ function HomeContent() {
   }
 
   const handleConfirmArchive = async () => {
-      // Re-use the chunk processor logic
-      // Note: idsToArchive contains specific IDs OR is empty array (if all matching was true)
-      // But processBatchOperation logic for 'all matching' relies on the current `isAllMatchingSelected` state
-      // which is still valid here.
-      
-      // If we are in single view (selectedEmailId exists), isAllMatchingSelected is likely false.
-      // idsToArchive handles the list correctly.
-      
       // Close dialog first
       setShowArchiveConfirm(false);
-      
-      // If idsToArchive is empty and NOT all matching, it means empty selection which shouldn't happen.
-      // If idsToArchive is empty AND all matching is true, we pass null/empty IDs and rely on state.
-      
-      const ids = (idsToArchive && idsToArchive.length > 0) ? idsToArchive : null;
-      // Note: We don't need to check isAllMatchingSelected here because 
-      // handleAssignLabels already resolved the full list of IDs into idsToArchive.
-      
-      await processBatchOperation('archive', { action: 'archive' }, 'Archiving emails', ids);
+      if (!archiveTarget) return;
+
+      // With explicit IDs, archive exactly those. On "all matching" (still selected here), the server
+      // re-runs the query, so mail that arrived after the labels were assigned is left out by date
+      await processBatchOperation(
+          'archive', { action: 'archive' }, 'Archiving emails', archiveTarget.ids,
+          { received_before: archiveTarget.receivedBefore }
+      );
       
     // Refresh list AFTER archive action
     await fetchEmails();
@@ -12,6 +12,7 @@ interface Email {
   subject: string
   date: string
   body: string
+  body_truncated?: boolean
   is_unread: boolean
 }
 
@@ -141,6 +142,9 @@ export default function EmailContentModal({
               </div>
             </div>
             <div className="flex-1 overflow-auto p-6 bg-background">
+              {email.body_truncated && (
+                <p className="text-xs text-muted-foreground mb-4">This email is very large; only the beginning is shown.</p>
+              )}
               <div
                 className="prose prose-sm dark:prose-invert max-w-none"
                 dangerouslySetInnerHTML={{ __html: DOMPurify.sanitize(email.body) }}